@@ -0,0 +1,158 @@
+# archivos.py
+# Bloqueos entre procesos y escritura atómica de JSON.
+#
+# Con `uvicorn --workers N` cada worker es un proceso con su propio estado en
+# memoria, así que un threading.Lock ya no basta para que dos mutaciones sobre
+# la misma carpeta no se pisen. bloqueo() toma un candado de archivo (flock en
+# Linux/macOS, msvcrt.locking en Windows) por cada clave en CARPETA_BLOQUEOS;
+# también excluye a otros hilos del mismo proceso porque cada toma abre su
+# propio descriptor.
+#
+# Las claves internas ("estructura", "indice.db", "vigilante") y las carpetas
+# de categoría van en espacios separados: una categoría se bloquea con
+# bloqueo_categorias(), que antepone PREFIJO_CATEGORIA, así que una categoría
+# llamada "vigilante" no espera al candado que el vigilante tiene tomado.
+#
+# Orden de toma para no cruzarse: primero "estructura" y después las
+# categorías, todas las de una operación en la misma llamada (se ordenan).
+# Dentro del mismo hilo el bloqueo es reentrante.
+import contextlib
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CARPETA_BLOQUEOS = os.environ.get("FACTURAS_BLOQUEOS_DIR", os.path.join(BASE_DIR, '.bloqueos'))
+
+# Windows no tiene espera bloqueante sin límite: se reintenta cada tanto
+ESPERA_REINTENTO = 0.05
+
+ESTRUCTURA = "estructura"
+PREFIJO_CATEGORIA = "categoria:"
+
+_tomados = threading.local()
+
+
+def _ruta(clave):
+    # Las claves son nombres de categoría (cualquier carácter): el archivo va por hash
+    return os.path.join(CARPETA_BLOQUEOS, hashlib.sha1(clave.encode("utf-8")).hexdigest()[:20] + ".lock")
+
+
+def _tomar(clave, esperar=True):
+    """Descriptor con el candado tomado, o None si esperar=False y lo tiene otro."""
+    os.makedirs(CARPETA_BLOQUEOS, exist_ok=True)
+    fd = os.open(_ruta(clave), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if fcntl is not None:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX if esperar else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                return None
+            return fd
+        while True:
+            try:
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                return fd
+            except OSError:
+                if not esperar:
+                    os.close(fd)
+                    return None
+                time.sleep(ESPERA_REINTENTO)
+    except BaseException:
+        os.close(fd)
+        raise
+
+
+def _soltar(fd):
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        else:
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+    finally:
+        os.close(fd)
+
+
+@contextlib.contextmanager
+def bloqueo(*claves):
+    """Bloqueo exclusivo de las claves entre procesos e hilos, mientras dure el with."""
+    tomados = getattr(_tomados, "claves", None)
+    if tomados is None:
+        tomados = _tomados.claves = set()
+    nuevas = sorted(set(claves) - tomados, key=lambda c: (c != ESTRUCTURA, c.startswith(PREFIJO_CATEGORIA), c))
+    descriptores = []
+    try:
+        for clave in nuevas:
+            descriptores.append(_tomar(clave))
+            tomados.add(clave)
+        yield
+    finally:
+        for clave, fd in zip(reversed(nuevas[:len(descriptores)]), reversed(descriptores)):
+            tomados.discard(clave)
+            _soltar(fd)
+
+
+def bloqueo_categorias(*categorias):
+    """bloqueo() de las carpetas de esas categorías."""
+    return bloqueo(*(PREFIJO_CATEGORIA + c for c in categorias))
+
+
+class Exclusivo:
+    """
+    Candado que un proceso conserva mientras vive (p. ej. un solo vigilante
+    entre todos los workers). Se suelta con soltar() o al terminar el proceso.
+    """
+
+    def __init__(self, clave):
+        self._clave = clave
+        self._fd = _tomar(clave, esperar=False)
+
+    @property
+    def tomado(self):
+        return self._fd is not None
+
+    def soltar(self, borrar=False):
+        """Suelta el candado; con borrar=True también quita su archivo (claves de un solo uso)."""
+        if self._fd is not None:
+            if borrar:
+                try:
+                    os.remove(_ruta(self._clave))
+                except OSError:
+                    pass
+            _soltar(self._fd)
+            self._fd = None
+
+
+def escribir_json(ruta, datos, **opciones):
+    """
+    Escribe a un temporal oculto en la misma carpeta y lo cambia de un golpe
+    por `ruta`: otro proceso lee el archivo anterior o el nuevo, nunca uno a
+    medias. El temporal no tiene extensión de factura, así que no se indexa.
+    """
+    opciones.setdefault("ensure_ascii", False)
+    opciones.setdefault("indent", 2)
+    carpeta, nombre = os.path.split(ruta)
+    fd, temporal = tempfile.mkstemp(prefix=f".{nombre}.", suffix=".tmp", dir=carpeta or ".")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(datos, f, **opciones)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporal, ruta)
+    except BaseException:
+        try:
+            os.remove(temporal)
+        except OSError:
+            pass
+        raise
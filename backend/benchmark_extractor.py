@@ -0,0 +1,188 @@
+# benchmark_extractor.py
+# Mide el extractor sobre un corpus sintético de CFDIs (ver corpus_sintetico.py).
+#
+# Uso:
+#   python benchmark_extractor.py                       # genera el corpus si falta y mide
+#   python benchmark_extractor.py --guardar base.json   # guarda el resultado como línea base
+#   python benchmark_extractor.py --comparar base.json  # compara contra una línea base
+#
+# Reporta latencia por archivo (p50/p90/p99/máx), archivos por segundo, RSS
+# pico del proceso y el porcentaje de aciertos por campo contra los valores
+# esperados del manifiesto. Todo corre local, sin red.
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import corpus_sintetico
+from extractor import extraer_datos_infalible, EXTRACTOR_VERSION
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+CARPETA_CORPUS = os.path.join(tempfile.gettempdir(), "facturas_corpus_sintetico")
+
+
+def _percentil(valores, p):
+    """Percentil con interpolación lineal sobre una lista ya ordenada."""
+    if not valores:
+        return None
+    pos = (len(valores) - 1) * p / 100
+    bajo = int(pos)
+    alto = min(bajo + 1, len(valores) - 1)
+    return valores[bajo] + (valores[alto] - valores[bajo]) * (pos - bajo)
+
+
+def _rss_pico_mb():
+    if resource is None:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reporta KiB; macOS, bytes
+    if sys.platform == "darwin":
+        return pico / (1024 * 1024)
+    return pico / 1024
+
+
+def _normalizar(campo, valor):
+    if valor is None:
+        return None
+    if campo in ("subtotal", "total_deducciones", "total_neto"):
+        try:
+            return f"{float(str(valor).replace(',', '')):.2f}"
+        except ValueError:
+            return str(valor)
+    return " ".join(str(valor).split()).upper()
+
+
+def preparar_corpus(carpeta, cantidad, semilla):
+    """Reutiliza el corpus si ya existe con la misma versión, semilla y tamaño; si no, lo genera."""
+    try:
+        manifiesto = corpus_sintetico.cargar_manifiesto(carpeta)
+        if (
+            manifiesto.get("version") == corpus_sintetico.VERSION_CORPUS
+            and manifiesto.get("semilla") == semilla
+            and len(manifiesto["archivos"]) == cantidad
+        ):
+            return manifiesto
+    except (OSError, ValueError):
+        pass
+    print(f"Generando corpus sintético de {cantidad} PDFs en {carpeta}...")
+    return corpus_sintetico.generar_corpus(carpeta, cantidad=cantidad, semilla=semilla)
+
+
+def medir(carpeta, manifiesto, repeticiones=1, calentamiento=3):
+    archivos = sorted(manifiesto["archivos"])
+
+    # Las primeras extracciones pagan imports perezosos de pdfplumber/pdfminer
+    for nombre in archivos[:calentamiento]:
+        extraer_datos_infalible(os.path.join(carpeta, nombre))
+
+    latencias = []
+    por_backend = {}
+    aciertos = {}
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        for nombre in archivos:
+            t0 = time.perf_counter()
+            datos = extraer_datos_infalible(os.path.join(carpeta, nombre))
+            latencias.append(time.perf_counter() - t0)
+            backend = str(datos.get("backend_texto"))
+            por_backend[backend] = por_backend.get(backend, 0) + 1
+
+            verdad = manifiesto["archivos"][nombre]
+            for campo, esperado in verdad.items():
+                if campo in ("tipo", "paginas"):
+                    continue
+                clave = f"{verdad['tipo']}.{campo}"
+                ok, total = aciertos.get(clave, (0, 0))
+                acierto = _normalizar(campo, datos.get(campo)) == _normalizar(campo, esperado)
+                aciertos[clave] = (ok + acierto, total + 1)
+    duracion = time.perf_counter() - inicio
+
+    latencias.sort()
+    ms = lambda s: round(s * 1000, 3) if s is not None else None
+    return {
+        "extractor_version": EXTRACTOR_VERSION,
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "archivos": len(archivos),
+        "repeticiones": repeticiones,
+        "latencia_ms": {
+            "p50": ms(_percentil(latencias, 50)),
+            "p90": ms(_percentil(latencias, 90)),
+            "p99": ms(_percentil(latencias, 99)),
+            "max": ms(latencias[-1] if latencias else None),
+            "media": ms(sum(latencias) / len(latencias) if latencias else None),
+        },
+        "archivos_por_segundo": round(len(latencias) / duracion, 2) if duracion else None,
+        "backend_texto": por_backend,
+        "rss_pico_mb": round(_rss_pico_mb(), 1) if resource is not None else None,
+        "aciertos": {
+            clave: round(ok / total, 4) for clave, (ok, total) in sorted(aciertos.items())
+        },
+    }
+
+
+def imprimir(resultado, base=None):
+    def delta(actual, anterior, menor_es_mejor=True):
+        if base is None or actual is None or not anterior:
+            return ""
+        cambio = (actual - anterior) / anterior * 100
+        mejora = cambio < 0 if menor_es_mejor else cambio > 0
+        return f"  ({cambio:+.1f}% {'mejor' if mejora else 'peor'})"
+
+    lat = resultado["latencia_ms"]
+    lat_base = (base or {}).get("latencia_ms", {})
+    print(f"\nExtractor v{resultado['extractor_version']} - {resultado['archivos']} archivos x {resultado['repeticiones']}")
+    for clave in ("p50", "p90", "p99", "max", "media"):
+        print(f"  {clave:>6}: {lat[clave]:9.2f} ms{delta(lat[clave], lat_base.get(clave))}")
+    print(f"  archivos/s: {resultado['archivos_por_segundo']}"
+          f"{delta(resultado['archivos_por_segundo'], (base or {}).get('archivos_por_segundo'), menor_es_mejor=False)}")
+    if resultado["rss_pico_mb"] is not None:
+        print(f"  RSS pico: {resultado['rss_pico_mb']} MB"
+              f"{delta(resultado['rss_pico_mb'], (base or {}).get('rss_pico_mb'))}")
+
+    print(f"  backend de texto: {resultado['backend_texto']}")
+    print("  Aciertos por campo:")
+    aciertos_base = (base or {}).get("aciertos", {})
+    for clave, valor in resultado["aciertos"].items():
+        marca = ""
+        if clave in aciertos_base and valor != aciertos_base[clave]:
+            marca = f"  (antes {aciertos_base[clave] * 100:.1f}%)"
+        print(f"    {clave:<28} {valor * 100:6.1f}%{marca}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del extractor de CFDIs sobre un corpus sintético")
+    parser.add_argument("--corpus", default=CARPETA_CORPUS, help="Carpeta del corpus (se genera si no existe)")
+    parser.add_argument("--cantidad", type=int, default=200, help="Número de PDFs del corpus")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--repeticiones", type=int, default=1)
+    parser.add_argument("--guardar", metavar="JSON", help="Guarda el resultado como línea base")
+    parser.add_argument("--comparar", metavar="JSON", help="Compara contra una línea base guardada")
+    args = parser.parse_args()
+
+    manifiesto = preparar_corpus(args.corpus, args.cantidad, args.semilla)
+
+    base = None
+    if args.comparar:
+        with open(args.comparar, "r", encoding="utf-8") as f:
+            base = json.load(f)
+
+    resultado = medir(args.corpus, manifiesto, repeticiones=args.repeticiones)
+    resultado["semilla"] = args.semilla
+    imprimir(resultado, base)
+
+    if args.guardar:
+        with open(args.guardar, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, ensure_ascii=False, indent=2)
+        print(f"\nLínea base guardada en {args.guardar}")
+
+
+if __name__ == "__main__":
+    main()
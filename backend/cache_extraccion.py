@@ -0,0 +1,228 @@
+# cache_extraccion.py
+# Caché persistente de resultados de extraer_datos_infalible.
+#
+# Los resultados se guardan por hash SHA-256 del contenido del PDF y con la
+# versión del extractor, así que renombrar un archivo (cambio de origen) o
+# moverlo de categoría no obliga a extraerlo de nuevo. Para no leer el archivo
+# completo en cada consulta, se recuerda el hash de cada ruta junto con su
+# tamaño y mtime: si ninguno cambió, se reutiliza el hash guardado.
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import metricas
+from extractor import extraer_datos_infalible, EXTRACTOR_VERSION
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DB = os.path.join(BASE_DIR, 'cache_extraccion.db')
+
+# Número máximo de resultados guardados; al superarlo se descartan los menos usados
+MAX_ENTRADAS = int(os.environ.get("FACTURAS_CACHE_MAX", "20000"))
+
+# No se reescribe la fecha de último uso en cada lectura, solo si es más vieja que esto
+INTERVALO_USO = 60.0
+
+_local = threading.local()
+
+
+def _conexion():
+    """Una conexión por hilo (FastAPI atiende endpoints síncronos en un threadpool)."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(CACHE_DB, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS resultados (
+                hash TEXT PRIMARY KEY,
+                version TEXT NOT NULL,
+                datos TEXT NOT NULL,
+                ultimo_uso REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_resultados_uso ON resultados(ultimo_uso)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS archivos (
+                ruta TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                hash TEXT NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_archivos_hash ON archivos(hash)")
+        conn.commit()
+        _local.conn = conn
+    return conn
+
+
+def hash_archivo(ruta):
+    h = hashlib.sha256()
+    with open(ruta, 'rb') as f:
+        for bloque in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+def _hash_de_ruta(conn, ruta):
+    """Devuelve el hash del contenido, reutilizando el guardado si size/mtime no cambiaron."""
+    st = os.stat(ruta)
+    row = conn.execute(
+        "SELECT size, mtime_ns, hash FROM archivos WHERE ruta = ?", (ruta,)
+    ).fetchone()
+    if row and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+        metricas.cache("hash_ruta", True)
+        return row[2]
+
+    metricas.cache("hash_ruta", False)
+    digest = hash_archivo(ruta)
+    conn.execute(
+        "INSERT OR REPLACE INTO archivos (ruta, size, mtime_ns, hash) VALUES (?, ?, ?, ?)",
+        (ruta, st.st_size, st.st_mtime_ns, digest),
+    )
+    conn.commit()
+    return digest
+
+
+def hash_de_ruta(ruta):
+    return _hash_de_ruta(_conexion(), ruta)
+
+
+def recordar_hash(ruta, digest):
+    """Guarda el hash ya calculado al escribir el archivo (p. ej. en una subida)."""
+    st = os.stat(ruta)
+    conn = _conexion()
+    conn.execute(
+        "INSERT OR REPLACE INTO archivos (ruta, size, mtime_ns, hash) VALUES (?, ?, ?, ?)",
+        (ruta, st.st_size, st.st_mtime_ns, digest),
+    )
+    conn.commit()
+
+
+def buscar(ruta):
+    """Devuelve los datos guardados para el PDF o None si no están en caché."""
+    conn = _conexion()
+    datos = _datos_de_hash(conn, _hash_de_ruta(conn, ruta))
+    metricas.cache("extraccion", datos is not None)
+    return datos
+
+
+def buscar_memo(ruta):
+    """
+    Como buscar(), pero sin leer el archivo: solo responde si el hash de la
+    ruta ya se conoce con el mismo tamaño y mtime (p. ej. recién subido).
+    """
+    st = os.stat(ruta)
+    conn = _conexion()
+    row = conn.execute(
+        "SELECT hash FROM archivos WHERE ruta = ? AND size = ? AND mtime_ns = ?",
+        (ruta, st.st_size, st.st_mtime_ns),
+    ).fetchone()
+    return _datos_de_hash(conn, row[0]) if row else None
+
+
+def _datos_de_hash(conn, digest):
+    row = conn.execute(
+        "SELECT datos, ultimo_uso FROM resultados WHERE hash = ? AND version = ?",
+        (digest, EXTRACTOR_VERSION),
+    ).fetchone()
+    if not row:
+        return None
+
+    ahora = time.time()
+    if ahora - row[1] > INTERVALO_USO:
+        conn.execute("UPDATE resultados SET ultimo_uso = ? WHERE hash = ?", (ahora, digest))
+        conn.commit()
+    return json.loads(row[0])
+
+
+def guardar(ruta, datos):
+    conn = _conexion()
+    digest = _hash_de_ruta(conn, ruta)
+    conn.execute(
+        "INSERT OR REPLACE INTO resultados (hash, version, datos, ultimo_uso) VALUES (?, ?, ?, ?)",
+        (digest, EXTRACTOR_VERSION, json.dumps(datos, ensure_ascii=False), time.time()),
+    )
+    conn.commit()
+    _evictar(conn)
+
+
+def obtener_datos(ruta):
+    """
+    Equivalente a extraer_datos_infalible(ruta) pero leyendo de la caché cuando
+    el contenido ya fue procesado con la versión actual del extractor.
+    """
+    datos = buscar(ruta)
+    if datos is not None:
+        return datos
+    datos, segundos = metricas.medir_extraccion(extraer_datos_infalible, ruta)
+    metricas.extraccion(datos, segundos)
+    if isinstance(datos, Exception):
+        raise datos
+    guardar(ruta, datos)
+    return datos
+
+
+def _evictar(conn):
+    total = conn.execute("SELECT COUNT(*) FROM resultados").fetchone()[0]
+    if total <= MAX_ENTRADAS:
+        return
+    # Se eliminan primero los resultados de versiones anteriores y luego los menos usados
+    conn.execute("DELETE FROM resultados WHERE version != ?", (EXTRACTOR_VERSION,))
+    conn.execute("""
+        DELETE FROM resultados WHERE hash IN (
+            SELECT hash FROM resultados ORDER BY ultimo_uso ASC LIMIT ?
+        )
+    """, (max(0, total - MAX_ENTRADAS),))
+    conn.execute("DELETE FROM archivos WHERE hash NOT IN (SELECT hash FROM resultados)")
+    conn.commit()
+
+
+def _renombrar(conn, ruta_old, ruta_new):
+    conn.execute("UPDATE OR REPLACE archivos SET ruta = ? WHERE ruta = ?", (ruta_new, ruta_old))
+
+
+def _invalidar(conn, ruta):
+    row = conn.execute("SELECT hash FROM archivos WHERE ruta = ?", (ruta,)).fetchone()
+    conn.execute("DELETE FROM archivos WHERE ruta = ?", (ruta,))
+    if row:
+        conn.execute(
+            "DELETE FROM resultados WHERE hash = ? AND NOT EXISTS (SELECT 1 FROM archivos WHERE hash = ?)",
+            (row[0], row[0]),
+        )
+
+
+def renombrar(ruta_old, ruta_new):
+    """
+    El contenido no cambia al renombrar: solo se mueve la ruta recordada. Si
+    la ruta anterior ya no está (el renombrado se aplicó antes) no hace nada.
+    """
+    conn = _conexion()
+    _renombrar(conn, ruta_old, ruta_new)
+    conn.commit()
+
+
+def invalidar(ruta):
+    """
+    Olvida la ruta y, si ningún otro archivo tiene el mismo contenido, también
+    su resultado. Se usa al eliminar o editar (convertir a manual) una factura.
+    """
+    conn = _conexion()
+    _invalidar(conn, ruta)
+    conn.commit()
+
+
+def aplicar_cambios(cambios):
+    """
+    Aplica en orden y en una sola transacción una lista de
+    ("renombrar", ruta_old, ruta_new) / ("invalidar", ruta) (ver /api/lote).
+    """
+    conn = _conexion()
+    for cambio in cambios:
+        if cambio[0] == "renombrar":
+            _renombrar(conn, cambio[1], cambio[2])
+        else:
+            _invalidar(conn, cambio[1])
+    conn.commit()
@@ -0,0 +1,103 @@
+# cfdi_xml.py
+# Lectura directa del XML de un CFDI (3.3 / 4.0, con o sin complemento de nómina).
+#
+# El XML trae exactos todos los campos que extractor.py intenta adivinar del
+# PDF, así que se lee en microsegundos y sin heurísticas. Se usa iterparse para
+# no construir el árbol completo: cada nodo se descarta al cerrarse y la lectura
+# termina en cuanto se cierra el Complemento (las Addendas pueden ser enormes y
+# no aportan nada).
+import xml.etree.ElementTree as ET
+from decimal import Decimal, InvalidOperation
+
+from extractor import _datos_vacios, normalizar_fecha
+
+# TipoDeComprobante -> texto que usa la representación impresa
+EFECTOS = {
+    "I": "Ingreso",
+    "E": "Egreso",
+    "T": "Traslado",
+    "N": "Nómina",
+    "P": "Pago",
+}
+
+
+def _local(etiqueta):
+    """'{http://www.sat.gob.mx/cfd/4}Emisor' -> 'emisor' (sin namespace ni mayúsculas)."""
+    return etiqueta.rsplit("}", 1)[-1].lower()
+
+
+def _atributos(elem):
+    # CFDI 3.2 usaba atributos en minúsculas (rfc, subTotal); 3.3 y 4.0 en PascalCase
+    return {k.rsplit("}", 1)[-1].lower(): v for k, v in elem.attrib.items()}
+
+
+def _monto(valor):
+    if valor is None or not valor.strip():
+        return None
+    try:
+        return f"{Decimal(valor.strip()):.2f}"
+    except InvalidOperation:
+        return None
+
+
+def leer_cfdi(ruta):
+    """
+    Devuelve los datos del CFDI con la misma forma que extraer_datos_infalible.
+    Lanza ValueError si el archivo no es un Comprobante (o ET.ParseError si
+    no es XML válido).
+    """
+    datos = _datos_vacios()
+    pila = []
+    es_comprobante = False
+    total = None
+
+    with open(ruta, "rb") as f:
+        for evento, elem in ET.iterparse(f, events=("start", "end")):
+            nombre = _local(elem.tag)
+            if evento == "start":
+                padre = pila[-1] if pila else None
+                pila.append(nombre)
+                attrs = _atributos(elem)
+
+                if padre is None:
+                    if nombre != "comprobante":
+                        raise ValueError("El XML no es un CFDI (falta el nodo Comprobante)")
+                    es_comprobante = True
+                    datos["subtotal"] = _monto(attrs.get("subtotal"))
+                    total = _monto(attrs.get("total"))
+                    datos["efecto_comprobante"] = EFECTOS.get(attrs.get("tipodecomprobante"), attrs.get("tipodecomprobante"))
+                    datos["fecha_emision"] = normalizar_fecha(attrs.get("fecha"))
+                elif nombre == "emisor" and padre == "comprobante":
+                    datos["rfc_emisor"] = attrs.get("rfc")
+                    datos["nombre_emisor"] = attrs.get("nombre")
+                elif nombre == "receptor" and padre == "comprobante":
+                    datos["rfc_receptor"] = attrs.get("rfc")
+                    datos["nombre_receptor"] = attrs.get("nombre")
+                    datos["uso_cfdi"] = attrs.get("usocfdi")
+                elif nombre == "timbrefiscaldigital":
+                    datos["folio_fiscal"] = attrs.get("uuid")
+                    # La de certificación solo si el Comprobante no trae Fecha
+                    datos["fecha_emision"] = datos["fecha_emision"] or normalizar_fecha(attrs.get("fechatimbrado"))
+                elif nombre == "nomina":
+                    datos["total_deducciones"] = _monto(attrs.get("totaldeducciones"))
+                elif nombre == "receptor" and padre == "nomina":
+                    datos["puesto"] = attrs.get("puesto")
+                elif nombre == "deduccion":
+                    datos["detalles_deducciones"].append({
+                        "tipo": attrs.get("tipodeduccion"),
+                        "concepto": attrs.get("concepto"),
+                        "importe": _monto(attrs.get("importe")),
+                    })
+            else:
+                pila.pop()
+                elem.clear()
+                if nombre == "complemento":
+                    break
+
+    if not es_comprobante:
+        raise ValueError("El XML no es un CFDI (falta el nodo Comprobante)")
+
+    # En nómina el Total del comprobante es lo que recibe el trabajador
+    if datos["efecto_comprobante"] == EFECTOS["N"]:
+        datos["total_neto"] = total
+    return datos
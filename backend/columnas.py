@@ -0,0 +1,220 @@
+# columnas.py
+# Almacén columnar (NumPy) de las facturas para el resumen y las agrupaciones.
+#
+# Por categoría se guarda un bloque de arreglos paralelos, uno por factura que
+# cuenta en el resumen: origen como código entero, desglose (centrales/campo),
+# monto en centavos (int64), RFC emisor como código de una tabla de RFCs
+# internados y fecha de emisión como entero AAAAMMDD (0 = sin fecha). Cada
+# bloque recuerda la versión del índice con la que se armó (indice.version): si
+# la categoría cambió desde entonces se vuelve a leer solo ese bloque, y las que
+# no cambiaron no tocan SQLite más que para comparar.
+#
+# Los totales por categoría, por categoría × origen o por RFC emisor son
+# reducciones vectorizadas (bincount / add.at) sobre los bloques concatenados.
+# Cada bloque está ordenado por fecha, así que un periodo (desde/hasta) es un
+# tramo contiguo que se ubica con búsqueda binaria: un resumen mensual solo
+# recorre las facturas de ese mes.
+import sys
+import threading
+
+import numpy as np
+
+import indice
+
+# Desglose del resumen; SIN_DATOS son los PDF todavía sin extraer: cuentan en
+# la categoría pero no en centrales ni en campo
+SIN_DATOS, CENTRALES, CAMPO = 0, 1, 2
+DESGLOSES = 3
+
+FECHA_MAXIMA = 99991231
+
+_lock = threading.Lock()
+_bloques = {}          # categoria -> _Bloque
+_unidos = None         # (claves de los bloques, columnas concatenadas)
+
+# Tablas de códigos: solo crecen, así que un código nunca cambia de significado
+_codigos_origen = {}
+_origenes = []
+_codigos_rfc = {None: 0}
+_rfcs = [None]
+_nombres_rfc = [None]  # primer nombre de emisor visto con cada RFC
+
+
+class _Bloque:
+    __slots__ = ("version", "origen", "desglose", "centavos", "rfc", "fecha")
+
+    def __init__(self, version, origen, desglose, centavos, rfc, fecha):
+        self.version = version
+        self.origen = origen
+        self.desglose = desglose
+        self.centavos = centavos
+        self.rfc = rfc
+        self.fecha = fecha
+
+    def tramo(self, desde, hasta):
+        """(inicio, fin) de las facturas con fecha entre desde y hasta (AAAAMMDD, None = sin límite)."""
+        if desde is None and hasta is None:
+            return 0, len(self.fecha)
+        # Las que no tienen fecha (0) no entran en ningún periodo
+        inicio = np.searchsorted(self.fecha, desde if desde is not None else 1, side="left")
+        fin = np.searchsorted(self.fecha, hasta if hasta is not None else FECHA_MAXIMA, side="right")
+        return int(inicio), int(max(inicio, fin))
+
+
+class _Columnas:
+    """
+    Tramos de los bloques de varias categorías, concatenados; `categoria` es
+    el índice en la lista pedida.
+    """
+
+    def __init__(self, bloques, tramos):
+        self.categoria = np.concatenate(
+            [np.full(fin - inicio, i, dtype=np.int32) for i, (inicio, fin) in enumerate(tramos)] or [np.zeros(0, np.int32)]
+        )
+        for campo in _Bloque.__slots__[1:]:
+            partes = [getattr(b, campo)[inicio:fin] for b, (inicio, fin) in zip(bloques, tramos)]
+            setattr(self, campo, np.concatenate(partes) if partes else np.zeros(0, np.int64))
+
+
+def _codigo_origen(origen):
+    codigo = _codigos_origen.get(origen)
+    if codigo is None:
+        codigo = _codigos_origen[origen] = len(_origenes)
+        _origenes.append(sys.intern(origen))
+    return codigo
+
+
+def _codigo_rfc(rfc, nombre):
+    rfc = (rfc or "").strip().upper() or None
+    codigo = _codigos_rfc.get(rfc)
+    if codigo is None:
+        codigo = _codigos_rfc[rfc] = len(_rfcs)
+        _rfcs.append(sys.intern(rfc))
+        _nombres_rfc.append(None)
+    if nombre and _nombres_rfc[codigo] is None:
+        _nombres_rfc[codigo] = nombre
+    return codigo
+
+
+def fecha_entera(fecha):
+    """Fecha AAAA-MM-DD como entero AAAAMMDD (None si no hay fecha)."""
+    return int(fecha.replace("-", "")) if fecha else None
+
+
+def _armar(categoria):
+    version, filas = indice.filas_resumen(categoria)
+    n = len(filas)
+    desgloses = {None: SIN_DATOS, 0: CENTRALES, 1: CAMPO}
+    return _Bloque(
+        version,
+        np.fromiter((_codigo_origen(f["origen"]) for f in filas), dtype=np.int32, count=n),
+        np.fromiter((desgloses[f["es_campo"]] for f in filas), dtype=np.int8, count=n),
+        np.fromiter((f["centavos"] for f in filas), dtype=np.int64, count=n),
+        np.fromiter((_codigo_rfc(f["rfc_emisor"], f["nombre_emisor"]) for f in filas), dtype=np.int32, count=n),
+        # filas_resumen las entrega ordenadas por fecha (sin fecha primero)
+        np.fromiter((fecha_entera(f["fecha"]) or 0 for f in filas), dtype=np.int32, count=n),
+    )
+
+
+def _bloque(categoria):
+    """Bloque vigente de la categoría (se llama con _lock)."""
+    bloque = _bloques.get(categoria)
+    if bloque is None or bloque.version != indice.version(categoria):
+        bloque = _bloques[categoria] = _armar(categoria)
+    return bloque
+
+
+def _columnas(categorias, desde=None, hasta=None):
+    """
+    Columnas de `categorias` en el periodo (se llama con _lock); se reutilizan
+    mientras ningún bloque cambie y se pida el mismo periodo.
+    """
+    global _unidos
+    bloques = [_bloque(c) for c in categorias]
+    claves = ([(c, b.version) for c, b in zip(categorias, bloques)], desde, hasta)
+    if _unidos is None or _unidos[0] != claves:
+        _unidos = (claves, _Columnas(bloques, [b.tramo(desde, hasta) for b in bloques]))
+    return _unidos[1]
+
+
+def _sumar_por(claves, centavos, grupos):
+    """(cantidad, centavos) por grupo; add.at suma en int64, sin redondeos de float."""
+    cantidades = np.bincount(claves, minlength=grupos)
+    sumas = np.zeros(grupos, dtype=np.int64)
+    np.add.at(sumas, claves, centavos)
+    return cantidades, sumas
+
+
+def _pesos(centavos):
+    return round(int(centavos) / 100, 2)
+
+
+def resumen(categorias, desde=None, hasta=None):
+    """
+    Totales de cada categoría (centrales/campo) con la forma de /api/resumen.
+    Con desde/hasta ("AAAA-MM-DD") solo cuentan las facturas emitidas en ese periodo.
+    """
+    for categoria in categorias:
+        indice.completar_pendientes(categoria)
+    with _lock:
+        cols = _columnas(categorias, fecha_entera(desde), fecha_entera(hasta))
+    cantidades, sumas = _sumar_por(cols.categoria * DESGLOSES + cols.desglose, cols.centavos, len(categorias) * DESGLOSES)
+    cantidades = cantidades.reshape(-1, DESGLOSES)
+    sumas = sumas.reshape(-1, DESGLOSES)
+
+    detalles = []
+    gran_total = 0.0
+    for i, categoria in enumerate(categorias):
+        detalle = {
+            "categoria": categoria,
+            "cantidad_facturas": int(cantidades[i].sum()),
+            "total": _pesos(sumas[i, CENTRALES] + sumas[i, CAMPO]),
+            "centrales": {"cantidad": int(cantidades[i, CENTRALES]), "total": _pesos(sumas[i, CENTRALES])},
+            "campo": {"cantidad": int(cantidades[i, CAMPO]), "total": _pesos(sumas[i, CAMPO])},
+        }
+        gran_total += detalle["total"]
+        detalles.append(detalle)
+    return {"detalles": detalles, "gran_total": round(gran_total, 2)}
+
+
+def por_origen(categorias, desde=None, hasta=None):
+    """Cantidad y total por categoría × origen (etiqueta del nombre), solo grupos con facturas."""
+    for categoria in categorias:
+        indice.completar_pendientes(categoria)
+    with _lock:
+        cols = _columnas(categorias, fecha_entera(desde), fecha_entera(hasta))
+        origenes = list(_origenes)
+    n = len(origenes)
+    cantidades, sumas = _sumar_por(cols.categoria * n + cols.origen, cols.centavos, len(categorias) * n)
+    return [
+        {
+            "categoria": categorias[g // n],
+            "origen": origenes[g % n],
+            "cantidad": int(cantidades[g]),
+            "total": _pesos(sumas[g]),
+        }
+        for g in np.flatnonzero(cantidades)
+    ]
+
+
+def por_rfc_emisor(categorias, desde=None, hasta=None, limite=100):
+    """Emisores con mayor total en `categorias` (RFC, primer nombre visto, cantidad y total)."""
+    for categoria in categorias:
+        indice.completar_pendientes(categoria)
+    with _lock:
+        cols = _columnas(categorias, fecha_entera(desde), fecha_entera(hasta))
+        rfcs = list(_rfcs)
+        nombres = list(_nombres_rfc)
+    cantidades, sumas = _sumar_por(cols.rfc, cols.centavos, len(rfcs))
+    con_facturas = np.flatnonzero(cantidades)
+    # Mayor total primero; a igual total, el RFC que apareció antes
+    orden = con_facturas[np.argsort(-sumas[con_facturas], kind="stable")][:max(0, limite)]
+    return [
+        {
+            "rfc_emisor": rfcs[g],
+            "nombre_emisor": nombres[g],
+            "cantidad": int(cantidades[g]),
+            "total": _pesos(sumas[g]),
+        }
+        for g in orden
+    ]
@@ -0,0 +1,272 @@
+# corpus_sintetico.py
+# Genera PDFs sintéticos estilo CFDI (facturas y recibos de nómina) con los
+# valores esperados de cada campo, para medir velocidad y aciertos del
+# extractor sin depender de facturas reales, red ni servicios.
+#
+# Los PDF se escriben a mano (texto con Helvetica y WinAnsiEncoding), así que
+# no hace falta ninguna librería extra. Con la misma semilla el corpus es
+# idéntico byte por byte.
+import json
+import os
+import random
+import uuid
+
+MANIFIESTO = "verdad.json"
+# Subir al cambiar los PDF o los campos del manifiesto (2: fecha_emision), para
+# que benchmark_extractor no reutilice un corpus viejo
+VERSION_CORPUS = "2"
+
+EMPRESAS = [
+    "SERVICIOS INTEGRALES DEL NORTE SA DE CV", "COMERCIALIZADORA AGRICOLA DEL BAJIO SA DE CV",
+    "TRANSPORTES Y FLETES GARCIA SA DE CV", "PAPELERIA Y SUMINISTROS OFICINA SA DE CV",
+    "TELECOMUNICACIONES RADIO CAMPO SA DE CV", "CONSULTORES ASOCIADOS MONTERREY SC",
+    "ARRENDADORA DE INMUEBLES LOS PINOS SA", "SEGUROS Y FIANZAS DEL PACIFICO SA",
+]
+NOMBRES = ["JUAN", "MARIA", "JOSE", "ANA", "LUIS", "SOFIA", "CARLOS", "LAURA", "MIGUEL", "ELENA"]
+APELLIDOS = ["PEREZ", "LOPEZ", "GARCIA", "MARTINEZ", "HERNANDEZ", "RAMIREZ", "TORRES", "FLORES", "RUIZ", "MORALES"]
+PUESTOS = ["Auxiliar Administrativo", "Tractorista", "Jefe de Campo", "Contador General", "Almacenista", "Chofer"]
+CONCEPTOS = [
+    "Servicio de mantenimiento preventivo", "Renta mensual de bodega", "Hojas blancas tamaño carta",
+    "Flete de producto terminado", "Plan de radio comunicacion", "Asesoria contable", "Poliza de seguro",
+    "Refacciones para tractor", "Toner para impresora", "Capacitacion en seguridad",
+]
+LETRAS_RFC = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+
+def _rfc(rnd, moral):
+    letras = "".join(rnd.choice(LETRAS_RFC) for _ in range(3 if moral else 4))
+    fecha = f"{rnd.randint(50, 99):02d}{rnd.randint(1, 12):02d}{rnd.randint(1, 28):02d}"
+    homoclave = "".join(rnd.choice(LETRAS_RFC + "0123456789") for _ in range(3))
+    return letras + fecha + homoclave
+
+
+def _monto(valor):
+    return f"{valor:,.2f}"
+
+
+# --- Escritura mínima de PDF ---
+
+def _escapar(texto):
+    return texto.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def escribir_pdf(ruta, paginas):
+    """
+    `paginas` es una lista de páginas; cada página una lista de
+    (x, y, tamaño de letra, texto). Escribe un PDF 1.4 válido en `ruta`.
+    """
+    objetos = []
+
+    def agregar(contenido):
+        objetos.append(contenido)
+        return len(objetos)
+
+    catalogo = agregar(None)
+    nodo_paginas = agregar(None)
+    fuente = agregar(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+
+    ids_paginas = []
+    for lineas in paginas:
+        flujo = b"".join(
+            b"BT /F1 %d Tf %.1f %.1f Td (" % (tam, x, y) + _escapar(texto).encode("cp1252", "replace") + b") Tj ET\n"
+            for x, y, tam, texto in lineas
+        )
+        contenido = agregar(b"<< /Length %d >>\nstream\n" % len(flujo) + flujo + b"\nendstream")
+        ids_paginas.append(agregar(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>" % (nodo_paginas, fuente, contenido)
+        ))
+
+    objetos[catalogo - 1] = b"<< /Type /Catalog /Pages %d 0 R >>" % nodo_paginas
+    objetos[nodo_paginas - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % i for i in ids_paginas), len(ids_paginas)
+    )
+
+    salida = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for i, contenido in enumerate(objetos, start=1):
+        offsets.append(len(salida))
+        salida += b"%d 0 obj\n" % i + contenido + b"\nendobj\n"
+    inicio_xref = len(salida)
+    salida += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objetos) + 1)
+    for offset in offsets:
+        salida += b"%010d 00000 n \n" % offset
+    salida += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objetos) + 1, catalogo, inicio_xref
+    )
+    with open(ruta, "wb") as f:
+        f.write(salida)
+
+
+# --- Documentos ---
+
+def _maquetar(rnd, bloques, conceptos, paginas_extra):
+    """
+    Convierte bloques de texto en páginas. Varía tamaño de letra, márgenes y,
+    a veces, pone etiqueta y valor en columnas separadas.
+    """
+    tam = rnd.choice([8, 9, 10])
+    alto = tam + rnd.choice([2, 3, 4])
+    x = rnd.choice([36, 48, 60])
+    dos_columnas = rnd.random() < 0.3
+
+    pagina = []
+    y = 760
+    for etiqueta, valor in bloques:
+        if dos_columnas and valor:
+            pagina.append((x, y, tam, etiqueta))
+            pagina.append((x + 200, y, tam, valor))
+        else:
+            pagina.append((x, y, tam, f"{etiqueta} {valor}".strip()))
+        y -= alto
+        if y < 60:
+            break
+
+    paginas = [pagina]
+    restantes = list(conceptos)
+    # Lo que no cabe en la primera página (y las páginas extra) va a hojas adicionales
+    while restantes or paginas_extra > 0:
+        hoja = []
+        y = 760
+        while restantes and y > 60:
+            hoja.append((x, y, tam, restantes.pop(0)))
+            y -= alto
+        if not hoja:
+            hoja.append((x, 760, tam, "Este documento es una representación impresa de un CFDI"))
+            paginas_extra -= 1
+        elif not restantes:
+            paginas_extra -= 1
+        paginas.append(hoja)
+    return paginas
+
+
+def _factura(rnd):
+    emisor = rnd.choice(EMPRESAS)
+    rfc_emisor = _rfc(rnd, moral=True)
+    rfc_receptor = _rfc(rnd, moral=True)
+    receptor = rnd.choice([e for e in EMPRESAS if e != emisor])
+    folio = str(uuid.UUID(int=rnd.getrandbits(128), version=4)).upper()
+
+    n_conceptos = rnd.choice([3, 8, 20, 60, 150])
+    filas = []
+    subtotal = 0.0
+    for _ in range(n_conceptos):
+        cantidad = rnd.randint(1, 20)
+        precio = round(rnd.uniform(10, 5000), 2)
+        importe = round(cantidad * precio, 2)
+        subtotal += importe
+        filas.append(f"{cantidad} {rnd.choice(CONCEPTOS)} {_monto(precio)} {_monto(importe)}")
+    subtotal = round(subtotal, 2)
+    iva = round(subtotal * 0.16, 2)
+
+    etiquetas = rnd.choice([
+        ("Nombre emisor:", "RFC emisor:", "Receptor:", "RFC receptor:"),
+        ("NOMBRE EMISOR:", "R.F.C.:", "RECEPTOR:", "RFC RECEPTOR:"),
+    ])
+    fecha = f"2024-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}"
+    bloques = [
+        ("FACTURA", ""),
+        (etiquetas[0], emisor),
+        (etiquetas[1], rfc_emisor),
+        ("Folio fiscal:", folio),
+        ("Fecha de emisión:", f"{fecha}T10:15:00"),
+        (etiquetas[2], receptor),
+        (etiquetas[3], rfc_receptor),
+        ("Uso CFDI:", "G03 - Gastos en general"),
+        ("Cantidad Descripción Valor unitario Importe", ""),
+    ]
+    # Los conceptos que caben van en la primera página; el resto en las siguientes
+    primera = filas[:25]
+    bloques += [(f, "") for f in primera]
+    bloques += [
+        ("Subtotal:", f"$ {_monto(subtotal)}"),
+        ("IVA 16%:", f"$ {_monto(iva)}"),
+        ("Total:", f"$ {_monto(subtotal + iva)}"),
+    ]
+    verdad = {
+        "tipo": "factura",
+        "folio_fiscal": folio,
+        "rfc_emisor": rfc_emisor,
+        "rfc_receptor": rfc_receptor,
+        "nombre_emisor": emisor,
+        "fecha_emision": fecha,
+        "subtotal": f"{subtotal:.2f}",
+    }
+    return bloques, filas[25:], verdad
+
+
+def _nomina(rnd):
+    emisor = rnd.choice(EMPRESAS)
+    rfc_emisor = _rfc(rnd, moral=True)
+    rfc_receptor = _rfc(rnd, moral=False)
+    trabajador = f"{rnd.choice(NOMBRES)} {rnd.choice(APELLIDOS)} {rnd.choice(APELLIDOS)}"
+    puesto = rnd.choice(PUESTOS)
+    folio = str(uuid.UUID(int=rnd.getrandbits(128), version=4))
+
+    sueldo = round(rnd.uniform(3000, 30000), 2)
+    isr = round(sueldo * 0.1, 2)
+    imss = round(sueldo * 0.025, 2)
+    deducciones = round(isr + imss, 2)
+    neto = round(sueldo - deducciones, 2)
+
+    fecha = f"2024-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}"
+    bloques = [
+        ("RECIBO DE NÓMINA", ""),
+        ("Nombre o razón social:", emisor),
+        ("R.F.C.:", rfc_emisor),
+        ("Folio fiscal:", folio),
+        ("Fecha de certificación:", f"{fecha}T08:00:00"),
+        ("Trabajador:", trabajador),
+        ("RFC receptor:", rfc_receptor),
+        ("Puesto:", f"{puesto} Fecha inicio 2020-01-01"),
+        ("Percepciones", ""),
+        ("001 Sueldo", _monto(sueldo)),
+        ("Deducciones", ""),
+        ("002 ISR", _monto(isr)),
+        ("001 IMSS", _monto(imss)),
+        ("Total deducciones", _monto(deducciones)),
+        ("Neto a pagar", _monto(neto)),
+    ]
+    verdad = {
+        "tipo": "nomina",
+        "folio_fiscal": folio,
+        "rfc_emisor": rfc_emisor,
+        "rfc_receptor": rfc_receptor,
+        "nombre_emisor": emisor,
+        "nombre_receptor": trabajador,
+        "puesto": puesto,
+        "fecha_emision": fecha,
+        "total_deducciones": f"{deducciones:.2f}",
+        "total_neto": f"{neto:.2f}",
+    }
+    return bloques, [], verdad
+
+
+def generar_corpus(carpeta, cantidad=200, semilla=0, proporcion_nomina=0.4):
+    """
+    Escribe `cantidad` PDFs en `carpeta` y un manifiesto (verdad.json) con los
+    valores esperados de cada archivo. Devuelve el manifiesto.
+    """
+    rnd = random.Random(semilla)
+    os.makedirs(carpeta, exist_ok=True)
+    manifiesto = {"version": VERSION_CORPUS, "semilla": semilla, "archivos": {}}
+    for i in range(cantidad):
+        if rnd.random() < proporcion_nomina:
+            bloques, conceptos, verdad = _nomina(rnd)
+        else:
+            bloques, conceptos, verdad = _factura(rnd)
+        paginas_extra = rnd.choice([0, 0, 0, 1, 2])
+        paginas = _maquetar(rnd, bloques, conceptos, paginas_extra)
+        nombre = f"{verdad['tipo']}_{i:05d}.pdf"
+        escribir_pdf(os.path.join(carpeta, nombre), paginas)
+        verdad["paginas"] = len(paginas)
+        manifiesto["archivos"][nombre] = verdad
+
+    with open(os.path.join(carpeta, MANIFIESTO), "w", encoding="utf-8") as f:
+        json.dump(manifiesto, f, ensure_ascii=False, indent=2)
+    return manifiesto
+
+
+def cargar_manifiesto(carpeta):
+    with open(os.path.join(carpeta, MANIFIESTO), "r", encoding="utf-8") as f:
+        return json.load(f)
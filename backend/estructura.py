@@ -0,0 +1,190 @@
+# estructura.py
+# Estructura de categorías (categories_config.json) en memoria.
+#
+# La estructura se lee una vez y se vuelve a leer solo si el archivo cambió
+# (otro worker la editó o alguien la editó a mano): cada lectura compara con un
+# stat el inodo, mtime y tamaño del archivo, sin abrirlo.
+# Las lecturas devuelven una instantánea que no se modifica nunca: las
+# ediciones trabajan sobre una copia con el bloqueo "estructura" tomado (entre
+# procesos, ver archivos.py), la escriben a un archivo temporal y la cambian
+# con os.replace, y solo entonces pasa a ser la vigente.
+import copy
+import hashlib
+import json
+import os
+import threading
+
+import archivos
+import metricas
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STRUCTURE_FILE = os.path.join(BASE_DIR, 'categories_config.json')
+
+DEFAULT_STRUCTURE = [
+    { "name": "I. Honorarios, Sueldos y Prestaciones", "key": "Honorarios" },
+    { "name": "II. Depreciación, Mantenimiento y Rentas", "key": "Depreciación" },
+    { "name": "III. Servicios", "key": "Servicios" },
+    { "name": "IV. Fletes y Acarreos", "key": "Fletes" },
+    {
+        "name": "V. Gastos de Oficina",
+        "key": "Gastos de Oficina",
+        "isGroup": True,
+        "subItems": [
+            { "name": "a. Papelería y Útiles", "key": "Papelería y Útiles" },
+            { "name": "b. Comunicaciones, Fax...", "key": "Comunicaciones y Radios" },
+            { "name": "c. Equipo de Cómputo", "key": "Equipo de Cómputo" }
+        ]
+    },
+    { "name": "VI. Gastos de Capacitación y Adiestramiento", "key": "Capacitación" },
+    { "name": "VII. Seguridad e Higiene", "key": "Seguridad" },
+    { "name": "VIII. Seguros y Fianzas", "key": "Seguros" },
+    { "name": "IX. Trabajos Previos y Auxiliares", "key": "Trabajos Previos" }
+]
+
+_lock = threading.RLock()
+_estructura = None   # instantánea vigente (no se modifica, se reemplaza)
+_categorias = []     # keys de las categorías hoja, en orden
+_firma = None       # (inodo, mtime, tamaño) del archivo leído
+_huella = None      # hash del contenido vigente (ETag de /api/structure)
+
+
+def _indexar(estructura):
+    """key de primer nivel -> (nodo, {key de subcategoría: nodo})."""
+    nodos = {}
+    for item in estructura:
+        subs = {}
+        for sub in item.get("subItems", []):
+            subs.setdefault(sub["key"], sub)
+        # Como la búsqueda lineal de antes, gana la primera aparición
+        nodos.setdefault(item["key"], (item, subs))
+    return nodos
+
+
+def _aplanar(estructura):
+    cats = []
+    def extract(item):
+        if item.get("isGroup"):
+            for sub in item.get("subItems", []):
+                extract(sub)
+        else:
+            cats.append(item["key"])
+    for item in estructura:
+        extract(item)
+    return cats
+
+
+def _instalar(estructura, firma):
+    global _estructura, _categorias, _firma, _huella
+    _categorias = _aplanar(estructura)
+    _huella = hashlib.sha1(json.dumps(estructura, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+    _estructura = estructura
+    _firma = firma
+
+
+def _firma_archivo():
+    # os.replace deja un inodo nuevo: dos escrituras en el mismo tick de mtime se distinguen
+    try:
+        st = os.stat(STRUCTURE_FILE)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def _escribir(estructura):
+    """Escribe el archivo de forma atómica y devuelve su firma nueva."""
+    archivos.escribir_json(STRUCTURE_FILE, estructura)
+    return _firma_archivo()
+
+
+def _vigente():
+    """Recarga la estructura si nunca se leyó o si el archivo cambió (se llama con _lock)."""
+    firma = _firma_archivo()
+    if _estructura is not None and firma == _firma:
+        metricas.cache("estructura", True)
+        return
+    metricas.cache("estructura", False)
+
+    if firma is None:
+        with archivos.bloqueo(archivos.ESTRUCTURA):
+            # Otro worker pudo crearlo mientras se esperaba el bloqueo
+            if _firma_archivo() is None:
+                _instalar(copy.deepcopy(DEFAULT_STRUCTURE), _escribir(DEFAULT_STRUCTURE))
+                return
+        firma = _firma_archivo()
+    try:
+        with open(STRUCTURE_FILE, 'r', encoding='utf-8') as f:
+            estructura = json.load(f)
+    except (OSError, ValueError):
+        estructura = copy.deepcopy(DEFAULT_STRUCTURE)
+    _instalar(estructura, firma)
+
+
+def obtener():
+    """Estructura vigente. Es compartida: no modificarla (usar edicion())."""
+    with _lock:
+        _vigente()
+        return _estructura
+
+
+def huella():
+    """Hash del contenido de la estructura vigente: igual en todos los procesos si no cambió."""
+    with _lock:
+        _vigente()
+        return _huella
+
+
+def categorias():
+    """Keys de todas las categorías hoja (carpetas), en el orden de la estructura."""
+    with _lock:
+        _vigente()
+        return list(_categorias)
+
+
+class _Edicion:
+    """
+    Copia editable de la estructura con el lock y el bloqueo entre procesos
+    tomados. Los cambios se escriben solo si se llama a guardar(); si no, la
+    estructura vigente queda igual.
+    """
+
+    def __enter__(self):
+        _lock.acquire()
+        self._bloqueo = archivos.bloqueo(archivos.ESTRUCTURA)
+        try:
+            self._bloqueo.__enter__()
+        except BaseException:
+            _lock.release()
+            raise
+        try:
+            # Ya con el bloqueo: si otro worker la acaba de guardar, se parte de esa
+            _vigente()
+            self.estructura = copy.deepcopy(_estructura)
+            self._nodos = _indexar(self.estructura)
+        except BaseException:
+            self.__exit__(None, None, None)
+            raise
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            self._bloqueo.__exit__(None, None, None)
+        finally:
+            _lock.release()
+        return False
+
+    def nodo(self, key):
+        """Nodo de primer nivel con esa key, o None."""
+        encontrado = self._nodos.get(key)
+        return encontrado[0] if encontrado else None
+
+    def subnodo(self, parent_key, key):
+        encontrado = self._nodos.get(parent_key)
+        return encontrado[1].get(key) if encontrado else None
+
+    def guardar(self):
+        firma = _escribir(self.estructura)
+        _instalar(self.estructura, firma)
+
+
+def edicion():
+    return _Edicion()
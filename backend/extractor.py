@@ -1,12 +1,278 @@
-import pdfplumber
+import os
 import re
+import threading
+from bisect import bisect_right
+from datetime import date
 
-def extraer_datos_infalible(pdf_path):
+import pdfplumber
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+
+# Versión de las reglas de extracción. Incrementar cada vez que cambie la salida
+# de extraer_datos_infalible para que los resultados en caché se descarten.
+EXTRACTOR_VERSION = "3"
+
+# --- Patrones precompilados ---
+UUID_RE = re.compile(r'[0-9a-fA-F]{8}(?:-[0-9a-fA-F]{4}){3}-[0-9a-fA-F]{12}')
+RFC_RE = re.compile(r'[A-Z&Ñ]{3,4}[0-9]{2}(?:0[1-9]|1[0-2])(?:0[1-9]|[12][0-9]|3[01])[A-Z0-9]{3}')
+RFC_SIMPLE_RE = re.compile(r'[A-Z&Ñ]{3,4}\d{6}[A-Z0-9]{3}')
+RFC_SIMPLE_ASCII_RE = re.compile(r'[A-Z&Ñ]{3,4}[0-9]{6}[A-Z0-9]{3}')
+
+EMISOR_ETIQUETA_RE = re.compile(r"emisor:|social:|nombre:", re.IGNORECASE)
+EMISOR_CORTE_RE = re.compile(r"folio|rfc|no\.?\s*de\s*serie|serie|csd|regimen|lugar", re.IGNORECASE)
+RFC_ETIQUETA_RE = re.compile(r"rfc[:\.]?", re.IGNORECASE)
+DIGITO_RE = re.compile(r'\d')
+
+MONTO_RE = re.compile(r"\$?\s*[\d,]+\.\d{2}")
+NUMERO_RE = re.compile(r"[\d,]+(?:\.\d{2})?")
+
+RFC_PREFIJO_RE = re.compile(r"r\.?f\.?c\.?\s*:?", re.IGNORECASE)
+RFC_EMISOR_PREFIJO_RE = re.compile(r"rfc.*emisor", re.IGNORECASE)
+
+RECEPTOR_ETIQUETA_RE = re.compile(r"(?:receptor|trabajador|empleado|recibí de)[:\s]+([^\n]+)", re.IGNORECASE)
+PAGO_NOMINA_RE = re.compile(r"pago de n[oó]mina", re.IGNORECASE)
+
+# Fecha de emisión (o, si no aparece, la de certificación del timbre): la
+# etiqueta y, a pocos caracteres (a veces en la línea siguiente), la fecha
+FECHA_RE = r"(\d{4}-\d{2}-\d{2}|\d{1,2}[/-]\d{1,2}[/-]\d{4}|\d{1,2}(?:\s*de)?\s+[a-záéíóú]{3,10}\.?(?:\s*de)?\s+\d{4}|\d{1,2}[/-][a-z]{3}[/-]\d{4})"
+FECHA_EMISION_RE = re.compile(r"fecha\s*(?:y\s*hora\s*)?de\s*emisi[oó]n[^0-9]{0,40}?" + FECHA_RE, re.IGNORECASE)
+FECHA_CERTIFICACION_RE = re.compile(r"fecha\s*(?:y\s*hora\s*)?de\s*certificaci[oó]n[^0-9]{0,40}?" + FECHA_RE, re.IGNORECASE)
+FECHA_ISO_RE = re.compile(r"(\d{4})-(\d{2})-(\d{2})")
+FECHA_NUMERICA_RE = re.compile(r"(\d{1,2})[/-](\d{1,2})[/-](\d{4})")
+FECHA_TEXTO_RE = re.compile(r"(\d{1,2})(?:\s*de)?[\s/-]+([a-záéíóú]{3,10})\.?(?:\s*de)?[\s/-]+(\d{4})", re.IGNORECASE)
+MESES = ("ene", "feb", "mar", "abr", "may", "jun", "jul", "ago", "sep", "oct", "nov", "dic")
+
+PUESTO_ETIQUETA_RE = re.compile(r"(?:puesto|departamento|categor[ií]a|ocupaci[oó]n)[:\s]+", re.IGNORECASE)
+PUESTO_CORTE_RE = re.compile(r"fecha|salario|sindicalizado|periodo|riesgo|jornada", re.IGNORECASE)
+
+# Lista negra de palabras que NO pueden ser un nombre
+BLACK_LIST = (
+    "sueldo", "salario", "hora", "extra", "aguinaldo", "prima", "vacacion",
+    "bono", "subsidio", "fondo", "ahorro", "vale", "despensa", "imss",
+    "infonavit", "isr", "sat", "folio", "fecha", "periodo", "dia", "pago",
+    "nomina", "neto", "total", "concepto", "percepcion", "deduccion",
+    "monto", "importe", "fiscal", "digital", "sello", "cadena"
+)
+
+CLAVES_RECEPTOR = ("receptor", "cliente", "facturar a", "razón social:")
+CLAVES_PUESTO = ("puesto", "departamento", "categoría", "categoria", "ocupación", "ocupacion")
+CLAVES_NETO = ("neto", "líquido", "liquido", "a pagar", "alcance")
+
+
+# --- Reglas por línea ---
+# Cada regla recibe (datos, clean_line, line_lower). Se aplican en el orden de
+# la tabla REGLAS, igual que las secciones del recorrido original, porque
+# algunas dependen de lo que dejó una anterior (p.ej. el RFC emisor).
+
+def _regla_nombre_emisor(datos, clean_line, line_lower):
+    # Estrategia 1: Etiqueta explícita
+    if "nombre" in line_lower and ("emisor" in line_lower or "razón social" in line_lower or "razon social" in line_lower):
+        try:
+            val = EMISOR_ETIQUETA_RE.split(clean_line)[1].strip()
+            clean_val = EMISOR_CORTE_RE.split(val)[0].strip()
+            if len(clean_val) > 3:
+                datos["nombre_emisor"] = clean_val
+        except:
+            pass
+
+    # Estrategia 2: Si la línea tiene el RFC emisor, a veces el nombre está antes o después
+    elif datos["rfc_emisor"] and datos["rfc_emisor"] in clean_line:
+        # Quitar el RFC y ver qué queda de texto
+        possible_name = clean_line.replace(datos["rfc_emisor"], "").strip()
+        # Limpiar basura común
+        possible_name = RFC_ETIQUETA_RE.sub("", possible_name).strip()
+        if len(possible_name) > 5 and not DIGITO_RE.search(possible_name): # Nombres suelen ser letras
+            datos["nombre_emisor"] = possible_name
+
+
+def _regla_subtotal(datos, clean_line, line_lower):
+    if "subtotal" in line_lower or "sub total" in line_lower:
+        # Busca números con formato (1,000.00 o 1000.00)
+        # Excluye porcentajes o códigos
+        nums = MONTO_RE.findall(clean_line)
+        if nums:
+            # Tomamos el último encontrado que sea un monto válido
+            raw_num = nums[-1].replace("$", "").replace(" ", "").replace(",", "")
+            try:
+                if float(raw_num) > 0:
+                    datos["subtotal"] = raw_num
+            except:
+                pass
+    elif not datos["subtotal"] and "importe" in line_lower and not "total" in line_lower:
+        # A veces dice "Importe" en lugar de subtotal en conceptos
+        nums = MONTO_RE.findall(clean_line)
+        if nums:
+            raw_num = nums[-1].replace("$", "").replace(" ", "").replace(",", "")
+            try:
+                # Validación simple para no agarrar cantidades irreales
+                if float(raw_num) > 0:
+                    # Guardamos provisionalmente, pero preferimos "Subtotal" explícito si aparece después
+                    datos["subtotal"] = raw_num
+            except:
+                pass
+
+
+def _regla_rfc_etiqueta(datos, clean_line, line_lower):
+    # Prioridad a etiquetas explícitas como "R.F.C.:" que vimos en la imagen
+    # Si NO es definitorio de receptor
+    if "receptor" not in line_lower and "cliente" not in line_lower:
+        try:
+            # Limpiar lo previo al RFC
+            parts_rfc = RFC_PREFIJO_RE.split(clean_line)
+            if len(parts_rfc) > 1:
+                potential_val = parts_rfc[1].strip().split(" ")[0] # Primer token
+                # Validar formato simple de RFC (3-4 letras, 6 nums, 3 alfanum)
+                if RFC_SIMPLE_RE.match(potential_val):
+                    datos["rfc_emisor"] = potential_val
+        except:
+            pass
+
+
+def _regla_rfc_emisor(datos, clean_line, line_lower):
+    # Intento de extracción directa si dice "RFC Emisor: XXXXX"
+    if "emisor" in line_lower:
+        try:
+            parts = RFC_EMISOR_PREFIJO_RE.split(clean_line)
+            if len(parts) > 1:
+                potential_rfc = parts[1].strip().split(" ")[0] # Tomar primer token
+                if RFC_SIMPLE_ASCII_RE.match(potential_rfc):
+                    datos["rfc_emisor"] = potential_rfc
+        except:
+            pass
+
+
+def _regla_nombre_receptor(datos, clean_line, line_lower):
+    # Nivel 1: Busqueda por etiqueta estricta
+    match = RECEPTOR_ETIQUETA_RE.search(clean_line)
+    if match:
+        posible_nombre = match.group(1).strip()
+        posible_nombre_lower = posible_nombre.lower()
+
+        # Filtros de sanidad estrictos
+        if (len(posible_nombre) > 5
+            and not any(x in posible_nombre_lower for x in BLACK_LIST)
+            and not DIGITO_RE.search(posible_nombre)): # Nombres no llevan numeros
+                datos["nombre_receptor"] = posible_nombre
+
+    # Nivel 2: Contexto "Pago de Nomina" (Sugerido por usuario)
+    # Solo si "Pago de Nomina" está seguido por algo que NO sea conceptos de pago
+    elif "pago de n" in line_lower and "mina" in line_lower:
+        # Intentar limpiar la frase "Pago de Nomina"
+        temp = PAGO_NOMINA_RE.sub("", clean_line).strip()
+        # Verificar que lo que queda sea un nombre valido
+        if (len(temp) > 5
+            and not any(x in temp.lower() for x in BLACK_LIST)
+            and not DIGITO_RE.search(temp)):
+                datos["nombre_receptor"] = temp
+
+
+def _regla_puesto(datos, clean_line, line_lower):
+    try:
+        # Divide por cualquiera de las keywords
+        parts = PUESTO_ETIQUETA_RE.split(clean_line)
+        if len(parts) > 1:
+            val = parts[1].strip()
+            # Limpiar basura del final (fechas, salarios)
+            val = PUESTO_CORTE_RE.split(val)[0].strip()
+            if len(val) > 2:
+                datos["puesto"] = val
+    except:
+        pass
+
+
+def _regla_total_deducciones(datos, clean_line, line_lower):
+    if "total" in line_lower:
+        # Intenta atrapar "$ 450.00" o "450.00"
+        nums = NUMERO_RE.findall(clean_line)
+        if nums:
+            # Filtrar numeros que parecen años o codigos
+            valid_nums = [n for n in nums if "." in n or len(n) > 3]
+            if valid_nums:
+                datos["total_deducciones"] = valid_nums[-1].replace(",", "")
+
+
+def _regla_total_neto(datos, clean_line, line_lower):
+    # Busca montos
+    nums = NUMERO_RE.findall(clean_line)
+    if nums:
+        # Tomamos el ultimo número que parezca dinero
+        valid_nums = [n for n in nums if "." in n]
+        if valid_nums:
+            datos["total_neto"] = valid_nums[-1].replace(",", "")
+
+
+# La etiqueta del trabajador se busca con re.IGNORECASE, que además de lower()
+# empareja "ı" y "ſ" con "i" y "s", e "İ" con "i" (lower() la convierte en
+# "i" + U+0307). Esas letras también cuentan como clave para no perder coincidencias.
+CLAVES_NOMBRE_RECEPTOR = ("receptor", "trabajador", "empleado", "recib", "pago de n", "\u0131", "\u017f", "\u0307")
+
+# (campo que, si ya tiene valor, desactiva la regla o None,
+#  palabras clave de las que basta una en la línea en minúsculas, o None si la regla siempre corre,
+#  regla)
+REGLAS = (
+    ("nombre_emisor", None, _regla_nombre_emisor),
+    (None, ("subtotal", "sub total", "importe"), _regla_subtotal),
+    (None, ("r.f.c.", "rfc"), _regla_rfc_etiqueta),
+    ("rfc_emisor", ("rfc",), _regla_rfc_emisor),
+    ("nombre_receptor", CLAVES_NOMBRE_RECEPTOR, _regla_nombre_receptor),
+    ("puesto", CLAVES_PUESTO, _regla_puesto),
+    (None, ("deducciones",), _regla_total_deducciones),
+    ("total_neto", CLAVES_NETO, _regla_total_neto),
+)
+
+
+def _lineas_con_claves(texto_lower, inicios, claves):
     """
-    Extrae datos del SAT de un PDF usando lectura de texto plano 
-    con coordenadas tolerantes y limpieza regex.
+    Índices de las líneas de `texto_lower` (líneas unidas con \\n, cuyos
+    offsets de inicio están en `inicios`) donde aparece alguna de las claves.
+    Usa str.find sobre el texto completo en lugar de revisar línea por línea.
+    """
+    lineas = set()
+    for clave in claves:
+        pos = texto_lower.find(clave)
+        while pos != -1:
+            i = bisect_right(inicios, pos) - 1
+            lineas.add(i)
+            if i + 1 >= len(inicios):
+                break
+            # Basta una aparición por línea: se salta a la siguiente
+            pos = texto_lower.find(clave, inicios[i + 1])
+    return lineas
+
+
+def normalizar_fecha(valor):
     """
-    datos = {
+    "2024-03-15T10:22:01", "15/03/2024", "15 de marzo de 2024" o "15/Mar/2024"
+    -> "2024-03-15". None si no es una fecha válida.
+    """
+    valor = str(valor or "").strip()
+    m = FECHA_ISO_RE.match(valor)
+    if m:
+        anio, mes, dia = m.groups()
+    elif FECHA_NUMERICA_RE.match(valor):
+        # En México el día va primero
+        dia, mes, anio = FECHA_NUMERICA_RE.match(valor).groups()
+    elif FECHA_TEXTO_RE.match(valor):
+        dia, nombre_mes, anio = FECHA_TEXTO_RE.match(valor).groups()
+        prefijo = nombre_mes.lower()[:3]
+        if prefijo == "set":
+            prefijo = "sep"
+        if prefijo not in MESES:
+            return None
+        mes = MESES.index(prefijo) + 1
+    else:
+        return None
+    try:
+        return date(int(anio), int(mes), int(dia)).isoformat()
+    except ValueError:
+        return None
+
+
+def _datos_vacios():
+    return {
         "folio_fiscal": None,
         "rfc_emisor": None,
         "rfc_receptor": None,
@@ -15,240 +281,210 @@ def extraer_datos_infalible(pdf_path):
         "puesto": None,
         "uso_cfdi": None,
         "efecto_comprobante": None,
+        "fecha_emision": None, # AAAA-MM-DD
         "subtotal": None,
         "total_neto": None,
         "total_deducciones": None,
         "detalles_deducciones": [] # Lista para el desglose
     }
-    
-    try:
-        with pdfplumber.open(pdf_path) as pdf:
-            # Usamos la primera página
-            page = pdf.pages[0]
-            
-            # x_tolerance y y_tolerance ayudan a que el texto no se "pegue" o se separe raro
-            text = page.extract_text(x_tolerance=2, y_tolerance=2)
-            
-            if not text:
-                return datos # Retorna vacíos si es una imagen sin texto (scan)
-
-            # 1. Búsqueda Global (Regex en todo el texto)
-            # -------------------------------------------
-            
-            # Folio Fiscal (UUID)
-            uuid_match = re.search(r'[0-9a-fA-F]{8}(?:-[0-9a-fA-F]{4}){3}-[0-9a-fA-F]{12}', text)
-            if uuid_match:
-                datos["folio_fiscal"] = uuid_match.group(0)
-
-            # RFCs Globales (Búsqueda inicial)
-            rfc_pattern = r'[A-Z&Ñ]{3,4}[0-9]{2}(?:0[1-9]|1[0-2])(?:0[1-9]|[12][0-9]|3[01])[A-Z0-9]{3}'
-            rfcs = re.findall(rfc_pattern, text)
-            
-            # Asignación preliminar (fallback)
-            datos["rfc_emisor"] = rfcs[0] if len(rfcs) > 0 else None
-            datos["rfc_receptor"] = rfcs[1] if len(rfcs) > 1 else None
-
-            # ---------------------------------------------------
-            # REFINAMIENTO SEMÁNTICO (Mejora solicitada)
-            # Busca RFCs "atados" a palabras clave como Receptor, Cliente, Facturar A
-            # ---------------------------------------------------
-            lines = text.split('\n')
-            for i, line in enumerate(lines):
-                 clean_line = " ".join(line.split()).lower()
-                 
-                 # Si encontramos palabras clave de Receptor
-                 if any(x in clean_line for x in ["receptor", "cliente", "facturar a", "razón social:"]):
-                     # Busco un RFC en ESTA linea
-                     match_rfc = re.search(rfc_pattern, line)
-                     if match_rfc:
-                         datos["rfc_receptor"] = match_rfc.group(0)
-                         # Si encontramos uno explícito, confiamos en él
-                         break 
-                     
-                     # O en la SIGUIENTE linea (a veces el titulo esta arriba)
-                     if i + 1 < len(lines):
-                         next_line = " ".join(lines[i+1].split())
-                         match_rfc_next = re.search(rfc_pattern, next_line)
-                         if match_rfc_next:
-                             datos["rfc_receptor"] = match_rfc_next.group(0)
-                             break
-            
-            # Si detectamos que RFC Emisor y Receptor son iguales, intentamos corregir
-            if datos["rfc_emisor"] == datos["rfc_receptor"] and len(rfcs) > 1:
-                # Si son iguales, probablemente agarramos el del emisor por error como receptor
-                # Asignamos el "otro" encontrado en la lista global
-                datos["rfc_receptor"] = rfcs[1] if rfcs[0] == datos["rfc_emisor"] else rfcs[0]
-
-            # 2. Búsqueda Línea por Línea (Para campos variables)
-            # ---------------------------------------------------
-            lines = text.split('\n')
-            
-            for line in lines:
-                # Normalizamos espacios (elimina tabs y dobles espacios)
-                clean_line = " ".join(line.split())
-                line_lower = clean_line.lower()
-                
-                # --- NOMBRE EMISOR (Estrategia Mejorada) ---
-                if not datos["nombre_emisor"]:
-                    # Estrategia 1: Etiqueta explícita
-                    if "nombre" in line_lower and ("emisor" in line_lower or "razón social" in line_lower or "razon social" in line_lower):
-                        try:
-                            val = re.split(r"emisor:|social:|nombre:", clean_line, flags=re.IGNORECASE)[1].strip()
-                            clean_val = re.split(r"folio|rfc|no\.?\s*de\s*serie|serie|csd|regimen|lugar", val, flags=re.IGNORECASE)[0].strip()
-                            if len(clean_val) > 3:
-                                datos["nombre_emisor"] = clean_val
-                        except:
-                            pass
-                    
-                    # Estrategia 2: Si la línea tiene el RFC emisor, a veces el nombre está antes o después
-                    elif datos["rfc_emisor"] and datos["rfc_emisor"] in clean_line:
-                        # Quitar el RFC y ver qué queda de texto
-                        possible_name = clean_line.replace(datos["rfc_emisor"], "").strip()
-                        # Limpiar basura común
-                        possible_name = re.sub(r"rfc[:\.]?", "", possible_name, flags=re.IGNORECASE).strip()
-                        if len(possible_name) > 5 and not re.search(r'\d', possible_name): # Nombres suelen ser letras
-                             datos["nombre_emisor"] = possible_name
-
-
-                # --- SUBTOTAL (Estrategia Mejorada) ---
-                if "subtotal" in line_lower or "sub total" in line_lower:
-                    # Busca números con formato (1,000.00 o 1000.00)
-                    # Excluye porcentajes o códigos
-                    nums = re.findall(r"\$?\s*[\d,]+\.\d{2}", clean_line)
-                    if nums:
-                        # Tomamos el último encontrado que sea un monto válido
-                        raw_num = nums[-1].replace("$", "").replace(" ", "").replace(",", "")
-                        try:
-                            if float(raw_num) > 0:
-                                datos["subtotal"] = raw_num
-                        except:
-                            pass
-                elif not datos["subtotal"] and "importe" in line_lower and not "total" in line_lower:
-                     # A veces dice "Importe" en lugar de subtotal en conceptos
-                     nums = re.findall(r"\$?\s*[\d,]+\.\d{2}", clean_line)
-                     if nums:
-                        raw_num = nums[-1].replace("$", "").replace(" ", "").replace(",", "")
-                        try:
-                             # Validación simple para no agarrar cantidades irreales
-                             if float(raw_num) > 0: 
-                                 # Guardamos provisionalmente, pero preferimos "Subtotal" explícito si aparece después
-                                 datos["subtotal"] = raw_num
-                        except:
-                            pass
-
-                # --- RFC EMISOR (Si no se ha detectado) ---
-                # Prioridad a etiquetas explícitas como "R.F.C.:" que vimos en la imagen
-                if "r.f.c." in line_lower or "rfc" in line_lower:
-                    # Si NO es definitorio de receptor
-                    if "receptor" not in line_lower and "cliente" not in line_lower:
-                        try:
-                            # Limpiar lo previo al RFC
-                            # Regex busca "R.F.C.:" o "RFC:" opcionalmente seguido de espacios
-                            parts_rfc = re.split(r"r\.?f\.?c\.?\s*:?", clean_line, flags=re.IGNORECASE)
-                            if len(parts_rfc) > 1:
-                                potential_val = parts_rfc[1].strip().split(" ")[0] # Primer token
-                                # Validar formato simple de RFC (3-4 letras, 6 nums, 3 alfanum)
-                                if re.match(r'[A-Z&Ñ]{3,4}\d{6}[A-Z0-9]{3}', potential_val):
-                                    datos["rfc_emisor"] = potential_val
-                        except:
-                            pass
-
-                if not datos["rfc_emisor"]:
-                    if "rfc" in line_lower and "emisor" in line_lower:
-                         # Intento de extracción directa si dice "RFC Emisor: XXXXX"
-                         try:
-                            parts = re.split(r"rfc.*emisor", clean_line, flags=re.IGNORECASE)
-                            if len(parts) > 1:
-                                potential_rfc = parts[1].strip().split(" ")[0] # Tomar primer token
-                                if re.match(r'[A-Z&Ñ]{3,4}[0-9]{6}[A-Z0-9]{3}', potential_rfc):
-                                    datos["rfc_emisor"] = potential_rfc
-                         except:
-                             pass
-
-                # --- NOMBRE TRABAJADOR (Estrategia Multinivel) ---
-                if not datos["nombre_receptor"]:
-                    # Lista negra de palabras que NO pueden ser un nombre
-                    black_list = [
-                        "sueldo", "salario", "hora", "extra", "aguinaldo", "prima", "vacacion", 
-                        "bono", "subsidio", "fondo", "ahorro", "vale", "despensa", "imss", 
-                        "infonavit", "isr", "sat", "folio", "fecha", "periodo", "dia", "pago", 
-                        "nomina", "neto", "total", "concepto", "percepcion", "deduccion", 
-                        "monto", "importe", "fiscal", "digital", "sello", "cadena"
-                    ]
-                    
-                    # Nivel 1: Busqueda por etiqueta estricta
-                    match = re.search(r"(?:receptor|trabajador|empleado|recibí de)[:\s]+([^\n]+)", clean_line, re.IGNORECASE)
-                    if match:
-                        posible_nombre = match.group(1).strip()
-                        posible_nombre_lower = posible_nombre.lower()
-                        
-                        # Filtros de sanidad estrictos
-                        if (len(posible_nombre) > 5 
-                            and not any(x in posible_nombre_lower for x in black_list) 
-                            and not re.search(r'\d', posible_nombre)): # Nombres no llevan numeros
-                                datos["nombre_receptor"] = posible_nombre
-                    
-                    # Nivel 2: Contexto "Pago de Nomina" (Sugerido por usuario)
-                    # Solo si "Pago de Nomina" está seguido por algo que NO sea conceptos de pago
-                    elif "pago de n" in line_lower and "mina" in line_lower:
-                        # Intentar limpiar la frase "Pago de Nomina"
-                        temp = re.sub(r"pago de n[oó]mina", "", clean_line, flags=re.IGNORECASE).strip()
-                        # Verificar que lo que queda sea un nombre valido
-                        if (len(temp) > 5 
-                            and not any(x in temp.lower() for x in black_list)
-                            and not re.search(r'\d', temp)):
-                                datos["nombre_receptor"] = temp
-
-                # --- PUESTO (Expandido) ---
-                if not datos["puesto"]:
-                    # Palabras clave: Puesto, Departamento, Categoría, Ocupación
-                    if any(x in line_lower for x in ["puesto", "departamento", "categoría", "categoria", "ocupación", "ocupacion"]):
-                        try:
-                            # Divide por cualquiera de las keywords
-                            parts = re.split(r"(?:puesto|departamento|categor[ií]a|ocupaci[oó]n)[:\s]+", clean_line, flags=re.IGNORECASE)
-                            if len(parts) > 1:
-                                val = parts[1].strip()
-                                # Limpiar basura del final (fechas, salarios)
-                                val = re.split(r"fecha|salario|sindicalizado|periodo|riesgo|jornada", val, flags=re.IGNORECASE)[0].strip()
-                                if len(val) > 2:
-                                    datos["puesto"] = val
-                        except:
-                            pass
-
-                # --- TOTAL DEDUCCIONES ---
-                if "total" in line_lower and "deducciones" in line_lower:
-                    # Intenta atrapar "$ 450.00" o "450.00"
-                    nums = re.findall(r"[\d,]+(?:\.\d{2})?", clean_line)
-                    if nums:
-                        # Filtrar numeros que parecen años o codigos
-                        valid_nums = [n for n in nums if "." in n or len(n) > 3]
-                        if valid_nums:
-                            datos["total_deducciones"] = valid_nums[-1].replace(",", "")
-                
-                # --- TOTAL NETO / LIQUIDO ---
-                if not datos["total_neto"]:
-                    if any(x in line_lower for x in ["neto", "líquido", "liquido", "a pagar", "alcance"]):
-                        # Busca montos
-                        nums = re.findall(r"[\d,]+(?:\.\d{2})?", clean_line)
-                        if nums:
-                             # Tomamos el ultimo número que parezca dinero
-                             valid_nums = [n for n in nums if "." in n]
-                             if valid_nums:
-                                 datos["total_neto"] = valid_nums[-1].replace(",", "")
-
-    except Exception as e:
-        print(f"Error procesando {pdf_path}: {e}")
-        # Retornamos lo que se haya podido rescatar o todo null
-        return datos
+
+
+def extraer_campos_de_texto(text, datos=None):
+    """
+    Aplica las reglas de extracción al texto plano de la primera página.
+    Separado de la lectura del PDF para poder usarlo con otros backends de texto.
+    """
+    if datos is None:
+        datos = _datos_vacios()
+
+    # 1. Búsqueda Global (Regex en todo el texto)
+    # -------------------------------------------
+
+    # Folio Fiscal (UUID)
+    uuid_match = UUID_RE.search(text)
+    if uuid_match:
+        datos["folio_fiscal"] = uuid_match.group(0)
+
+    # Fecha de emisión; la de certificación solo si no hay otra
+    for patron in (FECHA_EMISION_RE, FECHA_CERTIFICACION_RE):
+        fecha_match = patron.search(text)
+        if fecha_match and normalizar_fecha(fecha_match.group(1)):
+            datos["fecha_emision"] = normalizar_fecha(fecha_match.group(1))
+            break
+
+    # RFCs Globales (Búsqueda inicial)
+    rfcs = RFC_RE.findall(text)
+
+    # Asignación preliminar (fallback)
+    datos["rfc_emisor"] = rfcs[0] if len(rfcs) > 0 else None
+    datos["rfc_receptor"] = rfcs[1] if len(rfcs) > 1 else None
+
+    # Las líneas se normalizan una sola vez (elimina tabs y dobles espacios).
+    # El patrón de RFC no admite espacios, así que buscarlo en la línea
+    # normalizada da el mismo resultado que en la original.
+    lines = [" ".join(line.split()) for line in text.split('\n')]
+    texto_lower = "\n".join(lines).lower()
+    lines_lower = texto_lower.split('\n')
+    inicios = []
+    pos = 0
+    for line_lower in lines_lower:
+        inicios.append(pos)
+        pos += len(line_lower) + 1
+
+    # ---------------------------------------------------
+    # REFINAMIENTO SEMÁNTICO (Mejora solicitada)
+    # Busca RFCs "atados" a palabras clave como Receptor, Cliente, Facturar A
+    # ---------------------------------------------------
+    for i in sorted(_lineas_con_claves(texto_lower, inicios, CLAVES_RECEPTOR)):
+        # Busco un RFC en ESTA linea
+        match_rfc = RFC_RE.search(lines[i])
+        if match_rfc:
+            datos["rfc_receptor"] = match_rfc.group(0)
+            # Si encontramos uno explícito, confiamos en él
+            break
+
+        # O en la SIGUIENTE linea (a veces el titulo esta arriba)
+        if i + 1 < len(lines):
+            match_rfc_next = RFC_RE.search(lines[i + 1])
+            if match_rfc_next:
+                datos["rfc_receptor"] = match_rfc_next.group(0)
+                break
+
+    # Si detectamos que RFC Emisor y Receptor son iguales, intentamos corregir
+    if datos["rfc_emisor"] == datos["rfc_receptor"] and len(rfcs) > 1:
+        # Si son iguales, probablemente agarramos el del emisor por error como receptor
+        # Asignamos el "otro" encontrado en la lista global
+        datos["rfc_receptor"] = rfcs[1] if rfcs[0] == datos["rfc_emisor"] else rfcs[0]
+
+    # 2. Búsqueda Línea por Línea (Para campos variables)
+    # ---------------------------------------------------
+    # Primero se ubican, en todo el texto, las líneas donde puede aplicar cada
+    # regla; en cada línea solo corren esas reglas y las que no tienen prefiltro
+    lineas_regla = [
+        None if claves is None else _lineas_con_claves(texto_lower, inicios, claves)
+        for _, claves, _ in REGLAS
+    ]
+    candidatas = set().union(*(l for l in lineas_regla if l is not None))
+    siempre = tuple((campo, regla) for campo, claves, regla in REGLAS if claves is None)
+
+    for i, (clean_line, line_lower) in enumerate(zip(lines, lines_lower)):
+        if i not in candidatas:
+            # Línea sin palabras clave: solo corren las reglas sin prefiltro
+            for campo, regla in siempre:
+                if campo is None or not datos[campo]:
+                    regla(datos, clean_line, line_lower)
+            continue
+
+        for (campo, _, regla), lineas in zip(REGLAS, lineas_regla):
+            if campo is not None and datos[campo]:
+                continue
+            if lineas is not None and i not in lineas:
+                continue
+            regla(datos, clean_line, line_lower)
 
     return datos
 
+
+# --- Backends de texto ---
+# Cada backend recibe la ruta del PDF y devuelve el texto plano de la primera
+# página (o "" si no hay texto, p. ej. un escaneo). Se prueban en orden: pdfium
+# es nativo y mucho más rápido; pdfplumber (pdfminer en Python puro) queda como
+# respaldo cuando el primero no da texto o faltan campos obligatorios.
+
+# pdfium no es thread-safe y los endpoints síncronos corren en un threadpool
+_pdfium_lock = threading.Lock()
+
+
+def _texto_pdfium(pdf_path):
+    with _pdfium_lock:
+        pdf = pdfium.PdfDocument(pdf_path)
+        try:
+            page = pdf[0]
+            textpage = page.get_textpage()
+            try:
+                text = textpage.get_text_range()
+            finally:
+                textpage.close()
+                page.close()
+        finally:
+            pdf.close()
+    # pdfium separa líneas con \r\n y marca guiones de corte con \x02
+    return text.replace("\r\n", "\n").replace("\r", "\n").replace("\x02", "-")
+
+
+def _texto_pdfplumber(pdf_path):
+    with pdfplumber.open(pdf_path) as pdf:
+        # Usamos la primera página
+        page = pdf.pages[0]
+        # x_tolerance y y_tolerance ayudan a que el texto no se "pegue" o se separe raro
+        return page.extract_text(x_tolerance=2, y_tolerance=2) or ""
+
+
+BACKENDS_TEXTO = {"pdfplumber": _texto_pdfplumber}
+if pdfium is not None:
+    BACKENDS_TEXTO["pdfium"] = _texto_pdfium
+
+# Orden de los backends; se puede cambiar con FACTURAS_BACKENDS_TEXTO="pdfplumber"
+ORDEN_BACKENDS = [
+    nombre for nombre in os.environ.get("FACTURAS_BACKENDS_TEXTO", "pdfium,pdfplumber").split(",")
+    if nombre.strip() in BACKENDS_TEXTO
+] or ["pdfplumber"]
+
+# Sin estos campos el resultado del backend rápido no se da por bueno
+CAMPOS_REQUERIDOS = ("folio_fiscal", "rfc_emisor")
+CAMPOS_MONTO = ("subtotal", "total_neto")
+
+
+def _completo(datos):
+    return all(datos[c] for c in CAMPOS_REQUERIDOS) and any(datos[c] for c in CAMPOS_MONTO)
+
+
+def _campos_llenos(datos):
+    return sum(1 for k, v in datos.items() if v and k != "backend_texto")
+
+
+def extraer_datos_infalible(pdf_path):
+    """
+    Extrae datos del SAT de un PDF usando lectura de texto plano
+    con coordenadas tolerantes y limpieza regex.
+
+    El campo "backend_texto" indica qué backend dio el texto usado
+    (None si ninguno obtuvo texto).
+    """
+    mejor = None
+    for nombre in ORDEN_BACKENDS:
+        try:
+            text = BACKENDS_TEXTO[nombre](pdf_path)
+        except Exception as e:
+            print(f"Error procesando {pdf_path} con {nombre}: {e}")
+            continue
+        if not text:
+            continue # Sin texto (scan): se prueba el siguiente backend
+
+        datos = _datos_vacios()
+        try:
+            extraer_campos_de_texto(text, datos)
+        except Exception as e:
+            print(f"Error procesando {pdf_path}: {e}")
+            # Nos quedamos con lo que se haya podido rescatar
+        datos["backend_texto"] = nombre
+        if _completo(datos):
+            return datos
+        # Ante empate gana el backend posterior (pdfplumber es la referencia)
+        if mejor is None or _campos_llenos(datos) >= _campos_llenos(mejor):
+            mejor = datos
+
+    if mejor is None:
+        mejor = _datos_vacios()
+        mejor["backend_texto"] = None
+    return mejor
+
 # Bloque de prueba (solo se ejecuta si corres este archivo directamente)
 if __name__ == "__main__":
     import json
     # Cambia esto por un PDF real que tengas en la carpeta para probar
-    archivo_prueba = "facturas/ejemplo.pdf" 
+    archivo_prueba = "facturas/ejemplo.pdf"
     try:
         print(json.dumps(extraer_datos_infalible(archivo_prueba), indent=4))
     except:
-        print("No se encontró archivo de prueba, pero la función está lista.")
\ No newline at end of file
+        print("No se encontró archivo de prueba, pero la función está lista.")
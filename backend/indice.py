@@ -0,0 +1,1101 @@
+# indice.py
+# Índice SQLite de facturas: una fila por archivo de cada categoría.
+#
+# Los endpoints leen conteos, listados paginados y totales de aquí en lugar de
+# recorrer las carpetas y parsear la etiqueta [Origen] de cada nombre. Los
+# endpoints que modifican archivos actualizan la fila correspondiente; si una
+# carpeta cambió por fuera del servidor (su mtime no coincide con el guardado)
+# se vuelve a comparar contra el disco solo esa carpeta.
+#
+# Los totales del resumen no se guardan aquí: los calcula columnas.py sobre
+# arreglos de NumPy que se arman desde esta tabla.
+#
+# La tabla `generaciones` (también por triggers) cuenta los cambios de cada
+# categoría; version() la convierte en el ETag de listados y resumen.
+#
+# La tabla FTS5 `busqueda` (también mantenida por triggers) indexa RFCs,
+# nombres, puesto y folio para /api/buscar: prefijos y sin acentos.
+#
+# Con el vigilante activo (vigilante.py) los cambios hechos por fuera llegan
+# archivo por archivo a registrar()/quitar(), y sincronizar() ya no compara el
+# mtime de la carpeta: una lectura nunca tiene que recorrerla completa.
+#
+# El índice es compartido por todos los workers de uvicorn (SQLite en modo WAL):
+# lo que un proceso escribe lo ven los demás en su siguiente lectura.
+#
+# Un PDF y su XML CFDI con el mismo folio fiscal en la misma categoría son la
+# misma factura: se muestra el XML (valores exactos) con el nombre del PDF en
+# "archivo_pdf", y el PDF queda fuera de listados, conteos y totales.
+import base64
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+
+import archivos
+import cache_extraccion
+import cfdi_xml
+import estructura
+import metricas
+import motor_extraccion
+from extractor import EXTRACTOR_VERSION, normalizar_fecha
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CARPETA_FACTURAS = os.path.join(BASE_DIR, 'facturas')
+INDICE_DB = os.path.join(BASE_DIR, 'indice.db')
+
+# Incrementar al cambiar el esquema: el índice se descarta y se reconstruye
+# desde las carpetas (los PDF ya extraídos salen de cache_extraccion)
+VERSION_ESQUEMA = 5
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS facturas (
+    categoria TEXT NOT NULL,
+    archivo TEXT NOT NULL,
+    origen TEXT NOT NULL,
+    nombre_limpio TEXT NOT NULL,
+    clave_orden TEXT NOT NULL,
+    archivo_orden TEXT NOT NULL,
+    es_json INTEGER NOT NULL,
+    es_xml INTEGER NOT NULL DEFAULT 0,
+    folio_fiscal TEXT,
+    folio_norm TEXT,
+    rfc_emisor TEXT,
+    rfc_receptor TEXT,
+    nombre_emisor TEXT,
+    nombre_receptor TEXT,
+    puesto TEXT,
+    subtotal REAL,
+    total_deducciones REAL,
+    total_neto REAL,
+    es_campo INTEGER,
+    centavos INTEGER NOT NULL DEFAULT 0,
+    fecha TEXT,
+    datos TEXT,
+    error TEXT,
+    pendiente INTEGER NOT NULL DEFAULT 0,
+    version TEXT,
+    size INTEGER,
+    mtime_ns INTEGER,
+    hash TEXT,
+    PRIMARY KEY (categoria, archivo)
+);
+CREATE INDEX IF NOT EXISTS idx_facturas_orden ON facturas(categoria, clave_orden, archivo_orden);
+CREATE INDEX IF NOT EXISTS idx_facturas_origen ON facturas(categoria, origen, clave_orden, archivo_orden);
+CREATE INDEX IF NOT EXISTS idx_facturas_limpio ON facturas(categoria, nombre_limpio);
+CREATE INDEX IF NOT EXISTS idx_facturas_pendiente ON facturas(categoria, pendiente);
+CREATE INDEX IF NOT EXISTS idx_facturas_subtotal ON facturas(categoria, COALESCE(subtotal, 0), clave_orden, archivo_orden);
+CREATE INDEX IF NOT EXISTS idx_facturas_emisor ON facturas(categoria, COALESCE(nombre_emisor, '') COLLATE NOCASE, clave_orden, archivo_orden);
+CREATE INDEX IF NOT EXISTS idx_facturas_rfc ON facturas(categoria, COALESCE(rfc_emisor, ''), clave_orden, archivo_orden);
+CREATE INDEX IF NOT EXISTS idx_facturas_folio ON facturas(categoria, folio_norm);
+CREATE INDEX IF NOT EXISTS idx_facturas_xml ON facturas(categoria, es_xml, folio_norm);
+CREATE INDEX IF NOT EXISTS idx_facturas_folio_global ON facturas(folio_norm);
+CREATE INDEX IF NOT EXISTS idx_facturas_fecha ON facturas(categoria, fecha, clave_orden, archivo_orden);
+
+CREATE TABLE IF NOT EXISTS carpetas (
+    categoria TEXT PRIMARY KEY,
+    mtime_ns INTEGER
+);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS busqueda USING fts5(
+    folio_fiscal, rfc_emisor, rfc_receptor, nombre_emisor, nombre_receptor, puesto,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3 4'
+);
+
+CREATE TRIGGER IF NOT EXISTS facturas_busqueda_ai AFTER INSERT ON facturas BEGIN
+    INSERT INTO busqueda (rowid, folio_fiscal, rfc_emisor, rfc_receptor, nombre_emisor, nombre_receptor, puesto)
+    VALUES (NEW.rowid, NEW.folio_fiscal, NEW.rfc_emisor, NEW.rfc_receptor, NEW.nombre_emisor, NEW.nombre_receptor, NEW.puesto);
+END;
+
+CREATE TRIGGER IF NOT EXISTS facturas_busqueda_ad AFTER DELETE ON facturas BEGIN
+    DELETE FROM busqueda WHERE rowid = OLD.rowid;
+END;
+
+CREATE TRIGGER IF NOT EXISTS facturas_busqueda_au
+AFTER UPDATE OF folio_fiscal, rfc_emisor, rfc_receptor, nombre_emisor, nombre_receptor, puesto ON facturas BEGIN
+    UPDATE busqueda SET
+        folio_fiscal = NEW.folio_fiscal, rfc_emisor = NEW.rfc_emisor, rfc_receptor = NEW.rfc_receptor,
+        nombre_emisor = NEW.nombre_emisor, nombre_receptor = NEW.nombre_receptor, puesto = NEW.puesto
+    WHERE rowid = NEW.rowid;
+END;
+
+-- Generación por categoría (y global, categoria = ''): sube con cada alta, baja
+-- o cambio de una fila, venga de donde venga. De aquí salen los ETag.
+CREATE TABLE IF NOT EXISTS generaciones (
+    categoria TEXT PRIMARY KEY,
+    generacion INTEGER NOT NULL
+);
+
+-- Valor al azar de este índice: si se reconstruye, las generaciones empiezan
+-- de nuevo pero los ETag viejos ya no coinciden
+CREATE TABLE IF NOT EXISTS meta (
+    clave TEXT PRIMARY KEY,
+    valor TEXT NOT NULL
+);
+INSERT OR IGNORE INTO meta (clave, valor) VALUES ('epoca', lower(hex(randomblob(8))));
+
+CREATE TRIGGER IF NOT EXISTS facturas_generacion_ai AFTER INSERT ON facturas BEGIN
+    INSERT INTO generaciones (categoria, generacion) VALUES (NEW.categoria, 1), ('', 1)
+    ON CONFLICT (categoria) DO UPDATE SET generacion = generacion + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS facturas_generacion_ad AFTER DELETE ON facturas BEGIN
+    INSERT INTO generaciones (categoria, generacion) VALUES (OLD.categoria, 1), ('', 1)
+    ON CONFLICT (categoria) DO UPDATE SET generacion = generacion + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS facturas_generacion_au AFTER UPDATE ON facturas BEGIN
+    INSERT INTO generaciones (categoria, generacion) VALUES (OLD.categoria, 1), (NEW.categoria, 1), ('', 1)
+    ON CONFLICT (categoria) DO UPDATE SET generacion = generacion + 1;
+END;
+"""
+
+# Campos de texto del registro que también se guardan como columnas
+CAMPOS_TEXTO = ["folio_fiscal", "rfc_emisor", "rfc_receptor", "nombre_emisor", "nombre_receptor", "puesto"]
+CAMPOS_MONTO = ["subtotal", "total_deducciones", "total_neto"]
+
+_local = threading.local()
+
+# True mientras vigilante.py mantiene el índice al día con los eventos del disco
+_vigilado = False
+
+
+def _conexion():
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(INDICE_DB, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        # Con varios workers, solo uno revisa la versión y reconstruye a la vez
+        with archivos.bloqueo("indice.db"):
+            if conn.execute("PRAGMA user_version").fetchone()[0] != VERSION_ESQUEMA:
+                # Los triggers se van con la tabla
+                conn.executescript("""
+                    DROP TABLE IF EXISTS facturas;
+                    DROP TABLE IF EXISTS carpetas;
+                    DROP TABLE IF EXISTS totales;
+                    DROP TABLE IF EXISTS busqueda;
+                    DROP TABLE IF EXISTS generaciones;
+                    DROP TABLE IF EXISTS meta;
+                """)
+                conn.execute(f"PRAGMA user_version = {VERSION_ESQUEMA}")
+            conn.executescript(ESQUEMA)
+            conn.commit()
+        _local.conn = conn
+    return conn
+
+
+# --- Utilidades de nombres y montos ---
+
+def es_archivo_factura(nombre):
+    nombre = nombre.lower()
+    return nombre.endswith('.pdf') or nombre.endswith('.json') or nombre.endswith('.xml')
+
+
+def origen_de_nombre(archivo):
+    match = re.match(r'^\[(.*?)\]', archivo)
+    return match.group(1) if match else "Desconocido"
+
+
+def nombre_limpio(archivo):
+    return re.sub(r'^\[.*?\]\s*', '', archivo)
+
+
+def parsear_monto(monto_str):
+    if not monto_str:
+        return None
+    clean_num = str(monto_str).replace("$", "").replace(",", "").strip()
+    try:
+        return float(clean_num)
+    except:
+        return None
+
+
+def normalizar_folio(folio):
+    """Los UUID se comparan sin espacios ni distinción de mayúsculas."""
+    folio = str(folio or "").strip().upper()
+    return folio or None
+
+
+def _columnas_de_datos(archivo, es_json, datos):
+    """Columnas derivadas del registro (campos, montos numéricos y aporte al resumen)."""
+    cols = {campo: datos.get(campo) for campo in CAMPOS_TEXTO}
+    cols["folio_norm"] = normalizar_folio(datos.get("folio_fiscal"))
+    cols["fecha"] = normalizar_fecha(datos.get("fecha_emision"))
+    for campo in CAMPOS_MONTO:
+        cols[campo] = parsear_monto(datos.get(campo))
+
+    # Mismas reglas que el resumen: origen por etiqueta y, en JSON manuales, por el campo "origen"
+    es_campo = "[Campo]" in archivo
+    if es_json:
+        if datos.get("origen") == "Campo":
+            es_campo = True
+        elif datos.get("origen") == "Centrales":
+            es_campo = False
+    cols["es_campo"] = int(es_campo)
+
+    # Fallback a total_neto si subtotal no existe (nómina etc)
+    monto = parsear_monto(datos.get("subtotal") or datos.get("total_neto"))
+    cols["centavos"] = int(round(monto * 100)) if monto is not None else 0
+    return cols
+
+
+def _fila_base(categoria, archivo, st):
+    limpio = nombre_limpio(archivo)
+    return {
+        "categoria": categoria,
+        "archivo": archivo,
+        "origen": origen_de_nombre(archivo),
+        "nombre_limpio": limpio,
+        "clave_orden": limpio.lower(),
+        "archivo_orden": archivo.lower(),
+        "es_json": int(archivo.lower().endswith('.json')),
+        "es_xml": int(archivo.lower().endswith('.xml')),
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        # Sin datos todavía: cuenta en la categoría pero no en el desglose
+        "es_campo": None,
+        "centavos": 0,
+        "pendiente": 0,
+    }
+
+
+def _leer_fila(categoria, archivo, extraer):
+    """
+    Construye la fila de un archivo. Los JSON y XML se leen siempre; los PDF
+    se extraen (o se leen de la caché) solo si `extraer`. Si no, se usan los
+    datos en caché solo cuando el hash de la ruta ya se conoce; si no, quedan
+    pendientes.
+    """
+    ruta = os.path.join(CARPETA_FACTURAS, categoria, archivo)
+    st = os.stat(ruta)
+    fila = _fila_base(categoria, archivo, st)
+    metricas.archivos_escaneados(1, "lectura")
+
+    if fila["es_json"]:
+        try:
+            with open(ruta, 'rb') as f:
+                contenido = f.read()
+            fila["hash"] = hashlib.sha256(contenido).hexdigest()
+            datos = json.loads(contenido.decode('utf-8'))
+            fila["datos"] = json.dumps(datos, ensure_ascii=False)
+            fila.update(_columnas_de_datos(archivo, True, datos))
+        except Exception as e:
+            fila["error"] = str(e)
+    elif fila["es_xml"]:
+        try:
+            fila["hash"] = cache_extraccion.hash_archivo(ruta)
+            datos = cfdi_xml.leer_cfdi(ruta)
+            fila["datos"] = json.dumps(datos, ensure_ascii=False)
+            fila.update(_columnas_de_datos(archivo, False, datos))
+        except Exception as e:
+            fila["error"] = f"XML no válido: {e}"
+    elif extraer:
+        datos = cache_extraccion.obtener_datos(ruta)
+        fila.update(_columnas_pdf(ruta, archivo, datos))
+    else:
+        datos = cache_extraccion.buscar_memo(ruta)
+        if datos is not None:
+            fila.update(_columnas_pdf(ruta, archivo, datos))
+        else:
+            fila["pendiente"] = 1
+    return fila
+
+
+def _columnas_pdf(ruta, archivo, datos):
+    cols = _columnas_de_datos(archivo, False, datos)
+    cols["datos"] = json.dumps(datos, ensure_ascii=False)
+    cols["version"] = EXTRACTOR_VERSION
+    cols["pendiente"] = 0
+    cols["error"] = None
+    try:
+        cols["hash"] = cache_extraccion.hash_de_ruta(ruta)
+    except OSError:
+        pass
+    return cols
+
+
+def _insertar(conn, fila):
+    conn.execute("DELETE FROM facturas WHERE categoria = ? AND archivo = ?", (fila["categoria"], fila["archivo"]))
+    columnas = ", ".join(fila)
+    marcas = ", ".join("?" for _ in fila)
+    conn.execute(f"INSERT INTO facturas ({columnas}) VALUES ({marcas})", list(fila.values()))
+
+
+def _mtime_carpeta(categoria):
+    try:
+        return os.stat(os.path.join(CARPETA_FACTURAS, categoria)).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _sincronizada(conn, categoria):
+    """Las mutaciones solo aplican su delta si la categoría ya está indexada."""
+    return conn.execute("SELECT 1 FROM carpetas WHERE categoria = ?", (categoria,)).fetchone() is not None
+
+
+def _marcar_sincronizada(conn, categoria):
+    conn.execute(
+        "INSERT OR REPLACE INTO carpetas (categoria, mtime_ns) VALUES (?, ?)",
+        (categoria, _mtime_carpeta(categoria)),
+    )
+
+
+# --- Sincronización con el disco ---
+
+def sincronizar(categoria, forzar=False):
+    """
+    Compara la carpeta con el índice si su mtime cambió desde la última vez.
+    Solo se vuelven a leer los archivos nuevos o con tamaño/mtime distinto; los
+    PDF quedan pendientes de extracción hasta que alguien los necesite.
+    """
+    conn = _conexion()
+    mtime = _mtime_carpeta(categoria)
+    row = conn.execute("SELECT mtime_ns FROM carpetas WHERE categoria = ?", (categoria,)).fetchone()
+    if row and not forzar and (_vigilado or row["mtime_ns"] == mtime):
+        metricas.cache("indice_carpeta", True)
+        return
+    metricas.cache("indice_carpeta", False)
+
+    en_indice = {
+        r["archivo"]: (r["size"], r["mtime_ns"])
+        for r in conn.execute("SELECT archivo, size, mtime_ns FROM facturas WHERE categoria = ?", (categoria,))
+    }
+    en_disco = {}
+    if mtime is not None:
+        with os.scandir(os.path.join(CARPETA_FACTURAS, categoria)) as it:
+            for entry in it:
+                if entry.is_file() and es_archivo_factura(entry.name):
+                    st = entry.stat()
+                    en_disco[entry.name] = (st.st_size, st.st_mtime_ns)
+        metricas.archivos_escaneados(len(en_disco), "listado")
+
+    with conn:
+        for archivo in en_indice.keys() - en_disco.keys():
+            conn.execute("DELETE FROM facturas WHERE categoria = ? AND archivo = ?", (categoria, archivo))
+        for archivo, firma in en_disco.items():
+            if en_indice.get(archivo) == firma:
+                continue
+            try:
+                _insertar(conn, _leer_fila(categoria, archivo, extraer=False))
+            except FileNotFoundError:
+                pass
+        _marcar_sincronizada(conn, categoria)
+
+
+def confiar_en_vigilante(activo):
+    """
+    Con el vigilante corriendo, una categoría ya indexada se da por sincronizada
+    sin comparar su mtime; al detenerlo se vuelve a comparar en cada lectura.
+    """
+    global _vigilado
+    _vigilado = bool(activo)
+
+
+def version(categoria=None):
+    """
+    Versión del contenido indexado de una categoría (o de todas, con None):
+    cambia con cada modificación de sus filas. Sincroniza antes, así que con el
+    vigilante activo no toca el disco y sin él solo revisa el mtime de cada carpeta.
+    """
+    for cat in ([categoria] if categoria is not None else estructura.categorias()):
+        sincronizar(cat)
+    return _version(_conexion(), categoria)
+
+
+def _version(conn, categoria):
+    epoca = conn.execute("SELECT valor FROM meta WHERE clave = 'epoca'").fetchone()[0]
+    row = conn.execute("SELECT generacion FROM generaciones WHERE categoria = ?", (categoria or "",)).fetchone()
+    return f"{epoca}-{row[0] if row else 0}"
+
+
+def migrar():
+    """Importa (o pone al día) todas las carpetas de facturas existentes."""
+    if not os.path.exists(CARPETA_FACTURAS):
+        return
+    for nombre in sorted(os.listdir(CARPETA_FACTURAS)):
+        if os.path.isdir(os.path.join(CARPETA_FACTURAS, nombre)):
+            sincronizar(nombre)
+
+
+def _resolver_pendientes(conn, filas):
+    """
+    Extrae (caché + pool) los PDF de `filas` que no tienen datos o que se
+    extrajeron con otra versión. Devuelve {archivo: excepción} de los que
+    fallaron, o None si no había nada que extraer.
+    """
+    faltantes = [
+        f for f in filas
+        if not f["es_json"] and not f["es_xml"] and not f["error"] and (f["pendiente"] or f["version"] != EXTRACTOR_VERSION)
+    ]
+    if not faltantes:
+        return None
+
+    rutas = [os.path.join(CARPETA_FACTURAS, f["categoria"], f["archivo"]) for f in faltantes]
+    errores = {}
+    with conn:
+        for fila, ruta, datos in zip(faltantes, rutas, motor_extraccion.extraer_lote(rutas)):
+            if isinstance(datos, Exception):
+                errores[fila["archivo"]] = datos
+                continue
+            _actualizar_extraccion(conn, fila["categoria"], fila["archivo"], ruta, datos)
+    return errores
+
+
+def _actualizar_extraccion(conn, categoria, archivo, ruta, datos):
+    cols = _columnas_pdf(ruta, archivo, datos)
+    asignaciones = ", ".join(f"{c} = ?" for c in cols)
+    conn.execute(
+        f"UPDATE facturas SET {asignaciones} WHERE categoria = ? AND archivo = ?",
+        list(cols.values()) + [categoria, archivo],
+    )
+
+
+def guardar_extraccion(categoria, archivo, datos):
+    """Guarda en la fila el resultado de una extracción hecha fuera del índice (ingesta)."""
+    conn = _conexion()
+    ruta = os.path.join(CARPETA_FACTURAS, categoria, archivo)
+    with conn:
+        _actualizar_extraccion(conn, categoria, archivo, ruta, datos)
+
+
+# --- Mutaciones (las llaman los endpoints después de tocar el disco) ---
+
+def registrar(categoria, archivo, extraer=True):
+    """Lee el archivo a su fila. Devuelve la fila, o None si no hay nada que indexar."""
+    conn = _conexion()
+    if not _sincronizada(conn, categoria):
+        return None
+    fila = None
+    with conn:
+        try:
+            fila = _leer_fila(categoria, archivo, extraer)
+            _insertar(conn, fila)
+        except FileNotFoundError:
+            conn.execute("DELETE FROM facturas WHERE categoria = ? AND archivo = ?", (categoria, archivo))
+        _marcar_sincronizada(conn, categoria)
+    return fila
+
+
+def quitar(categoria, archivo):
+    conn = _conexion()
+    if not _sincronizada(conn, categoria):
+        return
+    with conn:
+        conn.execute("DELETE FROM facturas WHERE categoria = ? AND archivo = ?", (categoria, archivo))
+        _marcar_sincronizada(conn, categoria)
+
+
+def reemplazar(categoria, archivo_old, archivo_new):
+    """Para ediciones: quita la fila anterior y lee el archivo nuevo."""
+    conn = _conexion()
+    if not _sincronizada(conn, categoria):
+        return
+    with conn:
+        conn.execute("DELETE FROM facturas WHERE categoria = ? AND archivo = ?", (categoria, archivo_old))
+        try:
+            _insertar(conn, _leer_fila(categoria, archivo_new, extraer=True))
+        except FileNotFoundError:
+            pass
+        _marcar_sincronizada(conn, categoria)
+
+
+def _mover_fila(conn, categoria, archivo_old, categoria_new, archivo_new, extraer):
+    """
+    Pasa la fila al nombre (y categoría) nuevos. Un PDF conserva sus datos
+    extraídos; un JSON (su campo "origen" manda sobre la etiqueta), un XML o un
+    PDF sin datos se vuelven a leer. No hace commit.
+    """
+    fila = conn.execute(
+        "SELECT * FROM facturas WHERE categoria = ? AND archivo = ?", (categoria, archivo_old)
+    ).fetchone()
+    conn.execute("DELETE FROM facturas WHERE categoria = ? AND archivo = ?", (categoria, archivo_old))
+    if not _sincronizada(conn, categoria_new):
+        return
+    try:
+        if fila is None or fila["es_json"] or fila["es_xml"] or fila["pendiente"] or fila["datos"] is None:
+            _insertar(conn, _leer_fila(categoria_new, archivo_new, extraer))
+            return
+        st = os.stat(os.path.join(CARPETA_FACTURAS, categoria_new, archivo_new))
+    except FileNotFoundError:
+        return
+    nueva = dict(fila)
+    nueva.update(_fila_base(categoria_new, archivo_new, st))
+    for campo in ("datos", "version", "hash", "pendiente", "error"):
+        nueva[campo] = fila[campo]
+    nueva.update(_columnas_de_datos(archivo_new, False, json.loads(fila["datos"])))
+    _insertar(conn, nueva)
+
+
+def renombrar(categoria, archivo_old, archivo_new):
+    """Cambio de etiqueta de origen (ver _mover_fila)."""
+    conn = _conexion()
+    if not _sincronizada(conn, categoria):
+        return
+    with conn:
+        _mover_fila(conn, categoria, archivo_old, categoria, archivo_new, extraer=True)
+        _marcar_sincronizada(conn, categoria)
+
+
+class _Lote:
+    """
+    Mutaciones de /api/lote en una sola transacción: cada operación se ve en
+    las consultas siguientes del mismo hilo (p. ej. pareja()), pero generaciones,
+    búsqueda y mtimes se confirman una vez al final. Los PDF sin datos quedan
+    pendientes en lugar de extraerse uno por uno.
+    """
+
+    def __init__(self, categorias):
+        self._categorias = set(categorias)
+
+    def __enter__(self):
+        # Se sincronizan antes: dentro del lote las consultas no vuelven a comparar el disco
+        for categoria in self._categorias:
+            sincronizar(categoria)
+        self.conn = _conexion()
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self
+
+    def __exit__(self, *exc):
+        # El disco ya cambió: lo aplicado se confirma aunque algo haya fallado
+        try:
+            for categoria in self._categorias:
+                if _sincronizada(self.conn, categoria):
+                    _marcar_sincronizada(self.conn, categoria)
+        finally:
+            self.conn.commit()
+        return False
+
+    def pareja(self, categoria, archivo):
+        return _pareja(self.conn, categoria, archivo)
+
+    def quitar(self, categoria, archivo):
+        self._categorias.add(categoria)
+        self.conn.execute("DELETE FROM facturas WHERE categoria = ? AND archivo = ?", (categoria, archivo))
+
+    def mover(self, categoria, archivo_old, categoria_new, archivo_new):
+        self._categorias.update((categoria, categoria_new))
+        _mover_fila(self.conn, categoria, archivo_old, categoria_new, archivo_new, extraer=False)
+
+    def reemplazar(self, categoria, archivo_old, archivo_new):
+        self._categorias.add(categoria)
+        self.conn.execute("DELETE FROM facturas WHERE categoria = ? AND archivo = ?", (categoria, archivo_old))
+        if _sincronizada(self.conn, categoria):
+            try:
+                _insertar(self.conn, _leer_fila(categoria, archivo_new, extraer=False))
+            except FileNotFoundError:
+                pass
+
+
+def lote(categorias):
+    """Contexto para las mutaciones de un lote sobre `categorias` (ver _Lote)."""
+    return _Lote(categorias)
+
+
+def renombrar_categoria(key_old, key_new):
+    conn = _conexion()
+    with conn:
+        conn.execute("DELETE FROM facturas WHERE categoria = ?", (key_new,))
+        conn.execute("DELETE FROM carpetas WHERE categoria = ?", (key_new,))
+        conn.execute("UPDATE facturas SET categoria = ? WHERE categoria = ?", (key_new, key_old))
+        # El mtime registrado sigue valiendo: renombrar la carpeta no lo cambia
+        conn.execute("UPDATE carpetas SET categoria = ? WHERE categoria = ?", (key_new, key_old))
+
+
+def olvidar_categoria(categoria):
+    """Al quitar una categoría de la estructura; si vuelve a agregarse se reindexa."""
+    conn = _conexion()
+    with conn:
+        conn.execute("DELETE FROM facturas WHERE categoria = ?", (categoria,))
+        conn.execute("DELETE FROM carpetas WHERE categoria = ?", (categoria,))
+
+
+# --- Consultas ---
+
+# PDF con un XML del mismo folio en la categoría (lo representa el XML).
+# Recibe la categoría como parámetro; la subconsulta se evalúa una sola vez.
+PDF_EMPAREJADO = (
+    "(es_json = 0 AND es_xml = 0 AND folio_norm IS NOT NULL AND folio_norm IN ("
+    "SELECT folio_norm FROM facturas WHERE categoria = ? AND es_xml = 1 AND folio_norm IS NOT NULL))"
+)
+
+
+def contar(categoria, origen=None):
+    sincronizar(categoria)
+    conn = _conexion()
+    sql = f"SELECT COUNT(*) FROM facturas WHERE categoria = ? AND NOT {PDF_EMPAREJADO}"
+    params = [categoria, categoria]
+    if origen is not None:
+        sql += " AND origen = ?"
+        params.append(origen)
+    return conn.execute(sql, params).fetchone()[0]
+
+
+def pareja(categoria, archivo):
+    """El otro archivo de un par PDF/XML con el mismo folio fiscal, o None."""
+    sincronizar(categoria)
+    return _pareja(_conexion(), categoria, archivo)
+
+
+def _pareja(conn, categoria, archivo):
+    fila = conn.execute(
+        "SELECT es_json, es_xml, folio_norm FROM facturas WHERE categoria = ? AND archivo = ?", (categoria, archivo)
+    ).fetchone()
+    if fila is None or fila["es_json"] or fila["folio_norm"] is None:
+        return None
+    row = conn.execute(
+        "SELECT archivo FROM facturas WHERE categoria = ? AND folio_norm = ? AND es_json = 0 AND es_xml = ? "
+        "ORDER BY archivo LIMIT 1",
+        (categoria, fila["folio_norm"], 0 if fila["es_xml"] else 1),
+    ).fetchone()
+    return row["archivo"] if row else None
+
+
+# Misma condición que PDF_EMPAREJADO pero correlacionada, para consultas de
+# varias categorías: la fila `f` es visible (no es un PDF representado por su XML)
+VISIBLE_GLOBAL = (
+    "(f.es_json = 1 OR f.es_xml = 1 OR NOT EXISTS ("
+    "SELECT 1 FROM facturas x WHERE x.categoria = f.categoria AND x.folio_norm = f.folio_norm AND x.es_xml = 1))"
+)
+
+
+def _categorias_vigentes(categorias):
+    """Categorías de la estructura (o las indicadas), ya sincronizadas con el disco."""
+    if categorias is None:
+        categorias = estructura.categorias()
+    for categoria in categorias:
+        sincronizar(categoria)
+    return list(categorias)
+
+
+def ubicaciones_folio(folio, excluir=None, categorias=None):
+    """
+    Dónde está registrado un folio fiscal (búsqueda por índice, sin extraer
+    nada): lista de {"categoria", "archivo"}. `excluir` = (categoria, archivo)
+    omite ese archivo y su pareja PDF/XML (es la misma factura).
+    """
+    folio = normalizar_folio(folio)
+    if folio is None:
+        return []
+    categorias = _categorias_vigentes(categorias)
+    conn = _conexion()
+    marcas = ", ".join("?" for _ in categorias)
+    sql = (
+        f"SELECT categoria, archivo FROM facturas f "
+        f"WHERE folio_norm = ? AND categoria IN ({marcas}) AND {VISIBLE_GLOBAL}"
+    )
+    params = [folio] + categorias
+    if excluir is not None:
+        categoria, archivo = excluir
+        propia = conn.execute(
+            "SELECT es_json, es_xml FROM facturas WHERE categoria = ? AND archivo = ?", (categoria, archivo)
+        ).fetchone()
+        sql += " AND NOT (categoria = ? AND archivo = ?)"
+        params += [categoria, archivo]
+        if propia is not None and not propia["es_json"]:
+            sql += " AND NOT (categoria = ? AND es_json = 0 AND es_xml != ?)"
+            params += [categoria, propia["es_xml"]]
+    sql += " ORDER BY categoria, archivo"
+    return [{"categoria": r["categoria"], "archivo": r["archivo"]} for r in conn.execute(sql, params)]
+
+
+def duplicados_de(categoria, archivo):
+    """Otras ubicaciones del folio fiscal de un archivo ya indexado ([] si no tiene folio aún)."""
+    row = _conexion().execute(
+        "SELECT folio_norm FROM facturas WHERE categoria = ? AND archivo = ?", (categoria, archivo)
+    ).fetchone()
+    if row is None or row["folio_norm"] is None:
+        return []
+    return ubicaciones_folio(row["folio_norm"], excluir=(categoria, archivo))
+
+
+def reporte_duplicados(categorias=None):
+    """
+    Folios fiscales que aparecen más de una vez entre las categorías (contando
+    cada par PDF/XML una sola vez). Los PDF aún no extraídos no tienen folio:
+    se informan como pendientes.
+    """
+    categorias = _categorias_vigentes(categorias)
+    conn = _conexion()
+    marcas = ", ".join("?" for _ in categorias)
+    filas = conn.execute(f"""
+        WITH visibles AS (
+            SELECT folio_norm, folio_fiscal, categoria, archivo, origen, nombre_emisor, rfc_emisor, subtotal, total_neto
+            FROM facturas f
+            WHERE folio_norm IS NOT NULL AND error IS NULL AND categoria IN ({marcas}) AND {VISIBLE_GLOBAL}
+        )
+        SELECT * FROM visibles
+        WHERE folio_norm IN (SELECT folio_norm FROM visibles GROUP BY folio_norm HAVING COUNT(*) > 1)
+        ORDER BY folio_norm, categoria, archivo
+    """, list(categorias)).fetchall()
+
+    grupos = {}
+    for fila in filas:
+        grupo = grupos.setdefault(fila["folio_norm"], {"folio_fiscal": fila["folio_fiscal"], "ubicaciones": []})
+        grupo["ubicaciones"].append({
+            "categoria": fila["categoria"],
+            "archivo": fila["archivo"],
+            "origen": fila["origen"],
+            "nombre_emisor": fila["nombre_emisor"],
+            "rfc_emisor": fila["rfc_emisor"],
+            "monto": fila["subtotal"] if fila["subtotal"] is not None else fila["total_neto"],
+        })
+    pendientes = conn.execute(
+        f"SELECT COUNT(*) FROM facturas WHERE categoria IN ({marcas}) AND es_json = 0 AND es_xml = 0 AND pendiente = 1",
+        list(categorias),
+    ).fetchone()[0]
+    return {"duplicados": list(grupos.values()), "pdfs_sin_extraer": pendientes}
+
+
+def _consulta_busqueda(texto, campo=None):
+    """
+    'juan pér' -> '"juan"* AND "pér"*' (cada palabra como prefijo). El
+    tokenizador de FTS5 quita acentos y mayúsculas de ambos lados.
+    """
+    palabras = re.findall(r"[^\W_]+", texto or "")
+    if not palabras:
+        return None
+    consulta = " AND ".join(f'"{p}"*' for p in palabras)
+    if campo is not None:
+        consulta = f"{campo} : ({consulta})"
+    return consulta
+
+
+def buscar(texto, campo=None, offset=0, limit=20, categorias=None):
+    """
+    Facturas cuyo folio, RFCs, nombres o puesto contienen palabras que
+    empiezan con las del texto. Devuelve (total, resultados); los más
+    relevantes primero. Los PDF aún no extraídos no tienen campos que buscar.
+    """
+    if campo is not None and campo not in CAMPOS_TEXTO:
+        raise ValueError(f"Campo no válido: {campo}")
+    consulta = _consulta_busqueda(texto, campo)
+    if consulta is None:
+        return 0, []
+
+    categorias = _categorias_vigentes(categorias)
+    conn = _conexion()
+    marcas = ", ".join("?" for _ in categorias)
+    desde = f"""
+        FROM busqueda JOIN facturas f ON f.rowid = busqueda.rowid
+        WHERE busqueda MATCH ? AND f.categoria IN ({marcas}) AND {VISIBLE_GLOBAL}
+    """
+    params = [consulta] + categorias
+    total = conn.execute(f"SELECT COUNT(*) {desde}", params).fetchone()[0]
+    filas = conn.execute(
+        f"SELECT f.* {desde} ORDER BY bm25(busqueda), f.categoria, f.clave_orden, f.archivo_orden LIMIT ? OFFSET ?",
+        params + [limit, offset],
+    ).fetchall()
+
+    resultados = []
+    for fila in filas:
+        resultado = {"categoria": fila["categoria"], "archivo": fila["archivo"], "origen": fila["origen"]}
+        for campo_texto in CAMPOS_TEXTO:
+            resultado[campo_texto] = fila[campo_texto]
+        resultado["subtotal"] = fila["subtotal"]
+        resultado["total_neto"] = fila["total_neto"]
+        resultados.append(resultado)
+    return total, resultados
+
+
+def _pdfs_emparejados(conn, categoria, filas):
+    """{folio_norm: archivo PDF} para los XML de `filas` que tienen su PDF."""
+    folios = list({f["folio_norm"] for f in filas if f["es_xml"] and f["folio_norm"]})
+    if not folios:
+        return {}
+    marcas = ", ".join("?" for _ in folios)
+    pdfs = {}
+    for row in conn.execute(
+        f"SELECT folio_norm, archivo FROM facturas WHERE categoria = ? AND es_json = 0 AND es_xml = 0 "
+        f"AND folio_norm IN ({marcas}) ORDER BY archivo",
+        [categoria] + folios,
+    ):
+        pdfs.setdefault(row["folio_norm"], row["archivo"])
+    return pdfs
+
+
+def datos_de_archivos(categoria, archivos):
+    """
+    {archivo: datos} de los archivos indicados que existen en el índice; los
+    PDF pendientes se extraen juntos (caché + pool). Los que fallan no aparecen.
+    """
+    sincronizar(categoria)
+    conn = _conexion()
+    marcas = ", ".join("?" for _ in archivos)
+    consulta = f"SELECT * FROM facturas WHERE categoria = ? AND archivo IN ({marcas})"
+    filas = conn.execute(consulta, [categoria, *archivos]).fetchall()
+    if _resolver_pendientes(conn, filas):
+        filas = conn.execute(consulta, [categoria, *archivos]).fetchall()
+    return {f["archivo"]: json.loads(f["datos"]) for f in filas if f["datos"]}
+
+
+def buscar_por_nombre_limpio(categoria, limpio):
+    """Archivo de la categoría cuyo nombre sin etiqueta coincide (o None)."""
+    sincronizar(categoria)
+    row = _conexion().execute(
+        "SELECT archivo FROM facturas WHERE categoria = ? AND nombre_limpio = ? ORDER BY archivo LIMIT 1",
+        (categoria, limpio),
+    ).fetchone()
+    return row["archivo"] if row else None
+
+
+# Órdenes disponibles en el listado: expresión SQL del valor (None = solo por
+# nombre). Siempre se desempata por nombre sin etiqueta y luego nombre completo,
+# así un cambio de origen no mueve la factura de lugar.
+ORDENES = {
+    "nombre": None,
+    "subtotal": "COALESCE(subtotal, 0)",
+    "emisor": "COALESCE(nombre_emisor, '') COLLATE NOCASE",
+    "rfc": "COALESCE(rfc_emisor, '')",
+    "fecha": "COALESCE(fecha, '')",
+}
+
+# Filtros sobre columnas extraídas: (condición SQL, cómo se transforma el valor)
+FILTROS = {
+    "rfc": ("rfc_emisor LIKE ? ESCAPE '\\'", lambda v: _escapar_like(v.strip().upper()) + "%"),
+    "emisor": ("nombre_emisor LIKE ? ESCAPE '\\'", lambda v: "%" + _escapar_like(v.strip()) + "%"),
+    "subtotal_min": ("COALESCE(subtotal, 0) >= ?", float),
+    "subtotal_max": ("COALESCE(subtotal, 0) <= ?", float),
+    # Fecha de emisión (AAAA-MM-DD, ya normalizada); sin fecha no entra en ningún periodo
+    "desde": ("fecha >= ?", str),
+    "hasta": ("fecha <= ?", str),
+}
+
+
+def _escapar_like(valor):
+    return valor.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _columnas_orden(orden):
+    expr = ORDENES[orden]
+    return ([expr] if expr else []) + ["clave_orden", "archivo_orden"]
+
+
+def _consultar_pagina(conn, categoria, origen, offset, limit, orden="nombre", descendente=False, filtros=None, despues=None, grupo=None):
+    """
+    `despues` es la llave de la última fila entregada: se continúa con las
+    filas cuya llave sin el nombre completo (valor de orden + nombre sin
+    etiqueta) es mayor, para que cambiar la etiqueta de origen de esa fila no
+    la haga aparecer otra vez. `grupo` pide las filas restantes con la misma
+    llave que la última entregada (mismo nombre con distinta etiqueta).
+    """
+    columnas = _columnas_orden(orden)
+    sql = "SELECT *, " + ", ".join(f"{c} AS _orden_{i}" for i, c in enumerate(columnas)) + " FROM facturas WHERE categoria = ?"
+    sql += f" AND NOT {PDF_EMPAREJADO}"
+    params = [categoria, categoria]
+    if origen is not None:
+        sql += " AND origen = ?"
+        params.append(origen)
+    for nombre, valor in (filtros or {}).items():
+        condicion, convertir = FILTROS[nombre]
+        sql += f" AND {condicion}"
+        params.append(convertir(valor))
+    comparador = "<" if descendente else ">"
+    llave = columnas[:-1]
+    if despues:
+        sql += f" AND ({', '.join(llave)}) {comparador} ({', '.join('?' for _ in llave)})"
+        params += list(despues[:-1])
+    if grupo is not None:
+        sql += f" AND ({', '.join(llave)}) = ({', '.join('?' for _ in llave)}) AND archivo_orden {comparador} ?"
+        params += list(grupo)
+    direccion = " DESC" if descendente else ""
+    sql += " ORDER BY " + ", ".join(c + direccion for c in columnas) + " LIMIT ? OFFSET ?"
+    params += [limit, offset]
+    return conn.execute(sql, params).fetchall()
+
+
+def _clave_fila(fila, orden):
+    return [fila[f"_orden_{i}"] for i in range(len(_columnas_orden(orden)))]
+
+
+def _vigentes(categoria, filas):
+    """
+    Revisa tamaño/mtime de las filas de la página (ediciones en sitio no cambian
+    el mtime de la carpeta). Devuelve False si algún archivo desapareció.
+    """
+    conn = _conexion()
+    metricas.archivos_escaneados(len(filas), "vigencia")
+    for fila in filas:
+        try:
+            st = os.stat(os.path.join(CARPETA_FACTURAS, categoria, fila["archivo"]))
+        except FileNotFoundError:
+            return False
+        if st.st_size != fila["size"] or st.st_mtime_ns != fila["mtime_ns"]:
+            with conn:
+                _insertar(conn, _leer_fila(categoria, fila["archivo"], extraer=False))
+    return True
+
+
+def _pagina(categoria, origen, offset, limit, orden="nombre", descendente=False, filtros=None, despues=None, completar_grupo=False):
+    if orden not in ORDENES:
+        raise ValueError(f"Orden no válido: {orden}")
+    for nombre in filtros or {}:
+        if nombre not in FILTROS:
+            raise ValueError(f"Filtro no válido: {nombre}")
+
+    sincronizar(categoria)
+    conn = _conexion()
+    if orden != "nombre" or filtros:
+        # Ordenar o filtrar por campos extraídos requiere que toda la categoría
+        # esté extraída (una sola vez: después sale del índice)
+        pendientes = conn.execute(
+            "SELECT * FROM facturas WHERE categoria = ? AND es_json = 0 AND es_xml = 0 AND (pendiente = 1 OR version != ?)",
+            (categoria, EXTRACTOR_VERSION),
+        ).fetchall()
+        _resolver_pendientes(conn, pendientes)
+
+    def consultar():
+        filas = _consultar_pagina(conn, categoria, origen, offset, limit, orden, descendente, filtros, despues)
+        if completar_grupo and filas and len(filas) == limit:
+            # Una página por cursor no parte un grupo con la misma llave
+            filas += _consultar_pagina(
+                conn, categoria, origen, 0, -1, orden, descendente, filtros,
+                grupo=_clave_fila(filas[-1], orden),
+            )
+        return filas
+
+    filas = consultar()
+    if not _vigentes(categoria, filas):
+        sincronizar(categoria, forzar=True)
+    filas = consultar()
+
+    errores = _resolver_pendientes(conn, filas)
+    if errores is None:
+        errores = {}
+    else:
+        filas = consultar()
+    pdfs = _pdfs_emparejados(conn, categoria, filas)
+    return filas, [
+        a_registro(fila, errores.get(fila["archivo"]), pdfs.get(fila["folio_norm"]) if fila["es_xml"] else None)
+        for fila in filas
+    ]
+
+
+def listar(categoria, origen=None, offset=0, limit=10, orden="nombre", descendente=False, filtros=None):
+    """
+    Página de registros con la forma que devuelve /api/procesar, ordenada por
+    nombre sin etiqueta (y nombre completo para desempatar) o por `orden`.
+    """
+    return _pagina(categoria, origen, offset, limit, orden, descendente, filtros)[1]
+
+
+def listar_cursor(categoria, origen=None, cursor=None, limit=50, orden="nombre", descendente=False, filtros=None):
+    """
+    Paginación por cursor: devuelve (registros, cursor siguiente o None). El
+    cursor guarda la llave de orden de la última fila, así que pedir la página
+    N cuesta lo mismo que la primera.
+    """
+    despues = None
+    if cursor:
+        datos_cursor = decodificar_cursor(cursor)
+        if datos_cursor["o"] != orden or datos_cursor["d"] != descendente:
+            raise ValueError("El cursor corresponde a otro orden")
+        despues = datos_cursor["k"]
+
+    filas, registros = _pagina(categoria, origen, 0, limit, orden, descendente, filtros, despues, completar_grupo=True)
+    siguiente = None
+    if len(filas) >= limit and filas:
+        siguiente = codificar_cursor(orden, descendente, _clave_fila(filas[-1], orden))
+    return registros, siguiente
+
+
+def codificar_cursor(orden, descendente, clave):
+    contenido = json.dumps({"o": orden, "d": descendente, "k": clave}, ensure_ascii=False)
+    return base64.urlsafe_b64encode(contenido.encode('utf-8')).decode('ascii').rstrip("=")
+
+
+def decodificar_cursor(cursor):
+    try:
+        relleno = "=" * (-len(cursor) % 4)
+        datos_cursor = json.loads(base64.urlsafe_b64decode(cursor + relleno).decode('utf-8'))
+        if datos_cursor["o"] not in ORDENES or not isinstance(datos_cursor["k"], list):
+            raise ValueError()
+        if len(datos_cursor["k"]) != len(_columnas_orden(datos_cursor["o"])):
+            raise ValueError()
+        return datos_cursor
+    except Exception:
+        raise ValueError("Cursor inválido")
+
+
+def iterar(categoria, origen=None, offset=0, limit=10, orden="nombre", descendente=False, filtros=None, tam_bloque=None):
+    """
+    Igual que listar() pero genera los registros por bloques (por defecto del
+    tamaño del pool de extracción), para poder enviarlos en cuanto están
+    listos. Cada bloque se consulta por separado (continuando por llave desde
+    el anterior), así que no se retiene la página completa ni una conexión
+    entre bloques. Con limit=None se recorre la categoría completa.
+    """
+    tam_bloque = tam_bloque or max(1, motor_extraccion.MAX_WORKERS)
+    enviados = 0
+    despues = None
+    while limit is None or enviados < limit:
+        n = tam_bloque if limit is None else min(tam_bloque, limit - enviados)
+        if despues is None:
+            filas, registros = _pagina(categoria, origen, offset, n, orden, descendente, filtros, completar_grupo=True)
+        else:
+            filas, registros = _pagina(categoria, origen, 0, n, orden, descendente, filtros, despues, completar_grupo=True)
+        yield from registros
+        if len(filas) < n:
+            break
+        enviados += len(filas)
+        despues = _clave_fila(filas[-1], orden)
+
+
+def a_registro(fila, error=None, archivo_pdf=None):
+    archivo = fila["archivo"]
+    origen = fila["origen"]
+    error = error or fila["error"]
+    if error:
+        return {"archivo": archivo, "origen": origen, "status": "error", "error_msg": str(error)}
+
+    data = json.loads(fila["datos"])
+    data["archivo"] = archivo
+    if fila["es_json"]:
+        # En los manuales el campo "origen" guardado manda sobre la etiqueta
+        if "origen" not in data:
+            data["origen"] = origen
+    else:
+        data["origen"] = origen
+    if archivo_pdf:
+        data["archivo_pdf"] = archivo_pdf
+    data["status"] = "success"
+    return data
+
+
+def completar_pendientes(categoria):
+    """Sincroniza la categoría y extrae los PDF que todavía no tienen datos (para el resumen)."""
+    sincronizar(categoria)
+    conn = _conexion()
+    pendientes = conn.execute(
+        "SELECT * FROM facturas WHERE categoria = ? AND es_json = 0 AND es_xml = 0 AND (pendiente = 1 OR version != ?)",
+        (categoria, EXTRACTOR_VERSION),
+    ).fetchall()
+    for archivo, e in (_resolver_pendientes(conn, pendientes) or {}).items():
+        print(f"Error procesando monto de {archivo}: {e}")
+        metricas.ERRORES.inc("resumen")
+
+
+def filas_resumen(categoria):
+    """
+    (versión, filas) de una categoría leídas en la misma transacción: origen,
+    es_campo, centavos, rfc_emisor, nombre_emisor y fecha de cada factura que
+    cuenta en el resumen (los PDF representados por su XML no cuentan dos
+    veces), ordenadas por fecha (las que no tienen, primero).
+    """
+    sincronizar(categoria)
+    conn = _conexion()
+    conn.execute("BEGIN")
+    try:
+        ver = _version(conn, categoria)
+        filas = conn.execute(f"""
+            SELECT origen, es_campo, centavos, rfc_emisor, nombre_emisor, fecha FROM facturas
+            WHERE categoria = ? AND NOT {PDF_EMPAREJADO}
+            ORDER BY fecha
+        """, (categoria, categoria)).fetchall()
+    finally:
+        conn.commit()
+    return ver, filas
@@ -0,0 +1,366 @@
+# ingesta.py
+# Extracción en segundo plano de los PDFs recién subidos.
+#
+# /api/subir solo copia los archivos y encola un trabajo; un hilo de fondo los
+# pasa por el motor de extracción para que el resultado ya esté en caché cuando
+# alguien abra el listado. El avance de cada trabajo se consulta en /api/jobs.
+#
+# La cola es del proceso que recibió la subida, pero el estado de los trabajos
+# vive en SQLite (INGESTA_DB): con varios workers, /api/jobs/{id} responde
+# igual sin importar qué proceso atienda la consulta.
+#
+# Cada trabajo anota a su dueño (DUENO, uno por proceso), que mientras vive
+# tiene tomado el candado "ingesta:<dueño>". Si el proceso muere con trabajos
+# sin terminar, el candado queda libre: recuperar() (al arrancar, o al
+# consultar uno de esos trabajos) los adopta y sigue con los archivos que
+# faltaban.
+#
+# Los archivos que escribe el propio servidor se anuncian (anunciar) antes de
+# aparecer en la carpeta; el vigilante no encola los anunciados ni los que ya
+# están en un trabajo sin terminar (ver cubiertos).
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+
+import archivos
+import indice
+import motor_extraccion
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+INGESTA_DB = os.path.join(BASE_DIR, 'ingesta.db')
+
+# Incrementar al cambiar el esquema: los trabajos guardados se descartan
+VERSION_ESQUEMA = 2
+
+# Trabajos terminados que se conservan para consulta
+MAX_TRABAJOS = 200
+# Un trabajo sin terminar más viejo que esto se da por abandonado y se poda
+VENCIMIENTO_TRABAJO = 24 * 3600
+# Lo que dura un anuncio si la subida nunca llega a encolar el archivo
+VENCIMIENTO_ANUNCIO = 600
+
+# Identifica a este proceso como dueño de sus trabajos
+DUENO = uuid.uuid4().hex
+
+_cola = queue.Queue()
+_lock = threading.Lock()
+_hilo = None
+_candado = None  # archivos.Exclusivo("ingesta:" + DUENO), tomado mientras viva el proceso
+_local = threading.local()
+
+
+def _conexion():
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(INGESTA_DB, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        with archivos.bloqueo("ingesta.db"):
+            if conn.execute("PRAGMA user_version").fetchone()[0] != VERSION_ESQUEMA:
+                conn.executescript("""
+                    DROP TABLE IF EXISTS trabajos;
+                    DROP TABLE IF EXISTS trabajo_archivos;
+                    DROP TABLE IF EXISTS anuncios;
+                """)
+                conn.execute(f"PRAGMA user_version = {VERSION_ESQUEMA}")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS trabajos (
+                    id TEXT PRIMARY KEY,
+                    categoria TEXT NOT NULL,
+                    carpeta TEXT NOT NULL,
+                    dueno TEXT NOT NULL,
+                    estado TEXT NOT NULL,
+                    creado REAL NOT NULL,
+                    terminado REAL,
+                    total INTEGER NOT NULL,
+                    procesados INTEGER NOT NULL DEFAULT 0,
+                    errores INTEGER NOT NULL DEFAULT 0,
+                    duplicados INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE INDEX IF NOT EXISTS idx_trabajos_creado ON trabajos(estado, creado);
+                CREATE TABLE IF NOT EXISTS trabajo_archivos (
+                    trabajo TEXT NOT NULL,
+                    posicion INTEGER NOT NULL,
+                    archivo TEXT NOT NULL,
+                    estado TEXT NOT NULL,
+                    error_msg TEXT,
+                    duplicados TEXT,
+                    PRIMARY KEY (trabajo, posicion)
+                );
+                CREATE INDEX IF NOT EXISTS idx_trabajo_archivos_archivo ON trabajo_archivos(archivo);
+                CREATE TABLE IF NOT EXISTS anuncios (
+                    categoria TEXT NOT NULL,
+                    archivo TEXT NOT NULL,
+                    vence REAL NOT NULL,
+                    PRIMARY KEY (categoria, archivo)
+                );
+            """)
+            conn.commit()
+        _local.conn = conn
+    return conn
+
+
+def _iniciar_hilo():
+    global _hilo, _candado
+    with _lock:
+        if _candado is None:
+            _candado = archivos.Exclusivo("ingesta:" + DUENO)
+        if _hilo is None or not _hilo.is_alive():
+            _hilo = threading.Thread(target=_procesar_cola, name="ingesta", daemon=True)
+            _hilo.start()
+
+
+def _podar(conn):
+    """
+    Descarta los trabajos terminados más antiguos, los que llevan más de
+    VENCIMIENTO_TRABAJO sin terminar y los anuncios vencidos (dentro de la
+    transacción de encolar).
+    """
+    ahora = time.time()
+    viejos = [
+        r["id"] for r in conn.execute(
+            "SELECT id FROM trabajos WHERE estado != 'terminado' AND creado < ?", (ahora - VENCIMIENTO_TRABAJO,)
+        )
+    ]
+    sobrantes = conn.execute("SELECT COUNT(*) FROM trabajos").fetchone()[0] - len(viejos) - MAX_TRABAJOS
+    if sobrantes > 0:
+        viejos += [
+            r["id"] for r in conn.execute(
+                "SELECT id FROM trabajos WHERE estado = 'terminado' ORDER BY creado LIMIT ?", (sobrantes,)
+            )
+        ]
+    conn.executemany("DELETE FROM trabajo_archivos WHERE trabajo = ?", [(i,) for i in viejos])
+    conn.executemany("DELETE FROM trabajos WHERE id = ?", [(i,) for i in viejos])
+    conn.execute("DELETE FROM anuncios WHERE vence < ?", (ahora,))
+
+
+def anunciar(categoria, archivo):
+    """El servidor va a escribir este archivo y lo encolará él mismo: el vigilante no lo encola."""
+    conn = _conexion()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO anuncios (categoria, archivo, vence) VALUES (?, ?, ?)",
+            (categoria, archivo, time.time() + VENCIMIENTO_ANUNCIO),
+        )
+
+
+def cubiertos(categoria, nombres):
+    """Los de `nombres` anunciados o pendientes en un trabajo sin terminar."""
+    conn = _conexion()
+    marcas = ",".join("?" * len(nombres))
+    if not marcas:
+        return set()
+    anunciados = conn.execute(
+        f"SELECT archivo FROM anuncios WHERE categoria = ? AND vence >= ? AND archivo IN ({marcas})",
+        [categoria, time.time(), *nombres],
+    )
+    en_trabajo = conn.execute(
+        f"""
+        SELECT a.archivo FROM trabajo_archivos a JOIN trabajos t ON t.id = a.trabajo
+        WHERE t.categoria = ? AND t.estado != 'terminado'
+          AND a.estado IN ('pendiente', 'procesando') AND a.archivo IN ({marcas})
+        """,
+        [categoria, *nombres],
+    )
+    return {r["archivo"] for r in anunciados} | {r["archivo"] for r in en_trabajo}
+
+
+def encolar(categoria, carpeta, nombres):
+    """Registra un trabajo de extracción para los archivos y devuelve su id."""
+    _iniciar_hilo()
+    job_id = uuid.uuid4().hex
+    conn = _conexion()
+    with conn:
+        conn.execute(
+            "INSERT INTO trabajos (id, categoria, carpeta, dueno, estado, creado, total) VALUES (?, ?, ?, ?, 'en_cola', ?, ?)",
+            (job_id, categoria, carpeta, DUENO, time.time(), len(nombres)),
+        )
+        conn.executemany(
+            "INSERT INTO trabajo_archivos (trabajo, posicion, archivo, estado) VALUES (?, ?, ?, 'pendiente')",
+            [(job_id, i, a) for i, a in enumerate(nombres)],
+        )
+        # Ya los cubre el trabajo
+        conn.executemany("DELETE FROM anuncios WHERE categoria = ? AND archivo = ?", [(categoria, a) for a in nombres])
+        _podar(conn)
+    _cola.put(job_id)
+    return job_id
+
+
+def cerrar():
+    """Al apagar: suelta el candado de dueño (otro worker podrá adoptar lo que quede)."""
+    with _lock:
+        if _candado is not None:
+            _candado.soltar(borrar=True)
+
+
+def recuperar(duenos=None):
+    """
+    Adopta los trabajos sin terminar cuyos dueños ya no viven (todos los
+    ajenos, o solo los de `duenos`) y los encola en este proceso.
+    """
+    conn = _conexion()
+    if duenos is None:
+        duenos = [
+            r["dueno"] for r in conn.execute(
+                "SELECT DISTINCT dueno FROM trabajos WHERE estado != 'terminado' AND dueno != ?", (DUENO,)
+            )
+        ]
+    adoptados = []
+    for dueno in duenos:
+        candado = archivos.Exclusivo("ingesta:" + dueno)
+        if not candado.tomado:
+            continue  # sigue vivo
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                ids = [
+                    r["id"] for r in conn.execute(
+                        "SELECT id FROM trabajos WHERE dueno = ? AND estado != 'terminado' ORDER BY creado", (dueno,)
+                    )
+                ]
+                conn.executemany("UPDATE trabajos SET dueno = ?, estado = 'en_cola' WHERE id = ?", [(DUENO, i) for i in ids])
+                # Lo que quedó a medio extraer se vuelve a extraer
+                conn.executemany(
+                    "UPDATE trabajo_archivos SET estado = 'pendiente' WHERE trabajo = ? AND estado = 'procesando'",
+                    [(i,) for i in ids],
+                )
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+        finally:
+            candado.soltar(borrar=True)
+        adoptados += ids
+
+    if adoptados:
+        _iniciar_hilo()
+        for job_id in adoptados:
+            _cola.put(job_id)
+    return adoptados
+
+
+def obtener(job_id):
+    conn = _conexion()
+    fila = conn.execute("SELECT estado, dueno FROM trabajos WHERE id = ?", (job_id,)).fetchone()
+    if fila is None:
+        return None
+    if fila["estado"] != "terminado" and fila["dueno"] != DUENO:
+        # Si el worker que lo tenía murió, este lo retoma
+        recuperar([fila["dueno"]])
+
+    # Trabajo y archivos de la misma instantánea
+    conn.execute("BEGIN")
+    try:
+        fila = conn.execute("SELECT * FROM trabajos WHERE id = ?", (job_id,)).fetchone()
+        entradas = conn.execute(
+            "SELECT archivo, estado, error_msg, duplicados FROM trabajo_archivos WHERE trabajo = ? ORDER BY posicion",
+            (job_id,),
+        ).fetchall()
+    finally:
+        conn.commit()
+    if fila is None:
+        return None
+
+    trabajo = {k: fila[k] for k in ("id", "categoria", "estado", "creado", "terminado", "total", "procesados", "errores", "duplicados")}
+    trabajo["archivos"] = []
+    for e in entradas:
+        entrada = {"archivo": e["archivo"], "estado": e["estado"]}
+        if e["error_msg"] is not None:
+            entrada["error_msg"] = e["error_msg"]
+        if e["duplicados"] is not None:
+            entrada["duplicados"] = json.loads(e["duplicados"])
+        trabajo["archivos"].append(entrada)
+    return trabajo
+
+
+def _procesar_cola():
+    while True:
+        job_id = _cola.get()
+        try:
+            _procesar(job_id)
+        except Exception as e:
+            print(f"Error en trabajo de ingesta {job_id}: {e}")
+        finally:
+            _cola.task_done()
+
+
+def _terminar_archivo(conn, job_id, posicion, error=None, duplicados=None):
+    """Deja el archivo en listo o error y suma al avance del trabajo."""
+    with conn:
+        conn.execute(
+            "UPDATE trabajo_archivos SET estado = ?, error_msg = ?, duplicados = ? WHERE trabajo = ? AND posicion = ?",
+            (
+                "error" if error is not None else "listo",
+                error,
+                json.dumps(duplicados, ensure_ascii=False) if duplicados else None,
+                job_id,
+                posicion,
+            ),
+        )
+        conn.execute(
+            "UPDATE trabajos SET procesados = procesados + 1, errores = errores + ?, duplicados = duplicados + ? WHERE id = ?",
+            (error is not None, bool(duplicados), job_id),
+        )
+
+
+def _procesar(job_id):
+    conn = _conexion()
+    with conn:
+        trabajo = conn.execute("SELECT categoria, carpeta FROM trabajos WHERE id = ? AND dueno = ?", (job_id, DUENO)).fetchone()
+        if trabajo is None:
+            return
+        conn.execute("UPDATE trabajos SET estado = 'procesando' WHERE id = ?", (job_id,))
+    carpeta = trabajo["carpeta"]
+    categoria = trabajo["categoria"]
+
+    try:
+        # Un trabajo retomado sigue con los que faltaban
+        entradas = conn.execute(
+            "SELECT posicion, archivo FROM trabajo_archivos WHERE trabajo = ? AND estado = 'pendiente' ORDER BY posicion",
+            (job_id,),
+        ).fetchall()
+
+        # Bloques del tamaño del pool: mantiene los procesos ocupados y el avance visible
+        tam_bloque = max(1, motor_extraccion.MAX_WORKERS)
+        for inicio in range(0, len(entradas), tam_bloque):
+            bloque = entradas[inicio:inicio + tam_bloque]
+            with conn:
+                conn.executemany(
+                    "UPDATE trabajo_archivos SET estado = 'procesando' WHERE trabajo = ? AND posicion = ?",
+                    [(job_id, e["posicion"]) for e in bloque],
+                )
+
+            rutas = [os.path.join(carpeta, e["archivo"]) for e in bloque]
+            resultados = motor_extraccion.extraer_lote(rutas)
+
+            for entrada, datos in zip(bloque, resultados):
+                if isinstance(datos, Exception):
+                    _terminar_archivo(conn, job_id, entrada["posicion"], error=str(datos))
+                    continue
+                # Primero el índice (para que el listado no extraiga nada) y
+                # después el estado: "listo" significa que ya está en el listado
+                try:
+                    indice.guardar_extraccion(categoria, entrada["archivo"], datos)
+                    # Con el folio ya extraído se puede avisar si el CFDI estaba registrado
+                    duplicados = indice.duplicados_de(categoria, entrada["archivo"])
+                except Exception as e:
+                    _terminar_archivo(conn, job_id, entrada["posicion"], error=f"No se pudo indexar: {e}")
+                    continue
+                _terminar_archivo(conn, job_id, entrada["posicion"], duplicados=duplicados)
+    finally:
+        # Pase lo que pase, el trabajo termina: lo que no se llegó a procesar queda como error
+        with conn:
+            faltantes = conn.execute(
+                "UPDATE trabajo_archivos SET estado = 'error', error_msg = 'Trabajo interrumpido' "
+                "WHERE trabajo = ? AND estado IN ('pendiente', 'procesando')",
+                (job_id,),
+            ).rowcount
+            conn.execute(
+                "UPDATE trabajos SET estado = 'terminado', terminado = ?, procesados = procesados + ?, errores = errores + ? WHERE id = ?",
+                (time.time(), faltantes, faltantes, job_id),
+            )
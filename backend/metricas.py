@@ -0,0 +1,226 @@
+# metricas.py
+# Métricas del proceso en formato de texto de Prometheus (GET /metrics).
+#
+# Todo vive en memoria del proceso, sin dependencias ni servicios externos:
+# contadores e histogramas con etiquetas, cada uno con su lock. Los valores se
+# reinician al reiniciar el servidor (Prometheus lo maneja con rate()).
+#
+# Las extracciones que corren en el pool de procesos se miden en el proceso
+# hijo y se registran aquí al recibir el resultado (ver motor_extraccion).
+import contextvars
+import threading
+import time
+
+from extractor import CAMPOS_MONTO, CAMPOS_REQUERIDOS
+
+# Límites superiores de las cubetas, en segundos
+CUBETAS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+CUBETAS_EXTRACCION = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60)
+CUBETAS_ARCHIVOS = (0, 1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000, 10000)
+
+_metricas = []
+
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _etiquetas(nombres, valores, extra=None):
+    pares = list(zip(nombres, valores))
+    if extra:
+        pares.append(extra)
+    if not pares:
+        return ""
+    return "{" + ",".join(f'{n}="{_escapar(v)}"' for n, v in pares) + "}"
+
+
+def _numero(valor):
+    if valor == float("inf"):
+        return "+Inf"
+    if isinstance(valor, float) and valor.is_integer():
+        return str(int(valor))
+    return repr(valor)
+
+
+class Contador:
+    """Valor que solo crece, con una serie por combinación de etiquetas."""
+
+    tipo = "counter"
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._valores = {}
+        self._lock = threading.Lock()
+        _metricas.append(self)
+
+    def inc(self, *etiquetas, valor=1):
+        with self._lock:
+            self._valores[etiquetas] = self._valores.get(etiquetas, 0) + valor
+
+    def valor(self, *etiquetas):
+        with self._lock:
+            return self._valores.get(etiquetas, 0)
+
+    def _lineas(self):
+        with self._lock:
+            series = sorted(self._valores.items())
+        for etiquetas, valor in series:
+            yield f"{self.nombre}{_etiquetas(self.etiquetas, etiquetas)} {_numero(valor)}"
+
+
+class Histograma:
+    """Cuenta observaciones por cubeta (acumulada, como pide Prometheus), suma y total."""
+
+    tipo = "histogram"
+
+    def __init__(self, nombre, ayuda, etiquetas=(), cubetas=CUBETAS_LATENCIA):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self.cubetas = tuple(sorted(cubetas))
+        self._series = {}  # etiquetas -> [conteos por cubeta..., suma, total]
+        self._lock = threading.Lock()
+        _metricas.append(self)
+
+    def observar(self, valor, *etiquetas):
+        with self._lock:
+            serie = self._series.get(etiquetas)
+            if serie is None:
+                serie = self._series[etiquetas] = [0] * len(self.cubetas) + [0.0, 0]
+            for i, limite in enumerate(self.cubetas):
+                if valor <= limite:
+                    serie[i] += 1
+                    break
+            serie[-2] += valor
+            serie[-1] += 1
+
+    def _lineas(self):
+        with self._lock:
+            series = sorted((k, list(v)) for k, v in self._series.items())
+        for etiquetas, serie in series:
+            acumulado = 0
+            for limite, conteo in zip(self.cubetas, serie):
+                acumulado += conteo
+                yield f"{self.nombre}_bucket{_etiquetas(self.etiquetas, etiquetas, ('le', _numero(float(limite))))} {acumulado}"
+            yield f"{self.nombre}_bucket{_etiquetas(self.etiquetas, etiquetas, ('le', '+Inf'))} {serie[-1]}"
+            yield f"{self.nombre}_sum{_etiquetas(self.etiquetas, etiquetas)} {_numero(serie[-2])}"
+            yield f"{self.nombre}_count{_etiquetas(self.etiquetas, etiquetas)} {serie[-1]}"
+
+
+PETICIONES = Histograma(
+    "facturas_http_duracion_segundos", "Duración de las peticiones HTTP por ruta",
+    ("metodo", "ruta", "codigo"),
+)
+ARCHIVOS_POR_PETICION = Histograma(
+    "facturas_archivos_escaneados_por_peticion", "Archivos revisados en disco durante una petición",
+    ("ruta",), cubetas=CUBETAS_ARCHIVOS,
+)
+ARCHIVOS_ESCANEADOS = Contador(
+    "facturas_archivos_escaneados_total", "Archivos revisados en disco (listados de carpeta y lecturas)",
+    ("origen",),
+)
+EXTRACCION = Histograma(
+    "facturas_extraccion_duracion_segundos", "Tiempo de extracción de un PDF por backend de texto y resultado",
+    ("backend", "resultado"), cubetas=CUBETAS_EXTRACCION,
+)
+BYTES_SUBIDOS = Contador("facturas_bytes_subidos_total", "Bytes escritos por /api/subir y /api/subir_zip")
+ARCHIVOS_SUBIDOS = Contador("facturas_archivos_subidos_total", "Archivos recibidos por /api/subir y /api/subir_zip", ("status",))
+CACHE = Contador("facturas_cache_total", "Consultas a cachés por resultado (hit/miss)", ("cache", "resultado"))
+ERRORES = Contador("facturas_errores_total", "Errores por archivo que antes solo se imprimían", ("etapa",))
+
+
+# --- Archivos escaneados por petición ---
+
+# Lista de un elemento que comparte toda la petición (también los hilos del
+# threadpool, que heredan el contexto)
+_escaneo_actual = contextvars.ContextVar("escaneo_actual", default=None)
+
+
+def archivos_escaneados(cantidad, origen):
+    if not cantidad:
+        return
+    ARCHIVOS_ESCANEADOS.inc(origen, valor=cantidad)
+    contador = _escaneo_actual.get()
+    if contador is not None:
+        contador[0] += cantidad
+
+
+def cache(nombre, hit):
+    CACHE.inc(nombre, "hit" if hit else "miss")
+
+
+def extraccion(datos, segundos):
+    """Registra una extracción; `datos` es el resultado o la excepción que lanzó."""
+    if isinstance(datos, Exception):
+        backend, resultado = "ninguno", "error"
+    else:
+        backend = datos.get("backend_texto") or "ninguno"
+        if datos.get("backend_texto") is None:
+            resultado = "sin_texto"
+        elif all(datos.get(c) for c in CAMPOS_REQUERIDOS) and any(datos.get(c) for c in CAMPOS_MONTO):
+            resultado = "completo"
+        else:
+            resultado = "incompleto"
+    EXTRACCION.observar(segundos, backend, resultado)
+
+
+def medir_extraccion(funcion, ruta):
+    """
+    Llama funcion(ruta) y devuelve (resultado o excepción, segundos). No toca
+    los contadores, así que se puede correr en un proceso del pool.
+    """
+    inicio = time.perf_counter()
+    try:
+        resultado = funcion(ruta)
+    except Exception as e:
+        resultado = e
+    return resultado, time.perf_counter() - inicio
+
+
+# --- Middleware ASGI ---
+
+class MedirPeticiones:
+    """
+    Mide cada petición HTTP. La ruta se etiqueta con la plantilla de FastAPI
+    ("/api/categoria/{categoria}"), no con la URL, para no crear una serie por
+    cada valor.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        codigo = [500]
+
+        async def enviar(mensaje):
+            if mensaje["type"] == "http.response.start":
+                codigo[0] = mensaje["status"]
+            await send(mensaje)
+
+        contador = [0]
+        token = _escaneo_actual.set(contador)
+        inicio = time.perf_counter()
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            duracion = time.perf_counter() - inicio
+            _escaneo_actual.reset(token)
+            route = scope.get("route")
+            ruta = getattr(route, "path", None) or "sin_ruta"
+            PETICIONES.observar(duracion, scope["method"], ruta, str(codigo[0]))
+            ARCHIVOS_POR_PETICION.observar(contador[0], ruta)
+
+
+def exponer():
+    """Texto de todas las métricas (formato de exposición 0.0.4)."""
+    lineas = []
+    for metrica in _metricas:
+        lineas.append(f"# HELP {metrica.nombre} {metrica.ayuda}")
+        lineas.append(f"# TYPE {metrica.nombre} {metrica.tipo}")
+        lineas.extend(metrica._lineas())
+    return "\n".join(lineas) + "\n"
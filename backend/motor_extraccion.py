@@ -0,0 +1,119 @@
+# motor_extraccion.py
+# Extracción de PDFs en paralelo con un pool de procesos.
+#
+# pdfplumber es Python puro y usa un solo núcleo, así que los lotes grandes
+# (listados y reconstrucción del resumen) se reparten entre procesos. Primero
+# se consulta la caché de extracción y solo los PDFs que faltan van al pool.
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import cache_extraccion
+import metricas
+from extractor import extraer_datos_infalible
+
+# Número de procesos de extracción (por defecto, uno por núcleo)
+MAX_WORKERS = int(os.environ.get("FACTURAS_WORKERS", "0")) or (os.cpu_count() or 1)
+
+# Cada proceso se recicla después de extraer este número de archivos para
+# acotar la memoria que pdfminer va acumulando
+ARCHIVOS_POR_WORKER = int(os.environ.get("FACTURAS_ARCHIVOS_POR_WORKER", "200"))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _obtener_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=MAX_WORKERS,
+                max_tasks_per_child=ARCHIVOS_POR_WORKER,
+            )
+        return _pool
+
+
+def _descartar_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def cerrar():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _extraer_en_pool(rutas):
+    """Extrae las rutas en el pool; si el pool se rompe, termina en este proceso."""
+    pool = _obtener_pool()
+    # El tiempo se mide dentro del proceso hijo: en el padre incluiría la espera en cola
+    futuros = [pool.submit(metricas.medir_extraccion, extraer_datos_infalible, ruta) for ruta in rutas]
+    resultados = []
+    roto = False
+    for ruta, futuro in zip(rutas, futuros):
+        try:
+            if roto:
+                raise BrokenProcessPool()
+            datos, segundos = futuro.result()
+        except BrokenProcessPool:
+            if not roto:
+                roto = True
+                _descartar_pool(pool)
+            datos, segundos = metricas.medir_extraccion(extraer_datos_infalible, ruta)
+        except Exception as e:
+            resultados.append(e)
+            continue
+        metricas.extraccion(datos, segundos)
+        resultados.append(datos)
+    return resultados
+
+
+def extraer_lote(rutas):
+    """
+    Devuelve, en el mismo orden que `rutas`, los datos extraídos de cada PDF.
+    Si un archivo falla (no existe, no se puede leer...) su posición contiene
+    la excepción en lugar de los datos, para que el llamador la reporte como
+    hacía con cada archivo por separado.
+    """
+    resultados = [None] * len(rutas)
+    faltantes = []
+    for i, ruta in enumerate(rutas):
+        try:
+            datos = cache_extraccion.buscar(ruta)
+        except Exception as e:
+            resultados[i] = e
+            continue
+        if datos is None:
+            faltantes.append(i)
+        else:
+            resultados[i] = datos
+
+    if not faltantes:
+        return resultados
+
+    rutas_faltantes = [rutas[i] for i in faltantes]
+    if len(rutas_faltantes) == 1 or MAX_WORKERS <= 1:
+        extraidos = []
+        for ruta in rutas_faltantes:
+            datos, segundos = metricas.medir_extraccion(extraer_datos_infalible, ruta)
+            metricas.extraccion(datos, segundos)
+            extraidos.append(datos)
+    else:
+        extraidos = _extraer_en_pool(rutas_faltantes)
+
+    for i, datos in zip(faltantes, extraidos):
+        resultados[i] = datos
+        if not isinstance(datos, Exception):
+            try:
+                cache_extraccion.guardar(rutas[i], datos)
+            except Exception as e:
+                print(f"Error guardando en caché {rutas[i]}: {e}")
+    return resultados
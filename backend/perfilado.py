@@ -0,0 +1,214 @@
+# perfilado.py
+# Perfil de CPU (cProfile) de peticiones sueltas, a pedido.
+#
+# El modo se activa definiendo FACTURAS_PERFILADO_TOKEN. Con el modo activo,
+# una petición que trae la cabecera "X-Perfilar: <token>" o el parámetro
+# ?perfilar=<token> se ejecuta bajo cProfile y el perfil se guarda en
+# CARPETA_PERFILES (se conservan los MAX_PERFILES más recientes). La respuesta
+# trae el nombre del perfil en la cabecera X-Perfil; /api/admin/perfiles los
+# lista y permite descargarlos (.prof para pstats/snakeviz o resumen en texto).
+#
+# Sin el token no se instala nada: ni middleware ni envoltura de endpoints.
+#
+# cProfile solo mide el hilo donde se activa, así que se envuelve cada
+# endpoint (RutaPerfilable) y el perfil corre en el hilo del threadpool que lo
+# ejecuta. En los endpoints async se mide el hilo del event loop, que puede
+# incluir trabajo de otras peticiones concurrentes. Los PDF que se extraen en
+# el pool de procesos aparecen como espera del resultado (su costo está en
+# /metrics, facturas_extraccion_duracion_segundos).
+import contextvars
+import cProfile
+import functools
+import inspect
+import io
+import json
+import os
+import pstats
+import re
+import threading
+import time
+import uuid
+from datetime import datetime
+from urllib.parse import parse_qsl
+
+from fastapi.routing import APIRoute
+
+import archivos
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CARPETA_PERFILES = os.environ.get("FACTURAS_PERFILES_DIR", os.path.join(BASE_DIR, 'perfiles'))
+TOKEN = os.environ.get("FACTURAS_PERFILADO_TOKEN", "")
+ACTIVO = bool(TOKEN)
+
+# Perfiles que se conservan; al pasar de aquí se borran los más viejos
+MAX_PERFILES = int(os.environ.get("FACTURAS_MAX_PERFILES", "50"))
+
+CABECERA = b"x-perfilar"
+PARAMETRO = "perfilar"
+PREFIJO_ADMIN = "/api/admin/perfiles"
+
+# Un perfil a la vez: dos cProfile en el mismo hilo (endpoints async) se pisan
+_ocupado = threading.Lock()
+_rotacion = threading.Lock()
+
+# Datos de la petición a perfilar, puestos por el middleware (None si no se pidió)
+_solicitud = contextvars.ContextVar("perfil_solicitud", default=None)
+
+
+def token_valido(valor):
+    return ACTIVO and valor == TOKEN
+
+
+def _nombre_ruta(ruta):
+    return re.sub(r'[^A-Za-z0-9]+', '_', ruta).strip('_') or "raiz"
+
+
+def _guardar(perfil, solicitud, ruta, duracion):
+    os.makedirs(CARPETA_PERFILES, exist_ok=True)
+    # Con microsegundos el orden alfabético es el de creación (ver _rotar)
+    base = f"{datetime.now():%Y%m%d-%H%M%S-%f}_{_nombre_ruta(ruta)}_{uuid.uuid4().hex[:6]}"
+    perfil.dump_stats(os.path.join(CARPETA_PERFILES, base + ".prof"))
+    meta = {
+        "nombre": base + ".prof",
+        "creado": time.time(),
+        "metodo": solicitud["metodo"],
+        "ruta": ruta,
+        "url": solicitud["url"],
+        # El token no se guarda junto al perfil
+        "parametros": {k: v for k, v in solicitud["parametros"].items() if k != PARAMETRO},
+        "duracion_ms": round(duracion * 1000, 2),
+    }
+    archivos.escribir_json(os.path.join(CARPETA_PERFILES, base + ".json"), meta)
+    _rotar()
+    return base + ".prof"
+
+
+def _rotar():
+    with _rotacion:
+        perfiles = sorted(n for n in os.listdir(CARPETA_PERFILES) if n.endswith(".prof"))
+        for nombre in perfiles[:max(0, len(perfiles) - MAX_PERFILES)]:
+            for ruta in (nombre, nombre[:-len(".prof")] + ".json"):
+                try:
+                    os.remove(os.path.join(CARPETA_PERFILES, ruta))
+                except FileNotFoundError:
+                    pass
+
+
+def _iniciar():
+    """Devuelve (perfil, solicitud) si esta petición se debe perfilar, o (None, None)."""
+    solicitud = _solicitud.get()
+    if solicitud is None or not _ocupado.acquire(blocking=False):
+        return None, None
+    perfil = cProfile.Profile()
+    perfil.enable()
+    return perfil, solicitud
+
+
+def _terminar(perfil, solicitud, ruta, inicio):
+    perfil.disable()
+    _ocupado.release()
+    try:
+        solicitud["perfil"] = _guardar(perfil, solicitud, ruta, time.perf_counter() - inicio)
+    except OSError as e:
+        print(f"No se pudo guardar el perfil de {ruta}: {e}")
+
+
+def _envolver(endpoint, ruta):
+    if inspect.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def envoltura(*args, **kwargs):
+            perfil, solicitud = _iniciar()
+            if perfil is None:
+                return await endpoint(*args, **kwargs)
+            inicio = time.perf_counter()
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                _terminar(perfil, solicitud, ruta, inicio)
+    else:
+        @functools.wraps(endpoint)
+        def envoltura(*args, **kwargs):
+            perfil, solicitud = _iniciar()
+            if perfil is None:
+                return endpoint(*args, **kwargs)
+            inicio = time.perf_counter()
+            try:
+                return endpoint(*args, **kwargs)
+            finally:
+                _terminar(perfil, solicitud, ruta, inicio)
+    return envoltura
+
+
+class RutaPerfilable(APIRoute):
+    """APIRoute que corre el endpoint bajo cProfile cuando la petición lo pide."""
+
+    def __init__(self, path, endpoint, **kwargs):
+        super().__init__(path, _envolver(endpoint, path), **kwargs)
+
+
+class MarcarPeticiones:
+    """
+    Middleware ASGI: si la petición trae el token, deja sus datos en el
+    contexto para que RutaPerfilable la perfile y agrega la cabecera X-Perfil.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        # Las consultas de perfiles usan el mismo token y no se perfilan
+        if scope["type"] != "http" or scope["path"].startswith(PREFIJO_ADMIN):
+            return await self.app(scope, receive, send)
+
+        parametros = dict(parse_qsl(scope.get("query_string", b"").decode("latin-1")))
+        cabeceras = dict(scope.get("headers") or [])
+        pedido = cabeceras.get(CABECERA, b"").decode("latin-1") or parametros.get(PARAMETRO, "")
+        if not token_valido(pedido):
+            return await self.app(scope, receive, send)
+
+        solicitud = {"metodo": scope["method"], "url": scope["path"], "parametros": parametros, "perfil": None}
+
+        async def enviar(mensaje):
+            if mensaje["type"] == "http.response.start" and solicitud["perfil"]:
+                mensaje = dict(mensaje)
+                mensaje["headers"] = list(mensaje.get("headers", [])) + [(b"x-perfil", solicitud["perfil"].encode())]
+            await send(mensaje)
+
+        token = _solicitud.set(solicitud)
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            _solicitud.reset(token)
+
+
+# --- Consulta de perfiles guardados ---
+
+def listar():
+    """Metadatos de los perfiles guardados, del más reciente al más viejo."""
+    if not os.path.isdir(CARPETA_PERFILES):
+        return []
+    perfiles = []
+    for nombre in sorted(os.listdir(CARPETA_PERFILES), reverse=True):
+        if not nombre.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(CARPETA_PERFILES, nombre), "r", encoding="utf-8") as f:
+                perfiles.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return perfiles
+
+
+def ruta_perfil(nombre):
+    """Ruta del .prof con ese nombre, o None (no se aceptan rutas, solo nombres listados)."""
+    if nombre != os.path.basename(nombre) or not nombre.endswith(".prof"):
+        return None
+    ruta = os.path.join(CARPETA_PERFILES, nombre)
+    return ruta if os.path.isfile(ruta) else None
+
+
+def resumen_texto(ruta, orden="cumulative", lineas=60):
+    salida = io.StringIO()
+    stats = pstats.Stats(ruta, stream=salida)
+    stats.strip_dirs().sort_stats(orden).print_stats(lineas)
+    return salida.getvalue()
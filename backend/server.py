@@ -1,17 +1,37 @@
 # server.py
-from fastapi import FastAPI, File, UploadFile
+from fastapi import FastAPI, File, Header, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from typing import List
+from starlette.concurrency import run_in_threadpool
+from typing import List, Optional
+import asyncio
+import csv
+import hashlib
+import io
 import os
-import shutil
-from extractor import extraer_datos_infalible
+import re
+import archivos
+import cache_extraccion
+import cfdi_xml
+import columnas
+import estructura
+import motor_extraccion
+import ingesta
+import indice
+import metricas
+import perfilado
+import vigilante
 import json
 import uuid
-from pydantic import BaseModel
+import zipfile
+from pydantic import BaseModel, field_validator
+from extractor import normalizar_fecha
 
 app = FastAPI()
+if perfilado.ACTIVO:
+    # Solo con el modo de perfilado activo se envuelven los endpoints
+    app.router.route_class = perfilado.RutaPerfilable
 
 app.add_middleware(
     CORSMiddleware,
@@ -19,9 +39,54 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(metricas.MedirPeticiones)
+if perfilado.ACTIVO:
+    app.add_middleware(perfilado.MarcarPeticiones)
 
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
+@app.get("/metrics")
+def exponer_metricas():
+    """Métricas del proceso en formato de texto de Prometheus."""
+    return Response(metricas.exponer(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/api/admin/perfiles")
+def listar_perfiles(perfilar: str = "", x_perfilar: Optional[str] = Header(None)):
+    """Perfiles guardados (requiere el token de FACTURAS_PERFILADO_TOKEN)."""
+    if not perfilado.token_valido(x_perfilar or perfilar):
+        return {"status": "error", "message": "Perfilado desactivado o token inválido"}
+    return {"perfiles": perfilado.listar()}
+
+@app.get("/api/admin/perfiles/{nombre}")
+def descargar_perfil(nombre: str, formato: str = "prof", orden: str = "cumulative", perfilar: str = "", x_perfilar: Optional[str] = Header(None)):
+    """Descarga el .prof (pstats/snakeviz) o, con formato=texto, las funciones más costosas."""
+    if not perfilado.token_valido(x_perfilar or perfilar):
+        return {"status": "error", "message": "Perfilado desactivado o token inválido"}
+    ruta = perfilado.ruta_perfil(nombre)
+    if ruta is None:
+        return {"status": "error", "message": "Perfil no encontrado"}
+    if formato == "texto":
+        try:
+            return Response(perfilado.resumen_texto(ruta, orden), media_type="text/plain; charset=utf-8")
+        except KeyError:
+            return {"status": "error", "message": f"Orden no válido: {orden}"}
+    return FileResponse(ruta, media_type="application/octet-stream", filename=nombre)
+
+@app.on_event("startup")
+def iniciar_vigilante():
+    vigilante.iniciar(CARPETA_FACTURAS)
+
+@app.on_event("startup")
+def retomar_ingesta():
+    # Trabajos que quedaron sin terminar al caerse un proceso anterior
+    ingesta.recuperar()
+
+@app.on_event("shutdown")
+def cerrar_motor_extraccion():
+    vigilante.detener()
+    ingesta.cerrar()
+    motor_extraccion.cerrar()
+
 # --- LÓGICA DE CARPETA SEGURA ---
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 CARPETA_FACTURAS = os.path.join(BASE_DIR, 'facturas')
@@ -31,46 +96,12 @@ CARPETA_FACTURAS = os.path.join(BASE_DIR, 'facturas')
 
 
 # --- LÓGICA DE CARPETAS (Dinámica) ---
-STRUCTURE_FILE = os.path.join(BASE_DIR, 'categories_config.json')
-
-DEFAULT_STRUCTURE = [
-    { "name": "I. Honorarios, Sueldos y Prestaciones", "key": "Honorarios" },
-    { "name": "II. Depreciación, Mantenimiento y Rentas", "key": "Depreciación" },
-    { "name": "III. Servicios", "key": "Servicios" },
-    { "name": "IV. Fletes y Acarreos", "key": "Fletes" },
-    {
-        "name": "V. Gastos de Oficina",
-        "key": "Gastos de Oficina",
-        "isGroup": True,
-        "subItems": [
-            { "name": "a. Papelería y Útiles", "key": "Papelería y Útiles" },
-            { "name": "b. Comunicaciones, Fax...", "key": "Comunicaciones y Radios" },
-            { "name": "c. Equipo de Cómputo", "key": "Equipo de Cómputo" }
-        ]
-    },
-    { "name": "VI. Gastos de Capacitación y Adiestramiento", "key": "Capacitación" },
-    { "name": "VII. Seguridad e Higiene", "key": "Seguridad" },
-    { "name": "VIII. Seguros y Fianzas", "key": "Seguros" },
-    { "name": "IX. Trabajos Previos y Auxiliares", "key": "Trabajos Previos" }
-]
-
-def load_structure():
-    if not os.path.exists(STRUCTURE_FILE):
-        save_structure(DEFAULT_STRUCTURE)
-        return DEFAULT_STRUCTURE
-    try:
-        with open(STRUCTURE_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except:
-        return DEFAULT_STRUCTURE
-
-def save_structure(structure):
-    with open(STRUCTURE_FILE, 'w', encoding='utf-8') as f:
-        json.dump(structure, f, indent=2, ensure_ascii=False)
+# La estructura vive en memoria (ver estructura.py); las ediciones se guardan
+# de forma atómica bajo un lock.
 
 # Ensure folders exist based on structure
 def ensure_folders_from_structure():
-    structure = load_structure()
+    structure = estructura.obtener()
     
     def check_item(item):
         if item.get("isGroup"):
@@ -87,25 +118,49 @@ def ensure_folders_from_structure():
 # Initialize folders on startup
 ensure_folders_from_structure()
 
+# Importa al índice las carpetas que hayan cambiado desde el último arranque
+indice.migrar()
+
 # Flatten categories for legacy compatibility if needed
 def get_all_categories_flat():
-    structure = load_structure()
-    cats = []
-    def extract(item):
-        if item.get("isGroup"):
-            for sub in item.get("subItems", []):
-                extract(sub)
-        else:
-            cats.append(item["key"])
-    for item in structure:
-        extract(item)
-    return cats
+    return estructura.categorias()
 
 CATEGORIAS = get_all_categories_flat()
 
+# --- ETAGS ---
+# Listado, resumen y estructura llevan un ETag fuerte que sale de las
+# generaciones del índice (ver indice.version) o del hash de la estructura. Un
+# If-None-Match que coincide se contesta 304 sin leer carpetas ni extraer PDFs.
+
+def _etag(*partes):
+    return '"' + hashlib.sha1("|".join(map(str, partes)).encode("utf-8")).hexdigest()[:24] + '"'
+
+def _etag_coincide(if_none_match, etag):
+    if not if_none_match:
+        return False
+    etiquetas = [e.strip() for e in if_none_match.split(",")]
+    # If-None-Match compara en forma débil: "W/" no cuenta
+    return "*" in etiquetas or etag in (e[2:] if e.startswith("W/") else e for e in etiquetas)
+
+def responder_con_etag(if_none_match, response, version, construir):
+    """
+    304 si el cliente ya tiene la versión actual; si no, construir(). El ETag
+    solo se manda si la versión no cambió mientras se construía la respuesta
+    (p. ej. al extraer PDFs pendientes): así nunca describe otro contenido.
+    """
+    etag = _etag(*version())
+    cabeceras = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _etag_coincide(if_none_match, etag):
+        return Response(status_code=304, headers=cabeceras)
+    contenido = construir()
+    response.headers["Cache-Control"] = "no-cache"
+    if _etag(*version()) == etag:
+        response.headers["ETag"] = etag
+    return contenido
+
 @app.get("/api/structure")
-def get_structure():
-    return load_structure()
+def get_structure(response: Response, if_none_match: Optional[str] = Header(None)):
+    return responder_con_etag(if_none_match, response, lambda: ("estructura", estructura.huella()), estructura.obtener)
 
 class AddCategoryRequest(BaseModel):
     name: str # The display name (e.g. "d. Nuevo Gasto")
@@ -114,40 +169,34 @@ class AddCategoryRequest(BaseModel):
 
 @app.post("/api/categories/add")
 def add_subcategory(req: AddCategoryRequest):
-    structure = load_structure()
-    
-    # Find parent category
-    parent = None
-    for item in structure:
-        if item["key"] == req.parent_key:
-            parent = item
-            break
-            
-    if not parent:
-         return {"status": "error", "message": "Categoría padre no encontrada"}
-    
-    # Ensure it's a group
-    if not parent.get("isGroup"):
-        parent["isGroup"] = True
-        parent["subItems"] = []
-    
-    # Validation
-    for sub in parent["subItems"]:
-        if sub["key"] == req.key:
+    with estructura.edicion() as ed:
+        # Find parent category
+        parent = ed.nodo(req.parent_key)
+
+        if not parent:
+             return {"status": "error", "message": "Categoría padre no encontrada"}
+
+        # Ensure it's a group
+        if not parent.get("isGroup"):
+            parent["isGroup"] = True
+            parent["subItems"] = []
+
+        # Validation
+        if ed.subnodo(req.parent_key, req.key):
             return {"status": "error", "message": "Categoría ya existe"}
 
-    new_item = { "name": req.name, "key": req.key }
-    
-    # Add new item
-    parent["subItems"].append(new_item)
-    
-    # Sort subitems by name to ensure order (a., b., c., ...)
-    parent["subItems"].sort(key=lambda x: x["name"])
-         
-    save_structure(structure)
-    ensure_folders_from_structure()
-    
-    return {"status": "success", "structure": structure}
+        new_item = { "name": req.name, "key": req.key }
+
+        # Add new item
+        parent["subItems"].append(new_item)
+
+        # Sort subitems by name to ensure order (a., b., c., ...)
+        parent["subItems"].sort(key=lambda x: x["name"])
+
+        ed.guardar()
+        ensure_folders_from_structure()
+
+    return {"status": "success", "structure": ed.estructura}
 
 class DeleteCategoryRequest(BaseModel):
     key: str
@@ -155,27 +204,22 @@ class DeleteCategoryRequest(BaseModel):
 
 @app.post("/api/categories/delete")
 def delete_subcategory(req: DeleteCategoryRequest):
-    structure = load_structure()
-    
-    # Find parent
-    parent = None
-    for item in structure:
-        if item["key"] == req.parent_key:
-            parent = item
-            break
-            
-    if not parent:
-         return {"status": "error", "message": "Categoría padre no encontrada"}
-         
-    # Remove item
-    original_len = len(parent.get("subItems", []))
-    parent["subItems"] = [sub for sub in parent["subItems"] if sub["key"] != req.key]
-    
-    if len(parent["subItems"]) == original_len:
-        return {"status": "error", "message": "Subcategoría no encontrada"}
+    with estructura.edicion() as ed:
+        # Find parent
+        parent = ed.nodo(req.parent_key)
+
+        if not parent:
+             return {"status": "error", "message": "Categoría padre no encontrada"}
+
+        if not ed.subnodo(req.parent_key, req.key):
+            return {"status": "error", "message": "Subcategoría no encontrada"}
+
+        # Remove item
+        parent["subItems"] = [sub for sub in parent["subItems"] if sub["key"] != req.key]
 
-    save_structure(structure)
-    return {"status": "success", "structure": structure}
+        ed.guardar()
+    indice.olvidar_categoria(req.key)
+    return {"status": "success", "structure": ed.estructura}
 
 class RenameCategoryRequest(BaseModel):
     key: str # Current key (folder name)
@@ -185,54 +229,46 @@ class RenameCategoryRequest(BaseModel):
 
 @app.post("/api/categories/rename")
 def rename_subcategory(req: RenameCategoryRequest):
-    structure = load_structure()
-    
-    # Find parent
-    parent = None
-    for item in structure:
-        if item["key"] == req.parent_key:
-            parent = item
-            break
-            
-    if not parent:
-         return {"status": "error", "message": "Categoría padre no encontrada"}
-    
-    # Check if new key already exists in this parent (unless it's the same item)
-    for sub in parent.get("subItems", []):
-        if sub["key"] == req.new_key and sub["key"] != req.key:
+    # La carpeta cambia de nombre: nadie más puede estar escribiendo en ella
+    with estructura.edicion() as ed, archivos.bloqueo_categorias(req.key, req.new_key):
+        # Find parent
+        parent = ed.nodo(req.parent_key)
+
+        if not parent:
+             return {"status": "error", "message": "Categoría padre no encontrada"}
+
+        # Check if new key already exists in this parent (unless it's the same item)
+        if req.new_key != req.key and ed.subnodo(req.parent_key, req.new_key):
              return {"status": "error", "message": "El nombre ya existe en esta categoría"}
 
-    # Find the specific item to update
-    target_sub = None
-    for sub in parent.get("subItems", []):
-        if sub["key"] == req.key:
-            target_sub = sub
-            break
-            
-    if not target_sub:
-        return {"status": "error", "message": "Subcategoría no encontrada"}
+        # Find the specific item to update
+        target_sub = ed.subnodo(req.parent_key, req.key)
 
-    # Rename File System Folder
-    old_path = os.path.join(CARPETA_FACTURAS, req.key)
-    new_path = os.path.join(CARPETA_FACTURAS, req.new_key)
-    
-    try:
-        if os.path.exists(old_path) and req.key != req.new_key:
-            os.rename(old_path, new_path)
-    except Exception as e:
-        return {"status": "error", "message": f"Error al renombrar carpeta: {str(e)}"}
+        if not target_sub:
+            return {"status": "error", "message": "Subcategoría no encontrada"}
 
-    # Update Structure
-    target_sub["name"] = req.new_name
-    target_sub["key"] = req.new_key
-    
-    # Sort subitems again
-    parent["subItems"].sort(key=lambda x: x["name"])
+        # Rename File System Folder
+        old_path = os.path.join(CARPETA_FACTURAS, req.key)
+        new_path = os.path.join(CARPETA_FACTURAS, req.new_key)
 
-    save_structure(structure)
-    ensure_folders_from_structure() # Ensure the new folder exists if rename failed or something
-    
-    return {"status": "success", "structure": structure}
+        try:
+            if os.path.exists(old_path) and req.key != req.new_key:
+                os.rename(old_path, new_path)
+                indice.renombrar_categoria(req.key, req.new_key)
+        except Exception as e:
+            return {"status": "error", "message": f"Error al renombrar carpeta: {str(e)}"}
+
+        # Update Structure
+        target_sub["name"] = req.new_name
+        target_sub["key"] = req.new_key
+
+        # Sort subitems again
+        parent["subItems"].sort(key=lambda x: x["name"])
+
+        ed.guardar()
+        ensure_folders_from_structure() # Ensure the new folder exists if rename failed or something
+
+    return {"status": "success", "structure": ed.estructura}
 
 @app.get("/")
 def read_index():
@@ -240,193 +276,419 @@ def read_index():
 
 @app.get("/api/total")
 def get_total(categoria: str = "General"):
-    carpeta_destino = os.path.join(CARPETA_FACTURAS, categoria)
-    if not os.path.exists(carpeta_destino):
-        return {"total": 0}
-    archivos = [f for f in os.listdir(carpeta_destino) if f.lower().endswith('.pdf') or f.lower().endswith('.json')]
-    return {"total": len(archivos)}
+    return {"total": indice.contar(categoria)}
+
+# Límites de /api/subir; se revisan antes de escribir nada en la carpeta
+MAX_ARCHIVOS_SUBIDA = int(os.environ.get("FACTURAS_MAX_ARCHIVOS_SUBIDA", "500"))
+MAX_BYTES_ARCHIVO = int(os.environ.get("FACTURAS_MAX_MB_ARCHIVO", "50")) * 1024 * 1024
+# Archivos que se escriben a la vez (entre todas las subidas en curso)
+SUBIDAS_CONCURRENTES = int(os.environ.get("FACTURAS_SUBIDAS_CONCURRENTES", "4"))
+TAM_BLOQUE_SUBIDA = 1024 * 1024
+
+_escrituras = asyncio.Semaphore(SUBIDAS_CONCURRENTES)
+
+class ArchivoDemasiadoGrande(Exception):
+    pass
+
+def nombre_repetido(nombre, anterior):
+    return f"Otro archivo de la subida ({anterior}) ya se guardó como '{nombre}'"
+
+def guardar_subida(origen_archivo, carpeta_destino, nombre_final):
+    """
+    Copia el archivo subido por bloques a un temporal de la carpeta, calculando
+    el SHA-256 en la misma pasada, y lo renombra al nombre final. Un archivo a
+    medio escribir nunca aparece con extensión .pdf/.xml en la categoría.
+    """
+    temporal = os.path.join(carpeta_destino, f".{uuid.uuid4().hex}.subiendo")
+    h = hashlib.sha256()
+    escritos = 0
+    try:
+        with open(temporal, "wb") as buffer:
+            for bloque in iter(lambda: origen_archivo.read(TAM_BLOQUE_SUBIDA), b""):
+                escritos += len(bloque)
+                if escritos > MAX_BYTES_ARCHIVO:
+                    raise ArchivoDemasiadoGrande()
+                h.update(bloque)
+                buffer.write(bloque)
+        ruta_final = os.path.join(carpeta_destino, nombre_final)
+        if nombre_final.lower().endswith('.pdf'):
+            # La subida encola su extracción: el vigilante no debe encolarlo otra vez
+            ingesta.anunciar(os.path.basename(carpeta_destino), nombre_final)
+        with archivos.bloqueo_categorias(os.path.basename(carpeta_destino)):
+            os.replace(temporal, ruta_final)
+    except BaseException:
+        try:
+            os.remove(temporal)
+        except OSError:
+            pass
+        raise
+    digest = h.hexdigest()
+    metricas.BYTES_SUBIDOS.inc(valor=escritos)
+    # La extracción ya no tendrá que volver a leer el archivo para hashearlo
+    cache_extraccion.recordar_hash(ruta_final, digest)
+    return escritos, digest
 
 @app.post("/api/subir")
 async def subir_archivos(files: List[UploadFile] = File(...), categoria: str = "General", origen: str = "Centrales"):
+    if len(files) > MAX_ARCHIVOS_SUBIDA:
+        return {"status": "error", "message": f"Demasiados archivos ({len(files)}); máximo {MAX_ARCHIVOS_SUBIDA} por subida"}
+
     carpeta_destino = os.path.join(CARPETA_FACTURAS, categoria)
-    if not os.path.exists(carpeta_destino):
-        os.makedirs(carpeta_destino)
-    
-    saved_files = []
-    for file in files:
-        if file.filename.lower().endswith('.pdf'):
-            # Limpiar nombre de archivo de etiquetas anteriores si existen
-            import re
-            clean_name = re.sub(r'^\[.*?\]\s*', '', file.filename)
-            
-            # Añadir etiqueta de origen
-            new_filename = f"[{origen}] {clean_name}"
-            
-            ruta_completa = os.path.join(carpeta_destino, new_filename)
-            with open(ruta_completa, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
-            saved_files.append(new_filename)
-        
-    return {"message": f"{len(saved_files)} archivos subidos", "files": saved_files}
+    await run_in_threadpool(os.makedirs, carpeta_destino, exist_ok=True)
+
+    # Nombre final -> archivo que lo tomó primero (en el orden de la subida)
+    reservados = {}
+
+    async def subir_uno(file):
+        resultado = {"archivo": file.filename}
+        extension = os.path.splitext(file.filename)[1].lower()
+        if extension not in ('.pdf', '.xml'):
+            resultado.update(status="omitido", error_msg="Solo se aceptan archivos .pdf y .xml")
+            return resultado
+        if file.size is not None and file.size > MAX_BYTES_ARCHIVO:
+            resultado.update(status="error", error_msg=f"El archivo supera {MAX_BYTES_ARCHIVO // (1024 * 1024)} MB")
+            return resultado
+
+        # Limpiar nombre de archivo de etiquetas anteriores si existen
+        # y añadir etiqueta de origen
+        new_filename = f"[{origen}] {indice.nombre_limpio(file.filename)}"
+        # Antes del primer await: gather arranca las subidas en orden, así que
+        # el primero de dos archivos con el mismo nombre final es el que se guarda
+        if new_filename in reservados:
+            resultado.update(status="error", error_msg=nombre_repetido(new_filename, reservados[new_filename]))
+            await file.close()
+            return resultado
+        reservados[new_filename] = file.filename
+        try:
+            async with _escrituras:
+                tam, digest = await run_in_threadpool(guardar_subida, file.file, carpeta_destino, new_filename)
+                # Los XML CFDI se leen al registrarlos; solo los PDF requieren extracción
+                await run_in_threadpool(indice.registrar, categoria, new_filename, False)
+                # XML y PDF ya conocidos (mismo contenido en caché) tienen folio desde ahora;
+                # los demás PDF se revisan al terminar su extracción (ver /api/jobs)
+                duplicados = await run_in_threadpool(indice.duplicados_de, categoria, new_filename)
+        except ArchivoDemasiadoGrande:
+            resultado.update(status="error", error_msg=f"El archivo supera {MAX_BYTES_ARCHIVO // (1024 * 1024)} MB")
+            return resultado
+        except Exception as e:
+            resultado.update(status="error", error_msg=str(e))
+            return resultado
+        finally:
+            await file.close()
+        resultado.update(status="ok", guardado_como=new_filename, bytes=tam, sha256=digest)
+        if duplicados:
+            resultado["duplicados"] = duplicados
+        return resultado
+
+    resultados = await asyncio.gather(*(subir_uno(file) for file in files))
+    for r in resultados:
+        metricas.ARCHIVOS_SUBIDOS.inc(r["status"])
+    saved_files = [r["guardado_como"] for r in resultados if r["status"] == "ok"]
+    pdfs = [f for f in saved_files if f.lower().endswith('.pdf')]
+
+    # La extracción se hace en segundo plano; el avance se consulta en /api/jobs/{job_id}
+    job_id = ingesta.encolar(categoria, carpeta_destino, pdfs) if pdfs else None
+
+    return {"message": f"{len(saved_files)} archivos subidos", "files": saved_files, "job_id": job_id, "resultados": resultados}
+
+# Límites de /api/subir_zip; el tamaño de cada miembro es el de MAX_BYTES_ARCHIVO
+MAX_MIEMBROS_ZIP = int(os.environ.get("FACTURAS_MAX_MIEMBROS_ZIP", "10000"))
+# PDFs por trabajo de ingesta: la extracción empieza sin esperar al resto del ZIP
+PDFS_POR_TRABAJO_ZIP = 200
+
+def _miembro_ignorado(nombre):
+    """Carpetas y lo que agregan los compresores (__MACOSX, ._archivo)."""
+    partes = nombre.replace("\\", "/").split("/")
+    return nombre.endswith("/") or "__MACOSX" in partes or partes[-1].startswith(".")
+
+@app.post("/api/subir_zip")
+def subir_zip(archivo: UploadFile = File(...), categoria: str = "General", origen: str = "Centrales"):
+    """
+    Sube un ZIP con facturas sin descomprimirlo a una carpeta: cada miembro se
+    copia por bloques directo del ZIP a la categoría (mismo nombre y etiqueta
+    de origen que /api/subir) y los PDF se encolan en grupos mientras se leen.
+    """
+    try:
+        # El índice central está al final del ZIP: se lee del archivo subido
+        # (Starlette lo guarda en disco pasado 1 MB), nunca entero en memoria
+        with zipfile.ZipFile(archivo.file) as zf:
+            return _guardar_zip(zf, categoria, origen)
+    except zipfile.BadZipFile as e:
+        return {"status": "error", "message": f"No es un ZIP válido: {e}"}
+    finally:
+        archivo.file.close()
+
+def _guardar_zip(zf, categoria, origen):
+    carpeta_destino = os.path.join(CARPETA_FACTURAS, categoria)
+    miembros = [m for m in zf.infolist() if not _miembro_ignorado(m.filename)]
+    if len(miembros) > MAX_MIEMBROS_ZIP:
+        return {"status": "error", "message": f"Demasiados archivos ({len(miembros)}); máximo {MAX_MIEMBROS_ZIP} por ZIP"}
+    os.makedirs(carpeta_destino, exist_ok=True)
+
+    resultados = []
+    job_ids = []
+    pendientes = []  # PDFs aún sin encolar
+    # Nombre final -> miembro que lo tomó: a/x.pdf y b/x.pdf darían el mismo
+    # nombre y el segundo reemplazaría al primero
+    reservados = {}
+    for miembro in miembros:
+        resultado = {"archivo": miembro.filename}
+        resultados.append(resultado)
+        nombre = os.path.basename(miembro.filename.replace("\\", "/"))
+        extension = os.path.splitext(nombre)[1].lower()
+        new_filename = f"[{origen}] {indice.nombre_limpio(nombre)}"
+        if extension not in ('.pdf', '.xml'):
+            resultado.update(status="omitido", error_msg="Solo se aceptan archivos .pdf y .xml")
+        elif miembro.file_size > MAX_BYTES_ARCHIVO:
+            resultado.update(status="error", error_msg=f"El archivo supera {MAX_BYTES_ARCHIVO // (1024 * 1024)} MB")
+        elif new_filename in reservados:
+            resultado.update(status="error", error_msg=nombre_repetido(new_filename, reservados[new_filename]))
+        else:
+            reservados[new_filename] = miembro.filename
+            try:
+                # guardar_subida también corta si lo descomprimido pasa del límite
+                with zf.open(miembro) as contenido:
+                    tam, digest = guardar_subida(contenido, carpeta_destino, new_filename)
+                indice.registrar(categoria, new_filename, False)
+                duplicados = indice.duplicados_de(categoria, new_filename)
+            except ArchivoDemasiadoGrande:
+                resultado.update(status="error", error_msg=f"El archivo supera {MAX_BYTES_ARCHIVO // (1024 * 1024)} MB")
+            except Exception as e:
+                # Miembro dañado, cifrado o con compresión no soportada
+                resultado.update(status="error", error_msg=str(e))
+            else:
+                resultado.update(status="ok", guardado_como=new_filename, bytes=tam, sha256=digest)
+                if duplicados:
+                    resultado["duplicados"] = duplicados
+                if extension == '.pdf':
+                    pendientes.append(new_filename)
+        metricas.ARCHIVOS_SUBIDOS.inc(resultado["status"])
+
+        if len(pendientes) >= PDFS_POR_TRABAJO_ZIP:
+            job_ids.append(ingesta.encolar(categoria, carpeta_destino, pendientes))
+            pendientes = []
+    if pendientes:
+        job_ids.append(ingesta.encolar(categoria, carpeta_destino, pendientes))
+
+    saved_files = [r["guardado_como"] for r in resultados if r["status"] == "ok"]
+    return {"message": f"{len(saved_files)} archivos subidos", "files": saved_files, "job_ids": job_ids, "resultados": resultados}
+
+@app.get("/api/jobs/{job_id}")
+def estado_trabajo(job_id: str):
+    trabajo = ingesta.obtener(job_id)
+    if trabajo is None:
+        return {"status": "error", "message": "Trabajo no encontrado"}
+    return trabajo
+
+def periodo(desde, hasta):
+    """desde/hasta de la query ("AAAA-MM-DD" o "DD/MM/AAAA", vacío = sin límite) normalizados."""
+    fechas = []
+    for nombre, valor in (("desde", desde), ("hasta", hasta)):
+        if valor is None or not valor.strip():
+            fechas.append(None)
+            continue
+        fecha = normalizar_fecha(valor)
+        if fecha is None:
+            raise ValueError(f"Fecha no válida en '{nombre}': {valor}")
+        fechas.append(fecha)
+    return tuple(fechas)
 
 @app.get("/api/procesar")
-def procesar_lote(categoria: str = "General", page: int = 1, limit: int = 10, filtro_origen: str = "Todos"):
+def procesar_lote(
+    response: Response,
+    categoria: str = "General",
+    page: int = 1,
+    limit: int = 10,
+    filtro_origen: str = "Todos",
+    stream: int = 0,
+    orden: str = "nombre",
+    direccion: str = "asc",
+    cursor: Optional[str] = None,
+    rfc: Optional[str] = None,
+    emisor: Optional[str] = None,
+    subtotal_min: Optional[float] = None,
+    subtotal_max: Optional[float] = None,
+    desde: Optional[str] = None,
+    hasta: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+):
     carpeta_destino = os.path.join(CARPETA_FACTURAS, categoria)
     if not os.path.exists(carpeta_destino):
-        return []
+        if stream:
+            return StreamingResponse(iter(()), media_type="application/x-ndjson")
+        return {"items": [], "siguiente": None} if cursor is not None else []
 
-    # Sort by clean name to ensure stability when changing tags
-    import re
-    def get_sort_key(f):
-        # Sort primarily by clean name, secondarily by full name to ensure complete determinism
-        clean = re.sub(r'^\[.*?\]\s*', '', f).lower()
-        return (clean, f.lower())
+    # El índice ya guarda el orden (nombre sin etiqueta, luego nombre completo),
+    # el origen de cada archivo y los datos extraídos de los PDFs
+    origen = None if filtro_origen == "Todos" else filtro_origen
+    descendente = direccion.lower() == "desc"
+    try:
+        desde, hasta = periodo(desde, hasta)
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}
+    filtros = {
+        nombre: valor
+        for nombre, valor in [
+            ("rfc", rfc), ("emisor", emisor), ("subtotal_min", subtotal_min), ("subtotal_max", subtotal_max),
+            ("desde", desde), ("hasta", hasta),
+        ]
+        if valor is not None and valor != ""
+    }
+    if orden not in indice.ORDENES:
+        return {"status": "error", "message": f"Orden no válido: {orden}"}
 
-    all_files = sorted([f for f in os.listdir(carpeta_destino) if f.lower().endswith('.pdf') or f.lower().endswith('.json')], key=get_sort_key)
-    
-    # Aplicar filtro si no es "Todos"
-    if filtro_origen != "Todos":
-        filtered_files = []
-        for f in all_files:
-            match = re.match(r'^\[(.*?)\]', f)
-            origen = match.group(1) if match else "Desconocido"
-            if origen == filtro_origen:
-                filtered_files.append(f)
-        archivos = filtered_files
-    else:
-        archivos = all_files
-    
     inicio = (page - 1) * limit
-    fin = inicio + limit
-    lote_archivos = archivos[inicio:fin]
-    
-    resultados = []
-    
-    # Importar re dentro de la funcion o asegurar que esta arriba (ya esta usado arriba)
-    import re
-    
-    for filename in lote_archivos:
-        ruta = os.path.join(carpeta_destino, filename)
-        
-        # Extraer origen del nombre de archivo
-        origen_match = re.match(r'^\[(.*?)\]', filename)
-        origen = origen_match.group(1) if origen_match else "Desconocido"
 
+    if stream and cursor is None:
+        # NDJSON: un registro por línea, enviado en cuanto se extrae o se lee del índice
+        lineas = (
+            json.dumps(registro, ensure_ascii=False) + "\n"
+            for registro in indice.iterar(categoria, origen, inicio, limit, orden, descendente, filtros)
+        )
+        return StreamingResponse(lineas, media_type="application/x-ndjson")
+
+    def construir():
+        if cursor is None:
+            return indice.listar(categoria, origen, inicio, limit, orden, descendente, filtros)
+        # Paginación por cursor (cursor vacío = primera página)
         try:
-            if filename.lower().endswith('.json'):
-                # Cargar datos manuales directamente
-                with open(ruta, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                # Asegurar campos minimos
-                data["archivo"] = filename
-                if "origen" not in data:
-                    data["origen"] = origen
-                data["status"] = "success"
-                resultados.append(data)
-            else:
-                # Es PDF, usar extractor
-                data = extraer_datos_infalible(ruta)
-                data["archivo"] = filename
-                data["origen"] = origen  # Añadimos el dato al objeto
-                data["status"] = "success"
-                resultados.append(data)
-        except Exception as e:
-            resultados.append({"archivo": filename, "origen": origen, "status": "error", "error_msg": str(e)})
-            
-    return resultados
+            items, siguiente = indice.listar_cursor(categoria, origen, cursor, limit, orden, descendente, filtros)
+        except ValueError as e:
+            return {"status": "error", "message": str(e)}
+        return {"items": items, "siguiente": siguiente}
+
+    # El ETag depende de la categoría y de todos los parámetros de la página
+    parametros = (categoria, page, limit, origen, orden, descendente, cursor, sorted(filtros.items()))
+    return responder_con_etag(if_none_match, response, lambda: ("listado", indice.version(categoria), parametros), construir)
+
+# --- EXPORTACIÓN ---
+
+COLUMNAS_EXPORTACION = [
+    "categoria", "archivo", "origen", "status", "folio_fiscal", "rfc_emisor", "nombre_emisor",
+    "rfc_receptor", "nombre_receptor", "puesto", "uso_cfdi", "efecto_comprobante", "fecha_emision",
+    "subtotal", "total_deducciones", "total_neto", "archivo_pdf", "error_msg",
+]
+MONTOS_EXPORTACION = ("subtotal", "total_deducciones", "total_neto")
+
+# Registros por consulta al índice y bytes acumulados antes de enviar un trozo
+BLOQUE_EXPORTACION = 500
+TAM_TROZO_EXPORTACION = 64 * 1024
+
+def _fila_csv(categoria, registro):
+    fila = []
+    for columna in COLUMNAS_EXPORTACION:
+        valor = categoria if columna == "categoria" else registro.get(columna)
+        if columna in MONTOS_EXPORTACION and valor is not None:
+            # "1,234.56" o "$ 1234.5" -> "1234.56", para que la hoja de cálculo lo tome como número
+            monto = indice.parsear_monto(valor)
+            valor = f"{monto:.2f}" if monto is not None else valor
+        fila.append("" if valor is None else valor)
+    return fila
+
+def generar_csv(categorias, origen, filtros=None):
+    """
+    Genera el CSV por trozos: el encabezado sale de inmediato y cada categoría
+    se recorre por bloques del índice, así que la memoria no depende del total
+    de facturas.
+    """
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    # BOM para que Excel abra el archivo como UTF-8
+    buffer.write("\ufeff")
+    escritor.writerow(COLUMNAS_EXPORTACION)
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+
+    for categoria in categorias:
+        for registro in indice.iterar(categoria, origen, 0, None, filtros=filtros, tam_bloque=BLOQUE_EXPORTACION):
+            escritor.writerow(_fila_csv(categoria, registro))
+            if buffer.tell() >= TAM_TROZO_EXPORTACION:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+@app.get("/api/exportar")
+def exportar_facturas(
+    formato: str = "csv",
+    categoria: Optional[str] = None,
+    filtro_origen: str = "Todos",
+    desde: Optional[str] = None,
+    hasta: Optional[str] = None,
+):
+    """Todas las facturas (o las de una categoría/origen/periodo) como archivo plano, enviado por streaming."""
+    if formato != "csv":
+        return {"status": "error", "message": f"Formato no soportado: {formato}"}
+    try:
+        desde, hasta = periodo(desde, hasta)
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}
+    filtros = {nombre: valor for nombre, valor in (("desde", desde), ("hasta", hasta)) if valor}
+    categorias = get_all_categories_flat()
+    if categoria:
+        if categoria not in categorias:
+            return {"status": "error", "message": f"Categoría no válida: {categoria}"}
+        categorias = [categoria]
+    origen = None if filtro_origen == "Todos" else filtro_origen
+
+    nombre = "facturas_" + re.sub(r'[^A-Za-z0-9_-]+', '_', categoria or "todas") + ".csv"
+    return StreamingResponse(
+        generar_csv(categorias, origen, filtros),
+        media_type="text/csv; charset=utf-8",
+        headers={"Content-Disposition": f'attachment; filename="{nombre}"'},
+    )
 
 @app.get("/api/resumen")
-def obtener_resumen_financiero():
-    resumen = []
-    gran_total = 0.0
-    
-    # Global accumulators if needed, but per-category is primary
-    
-    cats = get_all_categories_flat()
-    for categoria in cats:
-        carpeta_cat = os.path.join(CARPETA_FACTURAS, categoria)
-        
-        # Totales por Categoria
-        total_cat = 0.0
-        count_cat = 0
-        
-        # Desglose
-        total_centrales = 0.0
-        count_centrales = 0
-        total_campo = 0.0
-        count_campo = 0
-        
-        if os.path.exists(carpeta_cat):
-            archivos = [f for f in os.listdir(carpeta_cat) if f.lower().endswith('.pdf') or f.lower().endswith('.json')]
-            count_cat = len(archivos)
-            
-            for archivo in archivos:
-                ruta_completa = os.path.join(carpeta_cat, archivo)
-                try:
-                    # Determinamos Origen
-                    es_campo = False
-                    if "[Campo]" in archivo:
-                        es_campo = True
-                    
-                    # Extraemos datos
-                    datos = {}
-                    if archivo.lower().endswith('.json'):
-                        with open(ruta_completa, 'r', encoding='utf-8') as f:
-                            datos = json.load(f)
-                            # Confiar en el JSON si existe el campo, sino fallback al nombre
-                            if datos.get("origen") == "Campo":
-                                es_campo = True
-                            elif datos.get("origen") == "Centrales":
-                                es_campo = False
-                    else:
-                        datos = extraer_datos_infalible(ruta_completa)
-                    
-                    # Determinamos monto
-                    monto_str = datos.get("subtotal")
-                    # Fallback a total_neto si subtotal no existe (nómina etc)
-                    if not monto_str:
-                        monto_str = datos.get("total_neto")
-
-                    monto_val = 0.0
-                    if monto_str:
-                        clean_num = monto_str.replace("$", "").replace(",", "").strip()
-                        try:
-                            monto_val = float(clean_num)
-                        except:
-                            monto_val = 0.0
-                    
-                    # Acumulamos
-                    if es_campo:
-                        total_campo += monto_val
-                        count_campo += 1
-                    else:
-                        total_centrales += monto_val
-                        count_centrales += 1
-                        
-                    total_cat += monto_val
-                    
-                except Exception as e:
-                    print(f"Error procesando monto de {archivo}: {e}")
-        
-        gran_total += total_cat
-        resumen.append({
-            "categoria": categoria,
-            "cantidad_facturas": count_cat,
-            "total": round(total_cat, 2),
-            "centrales": {
-                "cantidad": count_centrales,
-                "total": round(total_centrales, 2)
-            },
-            "campo": {
-                "cantidad": count_campo,
-                "total": round(total_campo, 2)
-            }
-        })
+def obtener_resumen_financiero(
+    response: Response,
+    desde: Optional[str] = None,
+    hasta: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+):
+    """Totales por categoría; con desde/hasta, solo de las facturas emitidas en ese periodo."""
+    try:
+        desde, hasta = periodo(desde, hasta)
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}
+    # Depende de todas las categorías y de cuáles están en la estructura; los
+    # totales salen del almacén columnar (ver columnas.py)
+    version = lambda: ("resumen", indice.version(), estructura.huella(), desde, hasta)
+    construir = lambda: columnas.resumen(get_all_categories_flat(), desde, hasta)
+    return responder_con_etag(if_none_match, response, version, construir)
 
-    return {
-        "detalles": resumen,
-        "gran_total": round(gran_total, 2)
-    }
+AGRUPACIONES = {
+    "origen": lambda categorias, desde, hasta, limite: columnas.por_origen(categorias, desde, hasta),
+    "rfc_emisor": columnas.por_rfc_emisor,
+}
+
+@app.get("/api/resumen/agrupado")
+def resumen_agrupado(
+    response: Response,
+    por: str = "origen",
+    categoria: Optional[str] = None,
+    limite: int = 100,
+    desde: Optional[str] = None,
+    hasta: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+):
+    """Totales por categoría × origen (por=origen) o por RFC emisor (por=rfc_emisor)."""
+    if por not in AGRUPACIONES:
+        return {"status": "error", "message": f"Agrupación no válida: {por}"}
+    try:
+        desde, hasta = periodo(desde, hasta)
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}
+    categorias = get_all_categories_flat()
+    if categoria:
+        if categoria not in categorias:
+            return {"status": "error", "message": f"Categoría no válida: {categoria}"}
+        categorias = [categoria]
+
+    version = lambda: ("agrupado", indice.version(), estructura.huella(), por, categoria, limite, desde, hasta)
+    construir = lambda: {"por": por, "grupos": AGRUPACIONES[por](categorias, desde, hasta, limite)}
+    return responder_con_etag(if_none_match, response, version, construir)
 
 class ManualInvoiceRequest(BaseModel):
     folio_fiscal: str = None
@@ -440,9 +702,26 @@ class ManualInvoiceRequest(BaseModel):
     total_neto: str = "0.00"
     categoria: str = "General"
     origen: str = "Centrales"
+    fecha_emision: Optional[str] = None # AAAA-MM-DD (también acepta DD/MM/AAAA)
+
+    @field_validator("fecha_emision")
+    @classmethod
+    def validar_fecha(cls, valor):
+        if valor is None or not valor.strip():
+            return None
+        fecha = normalizar_fecha(valor)
+        if fecha is None:
+            raise ValueError(f"Fecha de emisión no válida: {valor}")
+        return fecha
 
 @app.post("/api/manual")
-def crear_factura_manual(req: ManualInvoiceRequest):
+def crear_factura_manual(req: ManualInvoiceRequest, forzar: bool = False):
+    # El mismo CFDI no debe contarse dos veces; `forzar` permite registrarlo igual
+    duplicados = indice.ubicaciones_folio(req.folio_fiscal)
+    if duplicados and not forzar:
+        lugares = ", ".join(f"{d['categoria']}/{d['archivo']}" for d in duplicados)
+        return {"status": "error", "message": f"El folio fiscal ya está registrado en: {lugares}", "duplicados": duplicados}
+
     carpeta_destino = os.path.join(CARPETA_FACTURAS, req.categoria)
     if not os.path.exists(carpeta_destino):
         os.makedirs(carpeta_destino)
@@ -459,14 +738,33 @@ def crear_factura_manual(req: ManualInvoiceRequest):
     # pero guardarlo todo está bien.
     
     try:
-        with open(ruta_completa, 'w', encoding='utf-8') as f:
-            json.dump(datos, f, ensure_ascii=False, indent=2)
+        with archivos.bloqueo_categorias(req.categoria):
+            archivos.escribir_json(ruta_completa, datos)
+            indice.registrar(req.categoria, filename)
         return {"status": "success", "archivo": filename, "data": datos}
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
 
 
+@app.get("/api/buscar")
+def buscar_facturas(q: str = "", campo: Optional[str] = None, page: int = 1, limit: int = 20):
+    """Búsqueda por prefijo (sin acentos) en RFCs, nombres, puesto y folio fiscal de todas las categorías."""
+    page = max(1, page)
+    limit = max(1, min(limit, 200))
+    try:
+        total, resultados = indice.buscar(q, campo, (page - 1) * limit, limit, get_all_categories_flat())
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}
+    return {"total": total, "page": page, "limit": limit, "resultados": resultados}
+
+
+@app.get("/api/duplicados")
+def reporte_duplicados():
+    """Folios fiscales registrados más de una vez en cualquier categoría."""
+    return indice.reporte_duplicados(get_all_categories_flat())
+
+
 class UpdateOrigenRequest(BaseModel):
     filename: str
     categoria: str
@@ -474,40 +772,63 @@ class UpdateOrigenRequest(BaseModel):
 
 @app.post("/api/actualizar_origen")
 def actualizar_origen(req: UpdateOrigenRequest):
-    carpeta_cat = os.path.join(CARPETA_FACTURAS, req.categoria)
-    ruta_old = os.path.join(carpeta_cat, req.filename)
+    # Un cambio a la vez por categoría, también entre workers
+    with archivos.bloqueo_categorias(req.categoria):
+        carpeta_cat = os.path.join(CARPETA_FACTURAS, req.categoria)
+        ruta_old = os.path.join(carpeta_cat, req.filename)
     
-    # Check if file exists
-    if not os.path.exists(ruta_old):
-        # Fallback: Maybe it doesn't have the tag yet? Or tag mismatch?
-        # Try finding the file by ignoring tag in directory
-        import re
-        try:
-            target_clean = re.sub(r'^\[.*?\]\s*', '', req.filename)
-            candidates = [f for f in os.listdir(carpeta_cat) if re.sub(r'^\[.*?\]\s*', '', f) == target_clean]
-            if candidates:
-                ruta_old = os.path.join(carpeta_cat, candidates[0])
-                req.filename = candidates[0] # Update for renaming logic
-            else:
-                return {"status": "error", "message": f"Archivo no encontrado: {req.filename}"}
-        except Exception:
-             return {"status": "error", "message": f"Archivo no encontrado: {req.filename}"}
+        # Check if file exists
+        if not os.path.exists(ruta_old):
+            # Fallback: Maybe it doesn't have the tag yet? Or tag mismatch?
+            # Try finding the file by ignoring tag in directory
+            try:
+                candidate = indice.buscar_por_nombre_limpio(req.categoria, indice.nombre_limpio(req.filename))
+                if candidate:
+                    ruta_old = os.path.join(carpeta_cat, candidate)
+                    req.filename = candidate # Update for renaming logic
+                else:
+                    return {"status": "error", "message": f"Archivo no encontrado: {req.filename}"}
+            except Exception:
+                 return {"status": "error", "message": f"Archivo no encontrado: {req.filename}"}
         
-    # Crear nuevo nombre
-    import re
-    clean_name = re.sub(r'^\[.*?\]\s*', '', req.filename)
-    new_filename = f"[{req.new_origen}] {clean_name}"
-    ruta_new = os.path.join(carpeta_cat, new_filename)
+        # Crear nuevo nombre
+        import re
+        clean_name = re.sub(r'^\[.*?\]\s*', '', req.filename)
+        new_filename = f"[{req.new_origen}] {clean_name}"
+        ruta_new = os.path.join(carpeta_cat, new_filename)
     
-    # Si el nombre es el mismo, no hacemos nada
-    if ruta_old == ruta_new:
-         return {"status": "success", "new_filename": new_filename}
+        # Si el nombre es el mismo, no hacemos nada
+        if ruta_old == ruta_new:
+             return {"status": "success", "new_filename": new_filename}
+
+        # El PDF y el XML de una misma factura llevan siempre la misma etiqueta
+        pareja = indice.pareja(req.categoria, req.filename)
 
+        try:
+            os.rename(ruta_old, ruta_new)
+            cache_extraccion.renombrar(ruta_old, ruta_new)
+            indice.renombrar(req.categoria, req.filename, new_filename)
+            if pareja:
+                pareja_new = f"[{req.new_origen}] {indice.nombre_limpio(pareja)}"
+                if pareja_new != pareja:
+                    os.rename(os.path.join(carpeta_cat, pareja), os.path.join(carpeta_cat, pareja_new))
+                    cache_extraccion.renombrar(os.path.join(carpeta_cat, pareja), os.path.join(carpeta_cat, pareja_new))
+                    indice.renombrar(req.categoria, pareja, pareja_new)
+            return {"status": "success", "new_filename": new_filename}
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
+
+def quitar_pareja(categoria, pareja):
+    """Borra el otro archivo de un par PDF/XML (se muestran como una sola factura)."""
+    if not pareja:
+        return
+    ruta = os.path.join(CARPETA_FACTURAS, categoria, pareja)
     try:
-        os.rename(ruta_old, ruta_new)
-        return {"status": "success", "new_filename": new_filename}
-    except Exception as e:
-        return {"status": "error", "message": str(e)}
+        os.remove(ruta)
+    except FileNotFoundError:
+        pass
+    cache_extraccion.invalidar(ruta)
+    indice.quitar(categoria, pareja)
 
 class DeleteFileRequest(BaseModel):
     filename: str
@@ -515,77 +836,350 @@ class DeleteFileRequest(BaseModel):
 
 @app.post("/api/eliminar")
 def eliminar_factura(req: DeleteFileRequest):
-    carpeta_cat = os.path.join(CARPETA_FACTURAS, req.categoria)
-    ruta_archivo = os.path.join(carpeta_cat, req.filename)
+    with archivos.bloqueo_categorias(req.categoria):
+        carpeta_cat = os.path.join(CARPETA_FACTURAS, req.categoria)
+        ruta_archivo = os.path.join(carpeta_cat, req.filename)
     
-    if not os.path.exists(ruta_archivo):
-         # Try finding by clean name similarity in case of race/rename?
-         # For deletion, better be strict or it's dangerous.
-         return {"status": "error", "message": "Archivo no encontrado"}
+        if not os.path.exists(ruta_archivo):
+             # Try finding by clean name similarity in case of race/rename?
+             # For deletion, better be strict or it's dangerous.
+             return {"status": "error", "message": "Archivo no encontrado"}
 
-    try:
-        os.remove(ruta_archivo)
-        return {"status": "success", "message": f"Archivo {req.filename} eliminado"}
-    except Exception as e:
-        return {"status": "error", "message": str(e)}
+        pareja = indice.pareja(req.categoria, req.filename)
+
+        try:
+            os.remove(ruta_archivo)
+            cache_extraccion.invalidar(ruta_archivo)
+            indice.quitar(req.categoria, req.filename)
+            quitar_pareja(req.categoria, pareja)
+            return {"status": "success", "message": f"Archivo {req.filename} eliminado"}
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
 
 class EditInvoiceRequest(ManualInvoiceRequest):
     filename: str # The original filename to replace/update
 
 @app.post("/api/editar")
 def editar_factura(req: EditInvoiceRequest):
-    carpeta_cat = os.path.join(CARPETA_FACTURAS, req.categoria)
-    ruta_old = os.path.join(carpeta_cat, req.filename)
+    with archivos.bloqueo_categorias(req.categoria):
+        carpeta_cat = os.path.join(CARPETA_FACTURAS, req.categoria)
+        ruta_old = os.path.join(carpeta_cat, req.filename)
     
-    # 1. Check existence
-    if not os.path.exists(ruta_old):
-         return {"status": "error", "message": "Archivo original no encontrado"}
+        # 1. Check existence
+        if not os.path.exists(ruta_old):
+             return {"status": "error", "message": "Archivo original no encontrado"}
 
-    # 2. Determine new filename (JSON)
-    # If it was PDF, we are effectively converting it to Manual (JSON)
-    # If it was already JSON, we just overwrite (or rename if origin changed)
+        # 2. Determine new filename (JSON)
+        # If it was PDF, we are effectively converting it to Manual (JSON)
+        # If it was already JSON, we just overwrite (or rename if origin changed)
     
-    import re
-    is_json = req.filename.lower().endswith('.json')
+        import re
+        is_json = req.filename.lower().endswith('.json')
     
-    if is_json:
-        # Regex to strip [Tag]
-        rest_of_name = re.sub(r'^\[.*?\]\s*', '', req.filename)
-        new_filename = f"[{req.origen}] {rest_of_name}"
-        ruta_new = os.path.join(carpeta_cat, new_filename)
+        if is_json:
+            # Regex to strip [Tag]
+            rest_of_name = re.sub(r'^\[.*?\]\s*', '', req.filename)
+            new_filename = f"[{req.origen}] {rest_of_name}"
+            ruta_new = os.path.join(carpeta_cat, new_filename)
         
-        # Update content
-        datos = req.dict()
-        del datos['filename'] # Don't store this in the file content
+            # Update content
+            datos = req.dict()
+            del datos['filename'] # Don't store this in the file content
         
-        try:
-            with open(ruta_new, 'w', encoding='utf-8') as f:
-                json.dump(datos, f, ensure_ascii=False, indent=2)
+            try:
+                archivos.escribir_json(ruta_new, datos)
                 
-            if ruta_old != ruta_new:
-                os.remove(ruta_old)
+                if ruta_old != ruta_new:
+                    os.remove(ruta_old)
+                indice.reemplazar(req.categoria, req.filename, new_filename)
                 
-            return {"status": "success", "archivo": new_filename}
+                return {"status": "success", "archivo": new_filename}
             
-        except Exception as e:
-            return {"status": "error", "message": str(e)}
+            except Exception as e:
+                return {"status": "error", "message": str(e)}
 
-    else:
-        # It's a PDF (or other). We are "Converting" to Manual JSON.
-        clean_name_no_ext = os.path.splitext(re.sub(r'^\[.*?\]\s*', '', req.filename))[0]
-        new_filename = f"[{req.origen}] {clean_name_no_ext}.json"
-        ruta_new = os.path.join(carpeta_cat, new_filename)
+        else:
+            # It's a PDF (or other). We are "Converting" to Manual JSON.
+            clean_name_no_ext = os.path.splitext(re.sub(r'^\[.*?\]\s*', '', req.filename))[0]
+            new_filename = f"[{req.origen}] {clean_name_no_ext}.json"
+            ruta_new = os.path.join(carpeta_cat, new_filename)
         
-        datos = req.dict()
-        del datos['filename']
+            datos = req.dict()
+            del datos['filename']
+            pareja = indice.pareja(req.categoria, req.filename)
         
-        try:
-            with open(ruta_new, 'w', encoding='utf-8') as f:
-                json.dump(datos, f, ensure_ascii=False, indent=2)
+            try:
+                archivos.escribir_json(ruta_new, datos)
             
-            # Remove original PDF
-            os.remove(ruta_old)
+                # Remove original PDF (and its XML pair, now superseded by the manual entry)
+                os.remove(ruta_old)
+                cache_extraccion.invalidar(ruta_old)
+                indice.reemplazar(req.categoria, req.filename, new_filename)
+                quitar_pareja(req.categoria, pareja)
             
-            return {"status": "success", "archivo": new_filename}
-        except Exception as e:
-             return {"status": "error", "message": str(e)}
\ No newline at end of file
+                return {"status": "success", "archivo": new_filename}
+            except Exception as e:
+                 return {"status": "error", "message": str(e)}
+
+# --- OPERACIONES EN LOTE ---
+# /api/lote aplica muchas operaciones de una vez: cada carpeta se lista una
+# sola vez, el índice confirma todo en una transacción y la caché de extracción
+# recibe sus cambios juntos al final. Cada operación reporta su propio resultado.
+
+MAX_OPERACIONES_LOTE = int(os.environ.get("FACTURAS_MAX_OPERACIONES_LOTE", "1000"))
+
+# Campos que puede cambiar la acción "editar" (la categoría se cambia con "mover")
+CAMPOS_EDITABLES = [c for c in ManualInvoiceRequest.model_fields if c != "categoria"]
+
+class OperacionLote(BaseModel):
+    accion: str  # "eliminar", "origen", "mover" o "editar"
+    categoria: str
+    filename: str
+    new_origen: Optional[str] = None  # accion "origen"
+    destino: Optional[str] = None     # accion "mover": categoría destino
+    campos: Optional[dict] = None     # accion "editar"
+
+class LoteRequest(BaseModel):
+    operaciones: List[OperacionLote]
+
+class ErrorLote(Exception):
+    pass
+
+class CarpetasLote:
+    """Nombres de archivo de cada carpeta tocada por el lote, leídos una vez y mantenidos al día."""
+
+    def __init__(self):
+        self._nombres = {}
+        self._limpios = {}
+
+    def nombres(self, categoria):
+        if categoria not in self._nombres:
+            try:
+                with os.scandir(os.path.join(CARPETA_FACTURAS, categoria)) as it:
+                    self._nombres[categoria] = {e.name for e in it if e.is_file()}
+            except FileNotFoundError:
+                self._nombres[categoria] = set()
+            metricas.archivos_escaneados(len(self._nombres[categoria]), "listado")
+        return self._nombres[categoria]
+
+    def resolver(self, categoria, filename, por_nombre_limpio=False):
+        """El archivo tal cual o, si se pide, el que tiene el mismo nombre sin etiqueta."""
+        nombres = self.nombres(categoria)
+        if filename in nombres:
+            return filename
+        if not por_nombre_limpio:
+            return None
+        if categoria not in self._limpios:
+            limpios = {}
+            for nombre in sorted(nombres):
+                limpios.setdefault(indice.nombre_limpio(nombre), nombre)
+            self._limpios[categoria] = limpios
+        return self._limpios[categoria].get(indice.nombre_limpio(filename))
+
+    def cambiar(self, categoria, quitar=None, agregar=None):
+        nombres = self.nombres(categoria)
+        nombres.discard(quitar)
+        if agregar:
+            nombres.add(agregar)
+        self._limpios.pop(categoria, None)
+
+class EjecucionLote:
+    """Una operación por método; lanzan ErrorLote si esa operación no se puede aplicar."""
+
+    def __init__(self, lote, carpetas, categorias, datos_previos):
+        self.lote = lote
+        self.carpetas = carpetas
+        self.categorias = categorias
+        self.datos_previos = datos_previos
+        self.cambios_cache = []
+
+    def _ruta(self, categoria, archivo):
+        return os.path.join(CARPETA_FACTURAS, categoria, archivo)
+
+    def _archivo(self, op, por_nombre_limpio=False):
+        archivo = self.carpetas.resolver(op.categoria, op.filename, por_nombre_limpio)
+        if archivo is None:
+            raise ErrorLote(f"Archivo no encontrado: {op.filename}")
+        return archivo
+
+    def _libre(self, categoria, archivo):
+        if archivo in self.carpetas.nombres(categoria):
+            raise ErrorLote(f"Ya existe {archivo} en {categoria}")
+
+    def _renombrar(self, categoria, archivo, categoria_new, archivo_new):
+        ruta_old, ruta_new = self._ruta(categoria, archivo), self._ruta(categoria_new, archivo_new)
+        os.rename(ruta_old, ruta_new)
+        self.carpetas.cambiar(categoria, quitar=archivo)
+        self.carpetas.cambiar(categoria_new, agregar=archivo_new)
+        self.cambios_cache.append(("renombrar", ruta_old, ruta_new))
+        self.lote.mover(categoria, archivo, categoria_new, archivo_new)
+
+    def _borrar(self, categoria, archivo):
+        ruta = self._ruta(categoria, archivo)
+        try:
+            os.remove(ruta)
+        except FileNotFoundError:
+            pass
+        self.carpetas.cambiar(categoria, quitar=archivo)
+        self.cambios_cache.append(("invalidar", ruta))
+        self.lote.quitar(categoria, archivo)
+
+    def eliminar(self, op):
+        archivo = self._archivo(op)
+        pareja = self.lote.pareja(op.categoria, archivo)
+        self._borrar(op.categoria, archivo)
+        if pareja:
+            self._borrar(op.categoria, pareja)
+        return {"message": f"Archivo {archivo} eliminado"}
+
+    def origen(self, op):
+        if not op.new_origen:
+            raise ErrorLote("Falta new_origen")
+        archivo = self._archivo(op, por_nombre_limpio=True)
+        # El PDF y el XML de una misma factura llevan siempre la misma etiqueta
+        renombres = []
+        for actual in filter(None, (archivo, self.lote.pareja(op.categoria, archivo))):
+            nuevo = f"[{op.new_origen}] {indice.nombre_limpio(actual)}"
+            if nuevo != actual:
+                self._libre(op.categoria, nuevo)
+                renombres.append((actual, nuevo))
+        for actual, nuevo in renombres:
+            self._renombrar(op.categoria, actual, op.categoria, nuevo)
+        return {"new_filename": f"[{op.new_origen}] {indice.nombre_limpio(archivo)}"}
+
+    def mover(self, op):
+        if op.destino not in self.categorias:
+            raise ErrorLote(f"Categoría destino no válida: {op.destino}")
+        archivo = self._archivo(op)
+        if op.destino == op.categoria:
+            return {"categoria_destino": op.destino, "new_filename": archivo}
+        movidos = list(filter(None, (archivo, self.lote.pareja(op.categoria, archivo))))
+        for actual in movidos:
+            self._libre(op.destino, actual)
+        os.makedirs(os.path.join(CARPETA_FACTURAS, op.destino), exist_ok=True)
+        for actual in movidos:
+            self._renombrar(op.categoria, actual, op.destino, actual)
+        return {"categoria_destino": op.destino, "new_filename": archivo}
+
+    def _datos(self, categoria, archivo):
+        datos = self.datos_previos.get((categoria, archivo))
+        if datos is not None:
+            return datos
+        # Archivo que llegó a este nombre dentro del mismo lote
+        ruta = self._ruta(categoria, archivo)
+        if archivo.lower().endswith('.xml'):
+            return cfdi_xml.leer_cfdi(ruta)
+        return cache_extraccion.obtener_datos(ruta)
+
+    def editar(self, op):
+        campos = op.campos or {}
+        desconocidos = sorted(set(campos) - set(CAMPOS_EDITABLES))
+        if desconocidos:
+            raise ErrorLote(f"Campos no editables: {', '.join(desconocidos)}")
+        archivo = self._archivo(op)
+        es_json = archivo.lower().endswith('.json')
+        ruta_old = self._ruta(op.categoria, archivo)
+
+        if es_json:
+            with open(ruta_old, 'r', encoding='utf-8') as f:
+                base = json.load(f)
+        else:
+            base = self._datos(op.categoria, archivo)
+        origen = campos.get("origen") or (base.get("origen") if es_json else None) or indice.origen_de_nombre(archivo)
+        valores = {k: v for k, v in base.items() if k in CAMPOS_EDITABLES and v is not None}
+        valores.update(campos)
+        valores.update(origen=origen, categoria=op.categoria)
+        try:
+            datos = ManualInvoiceRequest(**valores).dict()
+        except ValueError as e:
+            raise ErrorLote(f"Datos no válidos: {e}")
+
+        # Igual que /api/editar: un PDF o XML editado pasa a ser captura manual (JSON)
+        limpio = indice.nombre_limpio(archivo)
+        if es_json:
+            new_filename = f"[{origen}] {limpio}"
+            contenido = {**base, **datos}
+        else:
+            new_filename = f"[{origen}] {os.path.splitext(limpio)[0]}.json"
+            contenido = datos
+        if new_filename != archivo:
+            self._libre(op.categoria, new_filename)
+        pareja = None if es_json else self.lote.pareja(op.categoria, archivo)
+
+        archivos.escribir_json(self._ruta(op.categoria, new_filename), contenido)
+        self.carpetas.cambiar(op.categoria, agregar=new_filename)
+        if new_filename != archivo:
+            os.remove(ruta_old)
+            self.carpetas.cambiar(op.categoria, quitar=archivo)
+            if not es_json:
+                self.cambios_cache.append(("invalidar", ruta_old))
+        self.lote.reemplazar(op.categoria, archivo, new_filename)
+        if pareja:
+            self._borrar(op.categoria, pareja)
+        return {"archivo": new_filename}
+
+ACCIONES_LOTE = {
+    "eliminar": EjecucionLote.eliminar,
+    "origen": EjecucionLote.origen,
+    "mover": EjecucionLote.mover,
+    "editar": EjecucionLote.editar,
+}
+
+@app.post("/api/lote")
+def aplicar_lote(req: LoteRequest):
+    """
+    Aplica una lista de operaciones (eliminar, origen, mover, editar) en orden.
+    Una operación que falla no detiene a las demás; cada una trae su resultado.
+    """
+    if len(req.operaciones) > MAX_OPERACIONES_LOTE:
+        return {"status": "error", "message": f"Demasiadas operaciones ({len(req.operaciones)}); máximo {MAX_OPERACIONES_LOTE} por lote"}
+
+    categorias = set(get_all_categories_flat())
+    tocadas = {op.categoria for op in req.operaciones if op.categoria in categorias}
+    tocadas |= {op.destino for op in req.operaciones if op.accion == "mover" and op.destino in categorias}
+    # Todas las carpetas del lote quedan bloqueadas (entre workers) hasta el final
+    with archivos.bloqueo_categorias(*tocadas):
+        return _aplicar_lote(req, categorias, tocadas)
+
+def _aplicar_lote(req, categorias, tocadas):
+    carpetas = CarpetasLote()
+
+    # Los PDF y XML que se van a editar se leen (o extraen) todos juntos antes del lote
+    por_leer = {}
+    for op in req.operaciones:
+        if op.accion == "editar" and op.categoria in categorias and not op.filename.lower().endswith('.json'):
+            if op.filename in carpetas.nombres(op.categoria):
+                por_leer.setdefault(op.categoria, []).append(op.filename)
+    datos_previos = {}
+    for categoria, nombres in por_leer.items():
+        for archivo, datos in indice.datos_de_archivos(categoria, nombres).items():
+            datos_previos[(categoria, archivo)] = datos
+
+    resultados = []
+    with indice.lote(tocadas) as lote:
+        ejecucion = EjecucionLote(lote, carpetas, categorias, datos_previos)
+        for i, op in enumerate(req.operaciones):
+            resultado = {"indice": i, "accion": op.accion, "categoria": op.categoria, "filename": op.filename}
+            accion = ACCIONES_LOTE.get(op.accion)
+            try:
+                if accion is None:
+                    raise ErrorLote(f"Acción no válida: {op.accion}")
+                if op.categoria not in categorias:
+                    raise ErrorLote(f"Categoría no válida: {op.categoria}")
+                if op.filename != os.path.basename(op.filename):
+                    raise ErrorLote(f"Nombre de archivo no válido: {op.filename}")
+                resultado.update(accion(ejecucion, op))
+                resultado["status"] = "ok"
+            except Exception as e:
+                resultado.update(status="error", error_msg=str(e))
+            resultados.append(resultado)
+    cache_extraccion.aplicar_cambios(ejecucion.cambios_cache)
+
+    errores = sum(1 for r in resultados if r["status"] == "error")
+    return {
+        "status": "success",
+        "total": len(resultados),
+        "ok": len(resultados) - errores,
+        "errores": errores,
+        "resultados": resultados,
+    }
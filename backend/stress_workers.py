@@ -0,0 +1,89 @@
+import requests
+import uuid
+import time
+import concurrent.futures
+
+# Servidor con varios workers, p. ej.:
+#   FACTURAS_VIGILANTE=sondeo uvicorn server:app --port 8001 --workers 4
+BASE_URL = "http://localhost:8001"
+CATEGORIA = "Honorarios"
+HILOS = 16
+TIMEOUT = 30
+
+# PDF mínimo: la extracción no encuentra datos, pero la subida es válida
+PDF = b"%PDF-1.4\n1 0 obj<</Type/Catalog/Pages 2 0 R>>endobj\n2 0 obj<</Type/Pages/Kids[]/Count 0>>endobj\ntrailer<</Root 1 0 R>>\n%%EOF\n"
+
+
+def listado(categoria):
+    res = requests.get(f"{BASE_URL}/api/procesar", params={"categoria": categoria, "limit": 100000}, timeout=TIMEOUT)
+    return [x["archivo"] for x in res.json()]
+
+
+def test_toggles_concurrentes(cantidad=20, rondas=6):
+    """Cada factura cambia de origen varias veces desde hilos distintos (y workers distintos)."""
+    print(f"\n--- Toggles: {cantidad} facturas x {rondas} rondas ---")
+    nombres = []
+    for _ in range(cantidad):
+        payload = {"folio_fiscal": str(uuid.uuid4()), "categoria": CATEGORIA, "origen": "Centrales"}
+        nombres.append(requests.post(f"{BASE_URL}/api/manual", json=payload, timeout=TIMEOUT).json()["archivo"])
+
+    def alternar(i):
+        nombre = nombres[i % cantidad]
+        destino = "Campo" if (i // cantidad) % 2 == 0 else "Centrales"
+        payload = {"filename": nombre, "categoria": CATEGORIA, "new_origen": destino}
+        return requests.post(f"{BASE_URL}/api/actualizar_origen", json=payload, timeout=TIMEOUT).json()
+
+    start_time = time.time()
+    with concurrent.futures.ThreadPoolExecutor(HILOS) as ex:
+        respuestas = list(ex.map(alternar, range(cantidad * rondas)))
+    print(f"{len(respuestas)} toggles en {time.time() - start_time:.2f}s")
+
+    fallidos = [r for r in respuestas if r.get("status") != "success"]
+    if fallidos:
+        print(f"FAILURE: {len(fallidos)} toggles con error, p. ej. {fallidos[0]}")
+
+    # Cada factura debe aparecer exactamente una vez, con la etiqueta que sea
+    archivos = listado(CATEGORIA)
+    limpios = [n.split("] ", 1)[-1] for n in nombres]
+    perdidos = [n for n in limpios if sum(a.endswith("] " + n) for a in archivos) != 1]
+    if perdidos:
+        print(f"FAILURE: {len(perdidos)} facturas perdidas o repetidas: {perdidos[:3]}")
+    elif not fallidos:
+        print("SUCCESS: todas las facturas siguen en el listado una sola vez")
+
+
+def test_subidas_concurrentes(categoria=CATEGORIA, cantidad=40):
+    """Subidas en paralelo a la misma categoría: ninguna se pierde ni se queda colgada."""
+    print(f"\n--- Subidas: {cantidad} a '{categoria}' ---")
+    prefijo = uuid.uuid4().hex[:8]
+
+    def subir(i):
+        files = [("files", (f"{prefijo}_{i}_{j}.pdf", PDF, "application/pdf")) for j in range(3)]
+        res = requests.post(f"{BASE_URL}/api/subir", params={"categoria": categoria, "origen": "Campo"}, files=files, timeout=TIMEOUT)
+        return res.json()
+
+    start_time = time.time()
+    try:
+        with concurrent.futures.ThreadPoolExecutor(HILOS) as ex:
+            respuestas = list(ex.map(subir, range(cantidad)))
+    except requests.exceptions.Timeout:
+        print(f"FAILURE: una subida a '{categoria}' no terminó en {TIMEOUT}s (¿bloqueo colgado?)")
+        return
+    print(f"{cantidad * 3} archivos en {time.time() - start_time:.2f}s")
+
+    esperados = {f"[Campo] {prefijo}_{i}_{j}.pdf" for i in range(cantidad) for j in range(3)}
+    subidos = {f for r in respuestas for f in r.get("files", [])}
+    faltan = esperados - set(listado(categoria))
+    if subidos != esperados:
+        print(f"FAILURE: la API reportó {len(subidos)} de {len(esperados)} archivos")
+    elif faltan:
+        print(f"FAILURE: {len(faltan)} archivos subidos no aparecen en el listado: {sorted(faltan)[:3]}")
+    else:
+        print("SUCCESS: todos los archivos subidos aparecen en el listado")
+
+
+if __name__ == "__main__":
+    test_toggles_concurrentes()
+    test_subidas_concurrentes()
+    # Una categoría con el nombre de un candado interno no debe colgarse
+    test_subidas_concurrentes("vigilante", cantidad=5)
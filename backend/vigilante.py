@@ -0,0 +1,361 @@
+# vigilante.py
+# Mantiene el índice al día con los archivos que se agregan, renombran,
+# modifican o borran en CARPETA_FACTURAS por fuera del servidor (copiados a
+# mano, carpeta compartida, otro proceso).
+#
+# En Linux se usa inotify (por ctypes, sin dependencias); en otros sistemas,
+# o si inotify no está disponible, un hilo compara cada INTERVALO_SONDEO
+# segundos tamaño y mtime de los archivos de cada carpeta. En ambos casos los
+# eventos se agrupan por archivo y se aplican cuando el archivo lleva
+# ESPERA_EVENTOS segundos sin cambiar (una copia grande genera muchos), y solo
+# se vuelve a leer ese archivo: los PDF que no están en la caché se encolan
+# en ingesta para extraerlos en segundo plano, salvo los que ya cubre un
+# trabajo (las subidas del propio servidor se anuncian antes de escribirse).
+#
+# FACTURAS_VIGILANTE=inotify|sondeo|no fuerza el mecanismo o lo apaga.
+#
+# Con varios workers vigila uno solo (el que toma el candado "vigilante"); el
+# índice es compartido, así que los demás lo ven al día sin vigilar y siguen
+# comparando el mtime de las carpetas como si no hubiera vigilante.
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+import archivos
+import cache_extraccion
+import indice
+import ingesta
+import metricas
+
+MODO = os.environ.get("FACTURAS_VIGILANTE", "auto").lower()
+
+# Segundos sin eventos antes de aplicar los cambios de un archivo
+ESPERA_EVENTOS = float(os.environ.get("FACTURAS_VIGILANTE_ESPERA", "0.5"))
+
+# Cada cuánto se recorren las carpetas cuando no hay inotify
+INTERVALO_SONDEO = float(os.environ.get("FACTURAS_VIGILANTE_INTERVALO", "3"))
+
+# Constantes de <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+MASCARA_RAIZ = IN_CREATE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE | IN_ONLYDIR
+MASCARA_CATEGORIA = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+EVENTO = struct.Struct("iIII")  # wd, mask, cookie, len (+ nombre)
+
+_lock = threading.Lock()
+_vigilante = None
+_candado = None  # archivos.Exclusivo del worker que vigila
+
+
+class _Cambios:
+    """
+    Archivos con eventos sin aplicar: (categoría, archivo) -> momento del
+    último evento. Las categorías en `completas` se comparan enteras contra el
+    disco (carpeta nueva o eventos perdidos).
+    """
+
+    def __init__(self):
+        self.archivos = {}
+        self.completas = set()
+
+    def anotar(self, categoria, archivo):
+        if indice.es_archivo_factura(archivo):
+            self.archivos[(categoria, archivo)] = time.monotonic()
+
+    def anotar_categoria(self, categoria):
+        self.completas.add(categoria)
+
+    def espera(self):
+        """Segundos hasta que venza el próximo archivo (None si no hay nada)."""
+        if self.completas:
+            return 0
+        if not self.archivos:
+            return None
+        return max(0.0, min(self.archivos.values()) + ESPERA_EVENTOS - time.monotonic())
+
+    def vencidos(self):
+        limite = time.monotonic() - ESPERA_EVENTOS
+        listos = [clave for clave, t in self.archivos.items() if t <= limite]
+        for clave in listos:
+            del self.archivos[clave]
+        completas, self.completas = self.completas, set()
+        return completas, listos
+
+
+def _aplicar(completas, listos):
+    """Lleva al índice los cambios vencidos y encola la extracción de los PDF nuevos."""
+    for categoria in completas:
+        try:
+            indice.sincronizar(categoria, forzar=True)
+        except Exception as e:
+            print(f"Vigilante: no se pudo sincronizar {categoria}: {e}")
+
+    por_extraer = {}
+    for categoria, archivo in listos:
+        if categoria in completas:
+            continue
+        try:
+            fila = indice.registrar(categoria, archivo, extraer=False)
+        except Exception as e:
+            print(f"Vigilante: no se pudo indexar {categoria}/{archivo}: {e}")
+            continue
+        if fila and fila["pendiente"]:
+            por_extraer.setdefault(categoria, []).append(archivo)
+
+    for categoria, nombres in por_extraer.items():
+        # Los que subió el propio servidor (o ya están en un trabajo) los extrae ese trabajo
+        cubiertos = ingesta.cubiertos(categoria, nombres)
+        nombres = [n for n in nombres if n not in cubiertos]
+        if nombres:
+            ingesta.encolar(categoria, os.path.join(indice.CARPETA_FACTURAS, categoria), nombres)
+
+
+class _Vigilante:
+    """Hilo de fondo común a los dos mecanismos; las subclases implementan _esperar()."""
+
+    nombre = None
+
+    def __init__(self, raiz):
+        self.raiz = raiz
+        self.cambios = _Cambios()
+        self._detener = threading.Event()
+        self._hilo = threading.Thread(target=self._correr, name=f"vigilante-{self.nombre}", daemon=True)
+
+    def iniciar(self):
+        self._hilo.start()
+
+    def detener(self):
+        self._detener.set()
+        self._hilo.join(timeout=5)
+
+    def _categorias(self):
+        try:
+            with os.scandir(self.raiz) as it:
+                return [e.name for e in it if e.is_dir()]
+        except FileNotFoundError:
+            return []
+
+    def _correr(self):
+        while not self._detener.is_set():
+            try:
+                self._esperar(self.cambios.espera())
+                completas, listos = self.cambios.vencidos()
+                if completas or listos:
+                    _aplicar(completas, listos)
+            except Exception as e:
+                print(f"Vigilante: error procesando eventos: {e}")
+                self._detener.wait(1)
+        self._cerrar()
+
+    def _esperar(self, espera):
+        raise NotImplementedError
+
+    def _cerrar(self):
+        pass
+
+
+class _Inotify(_Vigilante):
+    """
+    Un watch sobre la raíz (carpetas de categoría que aparecen o se renombran)
+    y uno por categoría. IN_CLOSE_WRITE en lugar de IN_MODIFY: un archivo se
+    lee cuando quien lo escribe lo cierra, no a cada bloque.
+    """
+
+    nombre = "inotify"
+
+    def __init__(self, raiz):
+        super().__init__(raiz)
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._fd = libc.inotify_init1(IN_CLOEXEC | IN_NONBLOCK)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        self._categorias_wd = {}  # wd -> categoría
+        self._wd_raiz = self._vigilar(self.raiz, MASCARA_RAIZ)
+        for categoria in self._categorias():
+            self._vigilar_categoria(categoria)
+
+    def _vigilar(self, ruta, mascara):
+        wd = self._add_watch(self._fd, os.fsencode(ruta), mascara)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch {ruta}")
+        return wd
+
+    def _vigilar_categoria(self, categoria):
+        try:
+            wd = self._vigilar(os.path.join(self.raiz, categoria), MASCARA_CATEGORIA)
+        except OSError:
+            return  # se borró antes de poder vigilarla
+        # Un renombrado conserva el inodo y, por lo tanto, el wd: solo cambia el nombre
+        self._categorias_wd[wd] = categoria
+
+    def _esperar(self, espera):
+        listos, _, _ = select.select([self._fd], [], [], 1.0 if espera is None else min(espera, 1.0))
+        if not listos:
+            return
+        try:
+            datos = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return
+
+        movidos = {}  # cookie -> (categoría, archivo) de IN_MOVED_FROM
+        pos = 0
+        while pos + EVENTO.size <= len(datos):
+            wd, mascara, cookie, largo = EVENTO.unpack_from(datos, pos)
+            nombre = os.fsdecode(datos[pos + EVENTO.size:pos + EVENTO.size + largo].rstrip(b"\0"))
+            pos += EVENTO.size + largo
+            self._evento(wd, mascara, cookie, nombre, movidos)
+        # Movidos fuera de las carpetas vigiladas (o con la pareja en la próxima lectura)
+        for origen in movidos.values():
+            self.cambios.anotar(*origen)
+
+    def _evento(self, wd, mascara, cookie, nombre, movidos):
+        if mascara & IN_Q_OVERFLOW:
+            # Se perdieron eventos: solo queda comparar todo contra el disco
+            for categoria in self._categorias():
+                self.cambios.anotar_categoria(categoria)
+            return
+
+        if wd == self._wd_raiz:
+            if mascara & IN_ISDIR and mascara & (IN_CREATE | IN_MOVED_TO):
+                self._vigilar_categoria(nombre)
+                # Lo que se copió antes de tener el watch no generó eventos
+                self.cambios.anotar_categoria(nombre)
+            return
+
+        categoria = self._categorias_wd.get(wd)
+        if mascara & IN_IGNORED:
+            self._categorias_wd.pop(wd, None)
+            return
+        if categoria is None or mascara & (IN_DELETE_SELF | IN_MOVE_SELF | IN_ISDIR):
+            return
+
+        if mascara & IN_MOVED_FROM:
+            movidos[cookie] = (categoria, nombre)
+        elif mascara & IN_MOVED_TO and cookie in movidos:
+            # Renombrado o cambio de categoría: el hash recordado sigue valiendo
+            origen = movidos.pop(cookie)
+            cache_extraccion.renombrar(
+                os.path.join(self.raiz, *origen), os.path.join(self.raiz, categoria, nombre)
+            )
+            self.cambios.anotar(*origen)
+            self.cambios.anotar(categoria, nombre)
+        else:
+            self.cambios.anotar(categoria, nombre)
+
+    def _cerrar(self):
+        os.close(self._fd)
+
+
+class _Sondeo(_Vigilante):
+    """Sin inotify: compara (tamaño, mtime) de cada archivo contra la pasada anterior."""
+
+    nombre = "sondeo"
+
+    def __init__(self, raiz):
+        super().__init__(raiz)
+        self._firmas = {categoria: self._firmar(categoria) for categoria in self._categorias()}
+        self._proximo = time.monotonic() + INTERVALO_SONDEO
+
+    def _firmar(self, categoria):
+        firmas = {}
+        try:
+            with os.scandir(os.path.join(self.raiz, categoria)) as it:
+                for entry in it:
+                    if entry.is_file() and indice.es_archivo_factura(entry.name):
+                        st = entry.stat()
+                        firmas[entry.name] = (st.st_size, st.st_mtime_ns)
+        except FileNotFoundError:
+            pass
+        metricas.archivos_escaneados(len(firmas), "vigilante")
+        return firmas
+
+    def _esperar(self, espera):
+        restante = self._proximo - time.monotonic()
+        if espera is not None:
+            restante = min(restante, espera)
+        if restante > 0 and self._detener.wait(restante):
+            return
+        if time.monotonic() < self._proximo:
+            return
+        self._proximo = time.monotonic() + INTERVALO_SONDEO
+
+        anteriores = self._firmas
+        self._firmas = {}
+        for categoria in self._categorias():
+            actuales = self._firmar(categoria)
+            self._firmas[categoria] = actuales
+            if categoria not in anteriores:
+                self.cambios.anotar_categoria(categoria)
+                continue
+            previas = anteriores[categoria]
+            for archivo in previas.keys() ^ actuales.keys():
+                self.cambios.anotar(categoria, archivo)
+            for archivo, firma in actuales.items():
+                if archivo in previas and previas[archivo] != firma:
+                    self.cambios.anotar(categoria, archivo)
+
+
+def _crear(raiz):
+    if MODO in ("auto", "inotify") and sys.platform.startswith("linux"):
+        try:
+            return _Inotify(raiz)
+        except (OSError, AttributeError) as e:
+            if MODO == "inotify":
+                raise
+            print(f"Vigilante: inotify no disponible ({e}), se usa sondeo")
+    return _Sondeo(raiz)
+
+
+def iniciar(raiz=None):
+    """Arranca el vigilante (una sola vez). Devuelve el mecanismo usado o None."""
+    global _vigilante
+    if MODO == "no":
+        return None
+    raiz = raiz or indice.CARPETA_FACTURAS
+    global _candado
+    with _lock:
+        if _vigilante is None:
+            candado = archivos.Exclusivo("vigilante")
+            if not candado.tomado:
+                return None
+            try:
+                os.makedirs(raiz, exist_ok=True)
+                _vigilante = _crear(raiz)
+                _vigilante.iniciar()
+            except BaseException:
+                _vigilante = None
+                candado.soltar()
+                raise
+            _candado = candado
+            indice.confiar_en_vigilante(True)
+        return _vigilante.nombre
+
+
+def detener():
+    global _vigilante
+    with _lock:
+        if _vigilante is None:
+            return
+        indice.confiar_en_vigilante(False)
+        _vigilante.detener()
+        _vigilante = None
+        _candado.soltar()
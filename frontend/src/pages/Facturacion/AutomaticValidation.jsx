@@ -502,7 +502,7 @@ const AutomaticValidation = ({ categoria, title }) => {
                     <input
                         type="file"
                         multiple
-                        accept=".pdf"
+                        accept=".pdf,.xml"
                         ref={fileInputRef}
                         style={{ display: 'none' }}
                         onChange={handleUpload}